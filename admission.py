@@ -0,0 +1,176 @@
+"""
+Adaptive admission control
+
+Tracks in-flight requests per gunicorn worker and adapts a concurrency
+limit from scoring latency, in the style of the gradient limiters used for
+service load shedding:
+
+    gradient  = clamp(tolerance * baseline_rtt / recent_rtt, 0.5, 1.0)
+    new_limit = limit * gradient + sqrt(limit)
+
+baseline_rtt is the lowest latency seen over the last few minutes (the
+latency without queueing) and recent_rtt a fast moving average. Only
+single-row /predict calls that ran the model are sampled: cache hits and
+batches take very different times and would set a baseline the model can
+never meet. While
+recent latency stays within `tolerance` of the baseline the sqrt(limit)
+term grows the limit; once requests queue behind each other recent_rtt
+rises and the limit is cut multiplicatively. The limit only moves while
+at least half of it is in use, so slow requests on an idle worker, which
+are not queueing, cannot shrink it. Requests over the limit are
+rejected at once with 429 and Retry-After, rather than queueing until the
+client times out and retries.
+
+Each priority class may only fill its share of the limit, so analytics and
+docs traffic is shed well before scoring traffic.
+
+Latency is measured from when a worker thread picks the request up, so it
+excludes time spent waiting in gunicorn's accept queue. A worker never has
+more requests in flight than it has threads, so the limit should be capped
+at the thread count: above that the controller cannot see the queueing it
+is meant to prevent.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+# Share of the concurrency limit each class may occupy, highest priority first
+PRIORITY_SHARES = {'scoring': 1.0, 'analytics': 0.5, 'docs': 0.25}
+# Seconds clients of each class are asked to wait before retrying
+RETRY_AFTER = {'scoring': 1, 'analytics': 5, 'docs': 10}
+
+
+class AdmissionController:
+    """Concurrency limit driven by scoring latency, with priority classes"""
+
+    def __init__(self, initial_limit=8, min_limit=2, max_limit=64, tolerance=2.0,
+                 smoothing=0.2, recent_window=10, baseline_seconds=60, baseline_buckets=10):
+        """
+        Args:
+            initial_limit: Concurrent requests allowed before any latency is seen
+            min_limit, max_limit: Bounds for the adaptive limit
+            tolerance: How far recent latency may rise over the baseline before
+                the limit is cut (2.0 = may double)
+            smoothing: Weight of each new limit estimate (0-1)
+            recent_window: Samples averaged by the recent latency EWMA
+            baseline_seconds, baseline_buckets: The baseline is the minimum
+                latency over baseline_buckets periods of baseline_seconds
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_seconds = baseline_seconds
+        self._alpha = 2 / (recent_window + 1)
+        self._lock = threading.Lock()
+        self._limit = float(initial_limit)
+        self._recent_rtt = None
+        self._bucket_minima = deque(maxlen=baseline_buckets)
+        self._bucket_started = None
+        self._gradient = 1.0
+        self._last_sample_at = None
+        self._in_flight = 0
+        self._in_flight_by_class = dict.fromkeys(PRIORITY_SHARES, 0)
+        self._admitted = dict.fromkeys(PRIORITY_SHARES, 0)
+        self._rejected = dict.fromkeys(PRIORITY_SHARES, 0)
+        self._last_rejected_at = None
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def _class_capacity(self, priority):
+        return max(1, int(self._limit * PRIORITY_SHARES[priority]))
+
+    def try_acquire(self, priority):
+        """Admit a request of the given class, or return False to shed it"""
+        with self._lock:
+            if self._in_flight >= self._class_capacity(priority):
+                self._rejected[priority] += 1
+                self._last_rejected_at = time.time()
+                return False
+            self._in_flight += 1
+            self._in_flight_by_class[priority] += 1
+            self._admitted[priority] += 1
+            return True
+
+    def release(self, priority, latency=None):
+        """Finish an admitted request; scoring latencies (seconds) adapt the limit"""
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            self._in_flight_by_class[priority] -= 1
+            if priority == 'scoring' and latency is not None:
+                self._update(latency, in_flight)
+
+    def _baseline(self, rtt):
+        """Minimum latency over the recent buckets, including this sample"""
+        now = time.monotonic()
+        if self._bucket_started is None or now - self._bucket_started >= self.baseline_seconds:
+            self._bucket_minima.append(rtt)
+            self._bucket_started = now
+        elif rtt < self._bucket_minima[-1]:
+            self._bucket_minima[-1] = rtt
+        return min(self._bucket_minima)
+
+    def _update(self, rtt, in_flight):
+        baseline = self._baseline(rtt)
+        self._last_sample_at = time.monotonic()
+        if self._recent_rtt is None:
+            self._recent_rtt = rtt
+        self._recent_rtt += self._alpha * (rtt - self._recent_rtt)
+
+        self._gradient = max(0.5, min(1.0, self.tolerance * baseline / self._recent_rtt))
+        # While most of the limit is unused nothing is queueing: slow samples
+        # are not a reason to cut it, nor fast ones to raise it
+        if in_flight < self._limit / 2:
+            return
+        estimate = self._limit * self._gradient + math.sqrt(self._limit)
+        limit = self._limit * (1 - self.smoothing) + estimate * self.smoothing
+        self._limit = max(self.min_limit, min(self.max_limit, limit))
+
+    def under_pressure(self, recent_seconds=5):
+        """
+        Whether interactive scoring needs the CPU: half the scoring capacity is
+        in use, or scoring latency rose above tolerance in the last few seconds
+
+        Background work (scoring jobs) checks this before taking more CPU.
+        """
+        with self._lock:
+            if self._in_flight_by_class['scoring'] * 2 >= self._class_capacity('scoring'):
+                return True
+            recent = (self._last_sample_at is not None
+                      and time.monotonic() - self._last_sample_at < recent_seconds)
+            return recent and self._gradient < 1.0
+
+    def retry_after(self, priority):
+        return RETRY_AFTER[priority]
+
+    def describe(self):
+        """Controller state for tuning"""
+        with self._lock:
+            return {
+                'limit': round(self._limit, 2),
+                'in_flight': self._in_flight,
+                'in_flight_by_class': dict(self._in_flight_by_class),
+                'class_capacity': {p: self._class_capacity(p) for p in PRIORITY_SHARES},
+                'latency_ms': {
+                    'recent': round(self._recent_rtt * 1000, 2) if self._recent_rtt is not None else None,
+                    'baseline': round(min(self._bucket_minima) * 1000, 2) if self._bucket_minima else None,
+                },
+                'gradient': round(self._gradient, 3),
+                'admitted': dict(self._admitted),
+                'rejected': dict(self._rejected),
+                'last_rejected_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self._last_rejected_at))
+                if self._last_rejected_at else None,
+                'config': {
+                    'min_limit': self.min_limit,
+                    'max_limit': self.max_limit,
+                    'tolerance': self.tolerance,
+                    'smoothing': self.smoothing,
+                    'priority_shares': PRIORITY_SHARES,
+                    'retry_after': RETRY_AFTER,
+                },
+            }
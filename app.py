@@ -1,120 +1,241 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g, send_file
 import pandas as pd
 import numpy as np
-import pickle
 import os
 import markdown
 from markupsafe import Markup
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import threading
-from collections import deque
 import traceback
+import hmac
+import time
+import zlib
+import atexit
+from scoring import (FEATURE_NAMES, TIERS, TIER_DESCRIPTIONS, EMPLOYEE_RANGES, EMPLOYEE_RANGE_BOUNDS, assign_tier,
+                     normalize_field_names, build_features, get_employee_count, score_frame)
+from model_registry import ModelRegistry
+from inference_threads import ThreadPolicy
+from shadow import ShadowScorer
+from prediction_log import PredictionRingBuffer, to_epoch_us
+from history_store import HistoryStore, EMPLOYEE_BANDS
+from drift import DriftMonitor, reference_from_model, unavailable_reference
+from admission import AdmissionController
+from prediction_cache import PredictionCache, CacheWarmer, feature_key
+from rollups import RollupStore, summarize
+from serialization import (JSON, MSGPACK, ARROW, REQUIRED_PACKAGE, WireFormatError, available, request_format,
+                           response_format, pack, unpack, read_arrow, arrow_features, arrow_results, feature_dicts)
+from profiler import Profiler
+from jobs import JobManager, UPLOAD_FORMATS, FINISHED
 
 app = Flask(__name__)
 
-# Load model at startup
-with open('tapcheck_v4_model.pkl', 'rb') as f:
-    model = pickle.load(f)
+# Load model at startup - later versions can be hot-swapped via /admin/model/load
+MODEL_PATH = os.environ.get('MODEL_PATH', 'tapcheck_v4_model.pkl')
+MODEL_DIR = os.path.dirname(os.path.abspath(MODEL_PATH))
+parity_tolerance = os.environ.get('MODEL_PARITY_TOLERANCE')
+
+# OpenMP/BLAS thread budgets for inference, so workers don't oversubscribe the cores
+batch_threads = os.environ.get('INFERENCE_BATCH_THREADS')
+inference_threads = ThreadPolicy(
+    batch_threads=int(batch_threads) if batch_threads else None,
+    job_threads=int(os.environ.get('INFERENCE_JOB_THREADS', 1)),
+    batch_min_rows=int(os.environ.get('INFERENCE_BATCH_MIN_ROWS', 100)),
+    blas_threads=int(os.environ.get('INFERENCE_BLAS_THREADS', 1))
+)
+
+model_registry = ModelRegistry(
+    pointer_file=os.environ.get('MODEL_POINTER_FILE', 'active_model.json'),
+    parity_tolerance=float(parity_tolerance) if parity_tolerance else None,
+    thread_policy=inference_threads
+)
+model_registry.load_initial(MODEL_PATH, os.environ.get('MODEL_VERSION'))
+model_registry.watch_pointer()
+
+# Candidate model scored in the background against live traffic
+shadow_scorer = ShadowScorer(queue_size=int(os.environ.get('SHADOW_QUEUE_SIZE', 2000)),
+                             thread_policy=inference_threads,
+                             pointer_file=os.environ.get('SHADOW_POINTER_FILE', 'shadow_model.json'))
+shadow_scorer.watch_pointer(model_registry.read_model)
+
+# Per-feature drift against the training distribution. A profile built from
+# training data (python drift.py --training-data ...) is used when present,
+# otherwise one is derived from the active model.
+DRIFT_REFERENCE_FILE = os.environ.get('DRIFT_REFERENCE_FILE', 'drift_reference.json')
+
+def model_drift_reference(active):
+    """Profile derived from the model, or an empty one if the model's layout is not understood"""
+    try:
+        return reference_from_model(active.model, active.version)
+    except Exception as e:
+        print(f"[drift] Could not derive a reference profile from {active.version}: {e}")
+        return unavailable_reference(active.version, str(e))
+
+def load_drift_reference(active):
+    if os.path.exists(DRIFT_REFERENCE_FILE):
+        with open(DRIFT_REFERENCE_FILE, 'r') as f:
+            return json.load(f)
+    return model_drift_reference(active)
+
+drift_monitor = DriftMonitor(
+    load_drift_reference(model_registry.active),
+    window_seconds=int(os.environ.get('DRIFT_WINDOW_SECONDS', 3600))
+)
+
+def refresh_drift_reference(active):
+    """A model-derived profile follows hot-swaps (counters restart with it)"""
+    if drift_monitor.reference['source'] != 'training_data':
+        drift_monitor.set_reference(model_drift_reference(active))
+
+model_registry.on_activate(refresh_drift_reference)
+
+# Largest number of accounts accepted by /predict-batch
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Shed excess load with fast 429s instead of queueing until clients time out
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'true').lower() == 'true'
+# Requests beyond the worker's threads wait in gunicorn's queue, unseen by the limiter
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+admission_max_limit = min(int(os.environ.get('ADMISSION_MAX_LIMIT', 64)), GUNICORN_THREADS)
+admission = AdmissionController(
+    initial_limit=min(int(os.environ.get('ADMISSION_INITIAL_LIMIT', 8)), admission_max_limit),
+    min_limit=min(int(os.environ.get('ADMISSION_MIN_LIMIT', 2)), admission_max_limit),
+    max_limit=admission_max_limit,
+    tolerance=float(os.environ.get('ADMISSION_LATENCY_TOLERANCE', 2.0))
+)
 
 # Initialize logging system
-LOG_FILE = 'api_predictions_log.json'
+LOG_FILE = os.environ.get('PREDICTION_LOG_FILE', 'api_predictions_log.json')
 MAX_LOG_SIZE = 10000  # Keep last 10k predictions
-prediction_log = deque(maxlen=MAX_LOG_SIZE)
-log_lock = threading.Lock()
+prediction_log = PredictionRingBuffer(MAX_LOG_SIZE)
 
 # Load existing logs on startup
 try:
     if os.path.exists(LOG_FILE):
         with open(LOG_FILE, 'r') as f:
             existing_logs = json.load(f)
-            prediction_log.extend(existing_logs[-MAX_LOG_SIZE:])  # Keep only recent ones
-        print(f"Loaded {len(prediction_log)} existing log entries")
+        # A malformed entry is skipped on its own rather than dropping the rest
+        skipped = 0
+        for entry in existing_logs[-MAX_LOG_SIZE:]:  # Keep only recent ones
+            try:
+                prediction_log.append_entry(entry)
+            except Exception:
+                skipped += 1
+        print(f"Loaded {len(prediction_log)} existing log entries (skipped {skipped} malformed)")
 except Exception as e:
     print(f"Could not load existing logs: {e}")
 
-def normalize_field_names(data):
-    """Normalize field names to handle both snake_case and Title Case formats"""
-    # Mapping from various formats to expected format
-    field_mappings = {
-        # snake_case to Title Case
-        'global_employees': 'Global Employees',
-        'eligible_employees': 'Eligible Employees',
-        'predicted_eligible_employees': 'Predicted Eligible Employees',
-        'revenue_in_last_30_days': 'Revenue in Last 30 Days',
-        'territory': 'Territory',
-        'industry': 'Industry',
-        'billing_state_province': 'Billing State/Province',
-        'type': 'Type',
-        'vertical': 'Vertical',
-        'are_they_using_a_competitor': 'Are they using a Competitor?',
-        'web_technologies': 'Web Technologies',
-        'company_payroll_software': 'Company Payroll Software',
-        'marketing_source': 'Marketing Source',
-        'strategic_account': 'Strategic Account',
-        # Also handle exact matches (case-insensitive)
-        'billing state/province': 'Billing State/Province',
-        'are they using a competitor?': 'Are they using a Competitor?',
-    }
-    
-    # Create normalized data dictionary
-    normalized = {}
-    
-    # First, copy over any fields that are already in the correct format
-    for key, value in data.items():
-        normalized[key] = value
-    
-    # Then, check for fields that need to be mapped
-    for key, value in data.items():
-        # Check direct mapping (case-insensitive)
-        lower_key = key.lower()
-        if lower_key in field_mappings:
-            correct_key = field_mappings[lower_key]
-            normalized[correct_key] = value
-        # Also handle case where it's already correct but different case
-        elif key.lower() in [k.lower() for k in field_mappings.values()]:
-            # Find the correct casing
-            for correct_key in field_mappings.values():
-                if key.lower() == correct_key.lower():
-                    normalized[correct_key] = value
-                    break
-    
-    return normalized
+# Full prediction history, persisted as day-partitioned column files
+retention_days = os.environ.get('HISTORY_RETENTION_DAYS')
+history_store = HistoryStore(
+    os.environ.get('HISTORY_DIR', 'prediction_history'),
+    flush_rows=int(os.environ.get('HISTORY_FLUSH_ROWS', 5000)),
+    flush_interval=float(os.environ.get('HISTORY_FLUSH_INTERVAL', 300)),
+    retention_days=int(retention_days) if retention_days else None
+)
+history_store.start()
+
+# Per-minute tier and probability rollups, folded into hours and days
+rollup_store = RollupStore(
+    os.environ.get('ROLLUP_DIR', 'prediction_rollups'),
+    flush_interval=float(os.environ.get('ROLLUP_FLUSH_INTERVAL', 60))
+)
+rollup_store.start()
+
+
+def flush_stores():
+    """Write unflushed history rows and rollups when the worker exits"""
+    for name, flush in (('history', history_store.flush), ('rollups', rollup_store.save)):
+        try:
+            flush()
+        except Exception as e:
+            print(f"[{name}] Flush on exit failed: {e}")
+
+
+atexit.register(flush_stores)
+
+# Scores of recently seen feature vectors, preloaded from history after boot
+prediction_cache = PredictionCache(int(os.environ.get('PREDICTION_CACHE_SIZE', 20000)))
+cache_warmer = CacheWarmer(
+    prediction_cache, model_registry,
+    max_vectors=int(os.environ.get('CACHE_WARMUP_MAX_VECTORS', 5000)),
+    time_budget=float(os.environ.get('CACHE_WARMUP_SECONDS', 60)),
+    memory_budget_mb=float(os.environ.get('CACHE_WARMUP_MAX_MB', 50)),
+    thread_policy=inference_threads
+)
+
+profiler = Profiler()
+
+# Scoring jobs run in a process pool that yields to interactive scoring
+job_manager = JobManager(
+    os.environ.get('JOB_DIR', 'scoring_jobs'),
+    os.environ.get('JOB_INPUT_DIR', 'job_inputs'),
+    processes=int(os.environ.get('JOB_PROCESSES', max(1, (os.cpu_count() or 2) // 2))),
+    max_concurrent=int(os.environ.get('JOB_MAX_CONCURRENT', 1)),
+    max_queued=int(os.environ.get('JOB_MAX_QUEUED', 10)),
+    shard_size=int(os.environ.get('JOB_SHARD_SIZE', 5000)),
+    nice=int(os.environ.get('JOB_NICE', 10)),
+    retention_hours=float(os.environ.get('JOB_RETENTION_HOURS', 72)),
+    threads=inference_threads.job_threads,
+    pressure=admission.under_pressure if ADMISSION_CONTROL else None
+)
+
+def logged_features():
+    """Feature dicts from the in-memory log, newest first (read lazily, off the startup path)"""
+    for entry in reversed(prediction_log.entries()):
+        yield entry['all_features_used']
+
+if os.environ.get('CACHE_WARMUP', 'true').lower() == 'true':
+    # Columnar history first; the JSON log loaded above covers deployments without it
+    cache_warmer.start(history_store.iter_recent_features(), logged_features())
+
+log_save_lock = threading.Lock()
+log_save_requested = threading.Event()
 
 def save_logs():
     """Save logs to file"""
-    try:
-        with log_lock:
-            with open(LOG_FILE, 'w') as f:
-                json.dump(list(prediction_log), f)
-    except Exception as e:
-        print(f"Error saving logs: {e}")
+    with log_save_lock:
+        try:
+            # Materialize outside the buffer lock so logging is never blocked on disk
+            entries = prediction_log.entries()
+            tmp = LOG_FILE + '.tmp'
+            with open(tmp, 'w') as f:
+                # One dumps() call is much faster than json.dump's chunked writes
+                f.write(json.dumps(entries))
+            # Readers (and the next startup) only ever see a complete file
+            os.replace(tmp, LOG_FILE)
+        except Exception as e:
+            print(f"Error saving logs: {e}")
+
+def log_flusher():
+    """Single background writer; saves requested while it is writing are folded into the next one"""
+    while True:
+        log_save_requested.wait()
+        log_save_requested.clear()
+        save_logs()
+
+threading.Thread(target=log_flusher, daemon=True).start()
 
 def log_prediction(request_data, response_data, employee_count, features_dict=None):
     """Log a prediction request and response"""
-    log_entry = {
-        'timestamp': datetime.utcnow().isoformat(),
-        'request_from_clay': {
-            'global_employees': request_data.get('Global Employees'),
-            'eligible_employees': request_data.get('Eligible Employees'),
-            'industry': request_data.get('Industry'),
-            'territory': request_data.get('Territory'),
-            'type': request_data.get('Type')
-        },
-        'all_features_used': features_dict if features_dict else {},
-        'response': {
-            'probability': response_data['probability_closed_won'],
-            'tier': response_data['tier'],
-            'employee_count': employee_count
-        }
-    }
-    
-    with log_lock:
-        prediction_log.append(log_entry)
+    record = (
+        to_epoch_us(datetime.utcnow()),
+        features_dict if features_dict else request_data,
+        response_data['probability_closed_won'],
+        response_data['tier'],
+        employee_count,
+        response_data.get('model_version')
+    )
+    seq = prediction_log.append(*record)
+    history_store.append(*record)
+    rollup_store.observe(record[0], record[2], record[3], employee_count)
     
-    # Save periodically (every 10 predictions)
-    if len(prediction_log) % 10 == 0:
-        threading.Thread(target=save_logs).start()
+    # Save periodically (every 10 predictions); just a flag for the flusher thread
+    if seq % 10 == 9:
+        log_save_requested.set()
 
 def clean_value(value, default=None, field_name=None):
     """Clean incoming values, treating hyphens as null/missing"""
@@ -273,6 +394,68 @@ def render_markdown_as_html(markdown_file):
     except Exception as e:
         return f"<h1>Error loading documentation</h1><p>{str(e)}</p>"
 
+def request_priority(path):
+    """Admission class for a request path; None for paths that are never shed"""
+    if path in ('/health', '/analytics/admission'):
+        return None
+    if path.startswith('/predict'):
+        return 'scoring'
+    if path.startswith(('/analytics/', '/admin/', '/debug/', '/jobs')):
+        return 'analytics'
+    return 'docs'
+
+@app.before_request
+def admit_request():
+    if not ADMISSION_CONTROL:
+        return None
+    priority = request_priority(request.path)
+    if priority is None:
+        return None
+    if not admission.try_acquire(priority):
+        response = jsonify({'error': 'Server busy, retry later', 'status': 'overloaded'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(admission.retry_after(priority))
+        return response
+    g.admission = (priority, time.perf_counter())
+    return None
+
+@app.before_request
+def start_request_profile():
+    if profiler.active and not request.path.startswith('/debug/'):
+        g.profile = (profiler.request_started(f'{request.method} {request.path}'),)
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    admitted = g.pop('admission', None)
+    if admitted is None:
+        return
+    priority, started = admitted
+    # Failed requests say little about capacity; only successful single-row
+    # model calls feed the latency estimate (cache hits and batches would skew it)
+    ok = exc is None and g.get('response_status', 500) < 500 and g.pop('admission_sample', False)
+    admission.release(priority, time.perf_counter() - started if ok else None)
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profiled = g.pop('profile', None)
+    if profiled is not None:
+        profiler.request_finished(profiled[0])
+
+@app.route('/analytics/cache', methods=['GET'])
+def cache_status():
+    """Prediction cache statistics and warm-up progress"""
+    return jsonify({'cache': prediction_cache.describe(), 'warmup': cache_warmer.status})
+
+@app.route('/analytics/admission', methods=['GET'])
+def admission_status():
+    """Admission controller state, for tuning the limits"""
+    return jsonify(dict(admission.describe(), enabled=ADMISSION_CONTROL))
+
 @app.route('/')
 def index():
     """Serve the README as the landing page"""
@@ -305,10 +488,72 @@ def assign_tier_dynamic(proba, thresholds):
     # This function would use the calculated thresholds to assign tiers
     return None
 
+def build_prediction(features, proba, model_version):
+    """Turn a model probability into the /predict response body"""
+    employees = get_employee_count(features)
+    
+    # Assign tier based on employee count and quartiles
+    # Use dynamic thresholds based on recent predictions if available
+    dynamic_thresholds = get_dynamic_tier_thresholds(employees)
+    
+    if dynamic_thresholds:
+        # Use dynamic thresholds from recent predictions
+        tier = assign_tier_dynamic(proba, dynamic_thresholds)
+    else:
+        tier = assign_tier(proba, employees)
+    
+    # Get simple explanation factors
+    explanation = get_simple_explanation(features, proba, tier)
+    
+    response_data = {
+        'probability_closed_won': round(proba, 4),
+        'tier': tier,
+        'tier_description': TIER_DESCRIPTIONS[tier],
+        'employee_count': int(employees),
+        'explanation': explanation,
+        'model_version': model_version,
+        'status': 'success'
+    }
+    return response_data, employees
+
+def record_prediction(data, features, proba, response_data, employees):
+    """Side effects shared by the scoring endpoints once a row has been scored"""
+    # Log with all features that were actually used
+    log_prediction(data, response_data, employees, features)
+    
+    # Hand the row to the candidate model, if one is being shadowed
+    shadow_scorer.submit(features, proba, response_data['tier'], employees,
+                         response_data['model_version'])
+
+def read_scoring_request(allowed):
+    """Decode the body per its Content-Type and negotiate the response format"""
+    fmt = request_format(request.content_type, allowed)
+    g.response_format = response_format(request.accept_mimetypes, fmt, allowed)
+    if fmt == MSGPACK:
+        return fmt, unpack(request.get_data())
+    if fmt == ARROW:
+        return fmt, read_arrow(request.get_data())
+    return fmt, request.get_json()
+
+def respond(body, status=200):
+    """Encode a scoring response in the negotiated format (JSON unless asked otherwise)"""
+    fmt = g.get('response_format', JSON)
+    if fmt == MSGPACK:
+        return Response(pack(body), status=status, mimetype=MSGPACK)
+    if fmt == ARROW and 'predictions' in body:
+        metadata = {'count': body['count'], 'errors': body['errors']}
+        return Response(arrow_results(body['predictions'], metadata), status=status, mimetype=ARROW)
+    return jsonify(body), status
+
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        data = request.get_json()
+        try:
+            _, data = read_scoring_request((JSON, MSGPACK))
+        except WireFormatError as e:
+            return jsonify({'error': str(e)}), e.status
+        if not isinstance(data, dict):
+            return respond({'error': 'Expected a single account object'}, 400)
         
         # Normalize field names to handle both snake_case and Title Case
         data = normalize_field_names(data)
@@ -317,89 +562,128 @@ def predict():
         required = ['Global Employees']
         for field in required:
             if field not in data:
-                return jsonify({'error': f'Missing: {field}'}), 400
+                return respond({'error': f'Missing: {field}'}, 400)
         
-        # Prepare features WITHOUT preprocessing - let the model's pipeline handle it
-        # The model expects these exact column names in this order
-        feature_names = [
-            'Territory', 'Industry', 'Billing State/Province', 'Type', 'Vertical',
-            'Are they using a Competitor?', 'Web Technologies', 'Company Payroll Software',
-            'Marketing Source', 'Strategic Account',
-            'Global Employees', 'Eligible Employees', 'Predicted Eligible Employees',
-            'Revenue in Last 30 Days'
-        ]
-        
-        # Create raw feature dict - handle missing fields like pandas CSV reader
-        features = {}
-        for feature in feature_names:
-            if feature in data:
-                value = data[feature]
-                # Treat empty strings as NaN (like pandas does with CSV)
-                if isinstance(value, str) and value.strip() == "":
-                    features[feature] = np.nan
-                else:
-                    features[feature] = value
-            else:
-                # Missing fields become NaN, just like pandas reads empty CSV cells
-                features[feature] = np.nan
-        
-        # Create DataFrame with proper column order
-        df = pd.DataFrame([features], columns=feature_names)
+        features = build_features(data)
+        # Counted before scoring so inputs the model rejects still show up as drift
+        drift_monitor.observe(features)
         
-        # Make prediction - model's pipeline will handle imputation and encoding
-        proba = model.predict_proba(df)[0][1]
+        # The version is pinned so a concurrent hot-swap can't change it mid-request
+        key = feature_key(features)
+        with model_registry.acquire() as active:
+            proba = prediction_cache.get(active.version, key)
+            if proba is None:
+                # Create DataFrame with proper column order
+                df = pd.DataFrame([features], columns=FEATURE_NAMES)
+                
+                # Make prediction - model's pipeline will handle imputation and encoding
+                inference_threads.for_rows(1)
+                proba = score_frame(active.model, df)[0]
+                if isinstance(proba, Exception):
+                    raise proba
+                prediction_cache.put(active.version, key, proba)
+                # Only one-row model calls are comparable enough to drive the admission limit
+                g.admission_sample = True
         
-        # Determine employee count for tier assignment
-        eligible = features.get('Eligible Employees')
-        global_emp = features.get('Global Employees')
+        response_data, employees = build_prediction(features, proba, active.version)
+        record_prediction(data, features, proba, response_data, employees)
         
-        # Use eligible if available and not None/0, otherwise use global
-        if eligible and eligible > 0:
-            employees = eligible
-        elif global_emp and global_emp > 0:
-            employees = global_emp
-        else:
-            employees = 0
+        return respond(response_data)
         
-        # Assign tier based on employee count and quartiles
-        # Use dynamic thresholds based on recent predictions if available
-        dynamic_thresholds = get_dynamic_tier_thresholds(employees)
+    except Exception as e:
+        return respond({'error': str(e)}, 500)
+
+def score_feature_rows(feature_rows, frame=None):
+    """
+    Probabilities for a list of feature dicts, from the cache or one vectorized model call
+    
+    `frame` may already hold the same rows as a model-ready DataFrame. Rows
+    the model rejects come back as the exception instead of a probability.
+    Returns the probabilities and the model version that produced them.
+    """
+    keys = [feature_key(features) for features in feature_rows]
+    with model_registry.acquire() as active:
+        probas = [prediction_cache.get(active.version, key) for key in keys]
+        misses = [j for j, proba in enumerate(probas) if proba is None]
+        if misses:
+            if frame is None:
+                df = pd.DataFrame([feature_rows[j] for j in misses], columns=FEATURE_NAMES)
+            else:
+                df = frame if len(misses) == len(frame) else frame.iloc[misses]
+            inference_threads.for_rows(len(df))
+            scored = score_frame(active.model, df)
+            for j, proba in zip(misses, scored):
+                probas[j] = proba
+                if not isinstance(proba, Exception):
+                    prediction_cache.put(active.version, keys[j], proba)
+    return probas, active.version
+
+@app.route('/predict-batch', methods=['POST'])
+def predict_batch():
+    """Score many accounts in one request with a single vectorized model call"""
+    try:
+        try:
+            fmt, data = read_scoring_request((JSON, MSGPACK, ARROW))
+        except WireFormatError as e:
+            return jsonify({'error': str(e)}), e.status
         
-        if dynamic_thresholds:
-            # Use dynamic thresholds from recent predictions
-            tier = assign_tier_dynamic(proba, dynamic_thresholds)
+        frame = None
+        if fmt == ARROW:
+            # Columnar batch: one row per account, straight into a DataFrame
+            if data.num_rows > MAX_BATCH_SIZE:
+                return respond({'error': f'Batch too large: {data.num_rows} accounts (max {MAX_BATCH_SIZE})'}, 413)
+            if 'Global Employees' not in normalize_field_names(dict.fromkeys(data.column_names)):
+                return respond({'error': 'Missing: Global Employees'}, 400)
+            frame = arrow_features(data, normalize_field_names)
+            results = [None] * len(frame)
+            rows = []
+            for i, features in enumerate(feature_dicts(frame)):
+                drift_monitor.observe(features)
+                rows.append((i, features, features))
         else:
-            # Updated thresholds based on 120,195 accounts (July 14, 2025)
-            if employees >= 3000:
-                tier = 'A' if proba > 0.1237 else 'B' if proba > 0.0534 else 'C' if proba > 0.0419 else 'D'
-            elif employees >= 1000:
-                tier = 'A' if proba > 0.0825 else 'B' if proba > 0.0499 else 'C' if proba > 0.0117 else 'D'
-            elif employees >= 300:
-                tier = 'A' if proba > 0.1296 else 'B' if proba > 0.0552 else 'C' if proba > 0.0334 else 'D'
-            elif employees >= 100:
-                tier = 'A' if proba > 0.2002 else 'B' if proba > 0.0865 else 'C' if proba > 0.0534 else 'D'
-            else:
-                tier = 'A' if proba > 0.2638 else 'B' if proba > 0.1307 else 'C' if proba > 0.0577 else 'D'
+            accounts = data.get('accounts') if isinstance(data, dict) else data
+            if not isinstance(accounts, list):
+                return respond({'error': 'Expected a list or {"accounts": [...]}'}, 400)
+            if len(accounts) > MAX_BATCH_SIZE:
+                return respond({'error': f'Batch too large: {len(accounts)} accounts (max {MAX_BATCH_SIZE})'}, 413)
+            
+            results = [None] * len(accounts)
+            rows = []
+            for i, account in enumerate(accounts):
+                if not isinstance(account, dict):
+                    results[i] = {'error': 'Account must be an object', 'status': 'error'}
+                    continue
+                account = normalize_field_names(account)
+                if 'Global Employees' not in account:
+                    results[i] = {'error': 'Missing: Global Employees', 'status': 'error'}
+                    continue
+                features = build_features(account)
+                drift_monitor.observe(features)
+                rows.append((i, account, features))
         
-        # Get simple explanation factors
-        explanation = get_simple_explanation(features, proba, tier)
+        if rows:
+            probas, version = score_feature_rows([features for _, _, features in rows], frame)
+            for (i, account, features), proba in zip(rows, probas):
+                if isinstance(proba, Exception):
+                    results[i] = {'error': str(proba), 'status': 'error'}
+                    continue
+                try:
+                    response_data, employees = build_prediction(features, proba, version)
+                    record_prediction(account, features, proba, response_data, employees)
+                except Exception as e:
+                    results[i] = {'error': str(e), 'status': 'error'}
+                    continue
+                results[i] = response_data
         
-        response_data = {
-            'probability_closed_won': round(proba, 4),
-            'tier': tier,
-            'tier_description': {'A': 'Top 25%', 'B': 'High', 'C': 'Medium', 'D': 'Low'}[tier],
-            'employee_count': int(employees),
-            'explanation': explanation,
+        return respond({
+            'count': len(results),
+            'errors': sum(1 for r in results if r['status'] == 'error'),
+            'predictions': results,
             'status': 'success'
-        }
-        
-        # Log with all features that were actually used
-        log_prediction(data, response_data, employees, features)
-        
-        return jsonify(response_data)
+        })
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return respond({'error': str(e)}, 500)
 
 @app.route('/predict-raw', methods=['POST'])
 def predict_raw():
@@ -416,18 +700,9 @@ def predict_raw():
             if field not in data:
                 return jsonify({'error': f'Missing: {field}'}), 400
         
-        # Feature names expected by model
-        feature_names = [
-            'Territory', 'Industry', 'Billing State/Province', 'Type', 'Vertical',
-            'Are they using a Competitor?', 'Web Technologies', 'Company Payroll Software',
-            'Marketing Source', 'Strategic Account',
-            'Global Employees', 'Eligible Employees', 'Predicted Eligible Employees',
-            'Revenue in Last 30 Days'
-        ]
-        
         # Create raw feature dict - NO PREPROCESSING
         features = {}
-        for feature in feature_names:
+        for feature in FEATURE_NAMES:
             if feature in data:
                 value = data[feature]
                 # Only include if not None
@@ -443,18 +718,21 @@ def predict_raw():
                         features[feature] = value
         
         # Create DataFrame with proper column order
-        df = pd.DataFrame([features], columns=feature_names)
+        df = pd.DataFrame([features], columns=FEATURE_NAMES)
         
         # Make prediction - model's pipeline will handle everything
-        proba = model.predict_proba(df)[0][1]
+        inference_threads.for_rows(1)
+        with model_registry.acquire() as active:
+            proba = active.model.predict_proba(df)[0][1]
         
         response_data = {
             'probability_closed_won': round(proba, 4),
             'debug_info': {
-                'features_received': len([k for k in data if k in feature_names]),
+                'features_received': len([k for k in data if k in FEATURE_NAMES]),
                 'features_used': len(features),
                 'numeric_features': {k: v for k, v in features.items() if k in ['Global Employees', 'Eligible Employees']}
             },
+            'model_version': active.version,
             'status': 'success'
         }
         
@@ -465,7 +743,64 @@ def predict_raw():
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'healthy', 'model': 'tapcheck_v4'})
+    active = model_registry.active
+    return jsonify({
+        'status': 'healthy',
+        'model': active.version,
+        'model_loaded_at': active.loaded_at,
+        'inference_threads': inference_threads.describe()
+    })
+
+def check_admin_token():
+    """Return an error response unless the request carries the admin token"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(supplied, ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+def resolve_model_path(path):
+    """Only allow pickles from the model directory to be loaded"""
+    full_path = os.path.abspath(os.path.join(MODEL_DIR, path))
+    if os.path.dirname(full_path) != MODEL_DIR or not full_path.endswith('.pkl'):
+        raise ValueError('Model path must be a .pkl file in the model directory')
+    if not os.path.exists(full_path):
+        raise ValueError(f'Model file not found: {path}')
+    return full_path
+
+@app.route('/admin/model', methods=['GET'])
+def model_status():
+    """Show the active model version, versions still draining and the last load"""
+    error = check_admin_token()
+    if error:
+        return error
+    return jsonify(model_registry.describe())
+
+@app.route('/admin/model/load', methods=['POST'])
+def load_model():
+    """Load a new model version in the background and swap it in when ready"""
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        data = request.get_json() or {}
+        if 'path' not in data:
+            return jsonify({'error': 'Missing: path'}), 400
+        path = resolve_model_path(data['path'])
+        tolerance = data.get('parity_tolerance')
+        started = model_registry.load_async(
+            path,
+            version=data.get('version'),
+            tolerance=float(tolerance) if tolerance is not None else None
+        )
+        if not started:
+            return jsonify({'error': 'A model load is already in progress'}), 409
+        return jsonify({'status': 'loading', 'load': model_registry.load_status}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 def get_simple_explanation(features, proba, tier):
     """Generate simple list of factors affecting the prediction"""
@@ -473,7 +808,7 @@ def get_simple_explanation(features, proba, tier):
     factors = []
     
     # Employee size
-    employees = features.get('Eligible Employees', 0) or features.get('Global Employees', 0) or 0
+    employees = get_employee_count(features)
     if employees > 3000:
         factors.append(f'Large enterprise ({employees:,.0f} employees)')
     elif employees > 1000:
@@ -569,74 +904,280 @@ def get_simple_explanation(features, proba, tier):
     
     return factors
 
+@app.route('/admin/shadow', methods=['POST'])
+def start_shadow():
+    """Load a candidate model and start scoring live traffic with it in the background"""
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        data = request.get_json() or {}
+        if 'path' not in data:
+            return jsonify({'error': 'Missing: path'}), 400
+        path = resolve_model_path(data['path'])
+        sample_rate = float(data.get('sample_rate', 1.0))
+        if not 0 < sample_rate <= 1:
+            return jsonify({'error': 'sample_rate must be between 0 and 1'}), 400
+        
+        # Every worker picks the pointer up; this one loads it right away
+        shadow_scorer.publish(path, data.get('version'), sample_rate)
+        threading.Thread(target=shadow_scorer.sync, args=(model_registry.read_model,), daemon=True).start()
+        return jsonify({'status': 'loading', 'path': data['path']}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/shadow', methods=['DELETE'])
+def stop_shadow():
+    """Stop shadow scoring; collected comparison stats are kept"""
+    error = check_admin_token()
+    if error:
+        return error
+    shadow_scorer.retract()
+    shadow_scorer.sync(model_registry.read_model)
+    return jsonify({'status': 'stopped'})
+
+@app.route('/analytics/shadow-comparison', methods=['GET'])
+def shadow_comparison():
+    """Compare the primary and candidate models on shadowed traffic"""
+    try:
+        recent = min(request.args.get('recent', 0, type=int), 1000)
+        return jsonify(shadow_scorer.report(recent))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analytics/drift', methods=['GET'])
+def feature_drift():
+    """Per-feature drift of live inputs against the training distribution"""
+    try:
+        window = request.args.get('window', 'current')
+        if window not in ('current', 'previous', 'lifetime'):
+            return jsonify({'error': 'window must be current, previous or lifetime'}), 400
+        
+        report = drift_monitor.report(window, min_count=request.args.get('min_count', 100, type=int))
+        if request.args.get('histograms', 'false').lower() != 'true':
+            for feature in report['features'].values():
+                feature.pop('histogram', None)
+        return jsonify(report)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Removed get_prediction_explanation - using simplified get_simple_explanation instead
 
 # Removed /predict-with-explanation - consolidated into /predict
 
+@app.route('/debug/profile', methods=['POST'])
+def start_profile():
+    """Profile this worker for the next N requests or T seconds"""
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        data = request.get_json(silent=True) or {}
+        requests_limit = data.get('requests')
+        started = profiler.start(
+            mode=data.get('mode', 'sample'),
+            seconds=float(data.get('seconds', 30)),
+            requests=int(requests_limit) if requests_limit is not None else None,
+            interval_ms=float(data.get('interval_ms', 10)),
+            all_threads=bool(data.get('all_threads', False))
+        )
+        if not started:
+            return jsonify({'error': 'A profiling session is already running', 'profile': profiler.status()}), 409
+        return jsonify({'status': 'profiling', 'profile': profiler.status()}), 202
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/debug/profile', methods=['GET'])
+def profile_status():
+    """State of the current or last profiling session"""
+    error = check_admin_token()
+    if error:
+        return error
+    return jsonify(profiler.status())
+
+@app.route('/debug/profile', methods=['DELETE'])
+def stop_profile():
+    """End the running profiling session early; its result is kept"""
+    error = check_admin_token()
+    if error:
+        return error
+    profiler.stop()
+    return jsonify(profiler.status())
+
+@app.route('/debug/profile/result', methods=['GET'])
+def profile_result():
+    """Download the profile as collapsed stacks, a pstats dump or a pstats text summary"""
+    error = check_admin_token()
+    if error:
+        return error
+    status = profiler.status()
+    if status['state'] == 'idle':
+        return jsonify({'error': 'No profile has been recorded'}), 404
+    fmt = request.args.get('format', status['formats'][0])
+    if fmt not in status['formats']:
+        return jsonify({'error': f"format must be one of {', '.join(status['formats'])} for {status['mode']} profiles"}), 400
+    stamp = status['started_at'][:19].replace(':', '').replace('-', '')
+    headers = {'X-Profile-State': status['state']}
+    if fmt == 'collapsed':
+        headers['Content-Disposition'] = f'attachment; filename=profile-{stamp}.collapsed'
+        return Response(profiler.collapsed(), mimetype='text/plain', headers=headers)
+    if fmt == 'pstats':
+        dump = profiler.pstats_dump()
+        if dump is None:
+            return jsonify({'error': 'No requests have been profiled yet'}), 404
+        headers['Content-Disposition'] = f'attachment; filename=profile-{stamp}.pstats'
+        return Response(dump, mimetype='application/octet-stream', headers=headers)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        return jsonify({'error': 'sort must be one of cumulative, tottime, calls'}), 400
+    text = profiler.pstats_text(sort, min(request.args.get('limit', 50, type=int), 500))
+    if text is None:
+        return jsonify({'error': 'No requests have been profiled yet'}), 404
+    return Response(text, mimetype='text/plain', headers=headers)
+
+JOB_WIRE_FORMATS = {'msgpack': MSGPACK, 'arrow': ARROW}
+
+def job_response(job):
+    """A job's state as returned by the API"""
+    body = {k: v for k, v in job.items() if k != 'model_path'}
+    if job['state'] == 'succeeded':
+        body['result_url'] = f"/jobs/{job['id']}/results"
+    return body
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a scoring job over an uploaded dataset or a file in the job input directory"""
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        if 'input' in request.args:
+            input_path, fmt = job_manager.resolve_input(request.args['input'])
+            upload = None
+        else:
+            fmt = UPLOAD_FORMATS.get((request.content_type or '').split(';')[0].strip().lower())
+            if fmt is None:
+                return jsonify({'error': 'Upload the dataset as CSV, JSON, NDJSON, MessagePack or Arrow, '
+                                         'or reference a file with ?input='}), 415
+            input_path, upload = None, request.stream
+        if fmt in JOB_WIRE_FORMATS and not available(JOB_WIRE_FORMATS[fmt]):
+            return jsonify({'error': f'{fmt} input needs the {REQUIRED_PACKAGE[JOB_WIRE_FORMATS[fmt]]} '
+                                     'package on the server'}), 415
+        # Pinned here so a hot-swap while the job is queued doesn't change its model
+        active = model_registry.active
+        job = job_manager.create(active.path, active.version, fmt, input_path=input_path, upload=upload,
+                                 id_field=request.args.get('id_field') or None)
+        if job is None:
+            response = jsonify({'error': 'Too many jobs queued, retry later'})
+            response.status_code = 429
+            response.headers['Retry-After'] = '60'
+            return response
+        response = jsonify(job_response(job))
+        response.status_code = 202
+        response.headers['Location'] = f"/jobs/{job['id']}"
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Recent jobs, newest first"""
+    error = check_admin_token()
+    if error:
+        return error
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({'jobs': [job_response(job) for job in job_manager.list(limit)]})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """State and progress of one job"""
+    error = check_admin_token()
+    if error:
+        return error
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job; shards already being scored finish first"""
+    error = check_admin_token()
+    if error:
+        return error
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['state'] in FINISHED:
+        return jsonify({'error': f"Job already {job['state']}", 'job': job_response(job)}), 409
+    return jsonify({'status': 'cancelling', 'job': job_response(job)}), 202
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """Download a finished job's results as CSV"""
+    error = check_admin_token()
+    if error:
+        return error
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    path = job_manager.result_path(job_id)
+    if path is None:
+        return jsonify({'error': f"Job is {job['state']}; results are only available once it has succeeded"}), 409
+    return send_file(os.path.abspath(path), mimetype='text/csv', as_attachment=True,
+                     download_name=f'job-{job_id}.csv')
+
+def employee_range_index(employees):
+    """Vectorized employee band lookup - index into EMPLOYEE_RANGES"""
+    return np.searchsorted(EMPLOYEE_RANGE_BOUNDS, employees, side='right')
+
 @app.route('/analytics/tier-distribution', methods=['GET'])
 def tier_distribution():
     """Get current tier distribution from logs"""
     try:
-        with log_lock:
-            logs = list(prediction_log)
+        logs = prediction_log.columns('probability', 'tier', 'employees')
+        total = len(logs['tier'])
         
-        if not logs:
+        if not total:
             return jsonify({'error': 'No prediction logs available'}), 404
         
         # Calculate distributions
-        total = len(logs)
-        tier_counts = {'A': 0, 'B': 0, 'C': 0, 'D': 0}
-        
-        for log in logs:
-            tier = log['response']['tier']
-            tier_counts[tier] = tier_counts.get(tier, 0) + 1
+        tier_counts = dict(zip(TIERS, np.bincount(logs['tier'], minlength=4).tolist()))
         
         # Calculate by employee range
-        ranges = {
-            '<100': {'min': 0, 'max': 100, 'logs': []},
-            '100-299': {'min': 100, 'max': 300, 'logs': []},
-            '300-999': {'min': 300, 'max': 1000, 'logs': []},
-            '1000-2999': {'min': 1000, 'max': 3000, 'logs': []},
-            '>=3000': {'min': 3000, 'max': float('inf'), 'logs': []}
-        }
-        
-        for log in logs:
-            emp_count = log['response']['employee_count']
-            for range_name, range_info in ranges.items():
-                if range_info['min'] <= emp_count < range_info['max']:
-                    range_info['logs'].append(log)
-                    break
+        bands = employee_range_index(logs['employees'])
         
         # Analyze each range
         range_analysis = {}
-        for range_name, range_info in ranges.items():
-            range_logs = range_info['logs']
-            if range_logs:
-                range_tiers = {'A': 0, 'B': 0, 'C': 0, 'D': 0}
-                probs = []
-                
-                for log in range_logs:
-                    tier = log['response']['tier']
-                    prob = log['response']['probability']
-                    range_tiers[tier] += 1
-                    probs.append(prob)
-                
-                range_analysis[range_name] = {
-                    'count': len(range_logs),
-                    'tier_distribution': {
-                        tier: {
-                            'count': count,
-                            'percentage': round(count / len(range_logs) * 100, 1)
-                        } for tier, count in range_tiers.items()
-                    },
-                    'probability_stats': {
-                        'min': round(min(probs), 4),
-                        'max': round(max(probs), 4),
-                        'mean': round(sum(probs) / len(probs), 4),
-                        'median': round(sorted(probs)[len(probs)//2], 4)
-                    }
+        for band, range_name in enumerate(EMPLOYEE_RANGES):
+            mask = bands == band
+            count = int(mask.sum())
+            if not count:
+                continue
+            range_tiers = dict(zip(TIERS, np.bincount(logs['tier'][mask], minlength=4).tolist()))
+            probs = logs['probability'][mask]
+            
+            range_analysis[range_name] = {
+                'count': count,
+                'tier_distribution': {
+                    tier: {
+                        'count': n,
+                        'percentage': round(n / count * 100, 1)
+                    } for tier, n in range_tiers.items()
+                },
+                'probability_stats': {
+                    'min': round(float(probs.min()), 4),
+                    'max': round(float(probs.max()), 4),
+                    'mean': round(float(probs.sum()) / count, 4),
+                    'median': round(float(np.partition(probs, count // 2)[count // 2]), 4)
                 }
+            }
         
+        oldest, newest = prediction_log.time_range()
         return jsonify({
             'total_predictions': total,
             'overall_distribution': {
@@ -647,26 +1188,172 @@ def tier_distribution():
             },
             'by_employee_range': range_analysis,
             'log_period': {
-                'oldest': logs[0]['timestamp'] if logs else None,
-                'newest': logs[-1]['timestamp'] if logs else None
+                'oldest': oldest,
+                'newest': newest
             }
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def wants_ndjson():
+    """Whether the client asked for a streamed NDJSON response"""
+    if request.args.get('format') == 'ndjson':
+        return True
+    accept = request.accept_mimetypes
+    return accept.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def stream_ndjson(chunks, compress):
+    """Yield NDJSON bytes (optionally gzipped) for an iterator of entry lists"""
+    # Level 3 compresses nearly as well as the default at about half the CPU
+    gzip = zlib.compressobj(3, zlib.DEFLATED, 31) if compress else None
+    for entries in chunks:
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode()
+        if gzip:
+            data = gzip.compress(data)
+        if data:
+            yield data
+    if gzip:
+        yield gzip.flush()
+
 @app.route('/analytics/recent-predictions', methods=['GET'])
 def recent_predictions():
-    """Get recent predictions for debugging"""
+    """Get recent predictions for debugging, or poll for new ones with a cursor"""
     try:
+        since = request.args.get('since', type=int)
+        streamed = wants_ndjson()
         limit = request.args.get('limit', 100, type=int)
-        limit = min(limit, 1000)  # Cap at 1000
+        # Streaming never holds more than one chunk, so it may page the whole log
+        limit = max(min(limit, MAX_LOG_SIZE if streamed else 1000), 0)
+        
+        # Fix the page bounds now; rows are copied in small chunks as they are sent
+        start, stop, missed = prediction_log.cursor_range(since, limit)
+        oldest, newest = prediction_log.seq_range()
+        cursor = {
+            'next_cursor': stop,
+            'oldest_cursor': oldest,
+            'has_more': stop < newest,
+            'missed': missed
+        }
         
-        with log_lock:
-            recent = list(prediction_log)[-limit:]
+        if streamed:
+            compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+            response = Response(
+                stream_ndjson(prediction_log.iter_chunks(start, stop), compress),
+                mimetype='application/x-ndjson'
+            )
+            if compress:
+                response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+            for key, value in cursor.items():
+                response.headers['X-' + key.replace('_', '-').title()] = str(value).lower()
+            return response
+        
+        recent = [entry for chunk in prediction_log.iter_chunks(start, stop) for entry in chunk]
         
         return jsonify({
             'count': len(recent),
-            'predictions': recent
+            'predictions': recent,
+            **cursor
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_query_time(value, end_of_day=False):
+    """Epoch microseconds for an ISO date/datetime query parameter (UTC)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(value) == 10:
+        # A bare end date includes the whole day
+        parsed += timedelta(days=1, microseconds=-1)
+    return to_epoch_us(parsed)
+
+@app.route('/analytics/query', methods=['GET'])
+def query_history():
+    """Filter the persisted prediction history"""
+    try:
+        tiers = request.args.getlist('tier')
+        bands = request.args.getlist('employee_band')
+        invalid = [t for t in tiers if t not in TIERS] + [b for b in bands if b not in EMPLOYEE_BANDS]
+        if invalid:
+            return jsonify({'error': f'Invalid filter values: {invalid}',
+                            'valid_tiers': list(TIERS),
+                            'valid_employee_bands': list(EMPLOYEE_BANDS)}), 400
+        try:
+            start = parse_query_time(request.args.get('start'))
+            end = parse_query_time(request.args.get('end'), end_of_day=True)
+        except ValueError:
+            return jsonify({'error': 'start and end must be ISO 8601 dates or datetimes'}), 400
+        limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
+        
+        result = history_store.query(
+            start_us=start,
+            end_us=end,
+            tiers=tiers,
+            industries=request.args.getlist('industry'),
+            territories=request.args.getlist('territory'),
+            bands=bands,
+            limit=limit
+        )
+        result['filters'] = {
+            'start': request.args.get('start'),
+            'end': request.args.get('end'),
+            'tier': tiers,
+            'industry': request.args.getlist('industry'),
+            'territory': request.args.getlist('territory'),
+            'employee_band': bands
+        }
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+MAX_TREND_POINTS = 2000
+INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def parse_interval(value):
+    """Seconds in an interval such as 15m, 1h or 7d"""
+    unit = INTERVAL_UNITS.get(value[-1:])
+    if unit is None or not value[:-1].isdigit() or int(value[:-1]) <= 0:
+        raise ValueError('interval must be a whole number of minutes, hours or days, like 15m, 1h or 7d')
+    return int(value[:-1]) * unit
+
+@app.route('/analytics/trends', methods=['GET'])
+def trends():
+    """Tier mix and probability statistics over time, answered from rollups"""
+    try:
+        try:
+            interval = parse_interval(request.args.get('interval', '1h'))
+            end = parse_query_time(request.args.get('end'), end_of_day=True)
+            start = parse_query_time(request.args.get('start'))
+            quantiles = [float(q) for q in request.args.get('quantiles', '0.25,0.5,0.75').split(',')]
+            if not all(0 < q < 1 for q in quantiles):
+                raise ValueError('quantiles must be between 0 and 1')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        end = end // 1_000_000 + 1 if end is not None else int(time.time()) + 1
+        start = start // 1_000_000 if start is not None else end - 86400
+        if start >= end:
+            return jsonify({'error': 'start must be before end'}), 400
+        if (end - start) / interval > MAX_TREND_POINTS:
+            return jsonify({'error': f'Too many points; use a larger interval (max {MAX_TREND_POINTS} points)'}), 400
+        breakdown = request.args.get('breakdown', 'false').lower() == 'true'
+        try:
+            level, starts, points = rollup_store.series(start, end, interval)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        series = summarize(points, quantiles, breakdown)
+        for point, point_start in zip(series, starts.tolist()):
+            point['start'] = datetime.utcfromtimestamp(point_start).isoformat()
+        return jsonify({
+            'start': datetime.utcfromtimestamp(int(starts[0]) if len(starts) else start).isoformat(),
+            'end': datetime.utcfromtimestamp(end).isoformat(),
+            'interval_seconds': interval,
+            'resolution': level,
+            'summary': summarize(points.sum(axis=0), quantiles, breakdown)[0],
+            'points': series
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -675,47 +1362,26 @@ def recent_predictions():
 def probability_quartiles():
     """Calculate current probability quartiles for recalibration"""
     try:
-        with log_lock:
-            logs = list(prediction_log)
+        logs = prediction_log.columns('probability', 'employees')
+        total = len(logs['probability'])
         
-        if not logs:
+        if not total:
             return jsonify({'error': 'No prediction logs available'}), 404
         
         # Group by employee range
-        ranges = {
-            '<100': [],
-            '100-299': [],
-            '300-999': [],
-            '1000-2999': [],
-            '>=3000': []
-        }
-        
-        for log in logs:
-            prob = log['response']['probability']
-            emp_count = log['response']['employee_count']
-            
-            if emp_count < 100:
-                ranges['<100'].append(prob)
-            elif emp_count < 300:
-                ranges['100-299'].append(prob)
-            elif emp_count < 1000:
-                ranges['300-999'].append(prob)
-            elif emp_count < 3000:
-                ranges['1000-2999'].append(prob)
-            else:
-                ranges['>=3000'].append(prob)
+        bands = employee_range_index(logs['employees'])
         
         # Calculate quartiles for each range
         quartiles = {}
-        for range_name, probs in ranges.items():
-            if len(probs) >= 4:  # Need at least 4 values for quartiles
-                probs_sorted = sorted(probs)
-                n = len(probs)
+        for band, range_name in enumerate(EMPLOYEE_RANGES):
+            probs_sorted = np.sort(logs['probability'][bands == band])
+            n = len(probs_sorted)
+            if n >= 4:  # Need at least 4 values for quartiles
                 quartiles[range_name] = {
                     'count': n,
-                    'q25': round(probs_sorted[n//4], 4),
-                    'q50': round(probs_sorted[n//2], 4),
-                    'q75': round(probs_sorted[3*n//4], 4),
+                    'q25': round(float(probs_sorted[n//4]), 4),
+                    'q50': round(float(probs_sorted[n//2]), 4),
+                    'q75': round(float(probs_sorted[3*n//4]), 4),
                     'current_thresholds': {
                         'A': {'<100': 0.1986, '100-299': 0.2174, '300-999': 0.1479, 
                               '1000-2999': 0.1479, '>=3000': 0.1704}[range_name],
@@ -725,14 +1391,14 @@ def probability_quartiles():
                               '1000-2999': 0.0499, '>=3000': 0.0532}[range_name]
                     },
                     'recommended_thresholds': {
-                        'A': probs_sorted[3*n//4],
-                        'B': probs_sorted[n//2], 
-                        'C': probs_sorted[n//4]
+                        'A': float(probs_sorted[3*n//4]),
+                        'B': float(probs_sorted[n//2]), 
+                        'C': float(probs_sorted[n//4])
                     }
                 }
         
         return jsonify({
-            'total_predictions': len(logs),
+            'total_predictions': total,
             'quartiles_by_range': quartiles,
             'recommendation': 'Update tier thresholds to match the recommended values for proper 25% distribution'
         })
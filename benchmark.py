@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the hot paths of the Tapcheck Prediction API
+
+Times each function in-process (no HTTP server) and stores the results as
+a JSON baseline. Comparison mode flags any benchmark whose median time per
+call regressed by more than the threshold.
+
+Examples:
+
+    # Run everything and print the results
+    python benchmark.py
+
+    # Record a new baseline
+    python benchmark.py --save benchmarks/baseline.json
+
+    # Compare against the stored baseline (exit code 1 on regression)
+    python benchmark.py --compare benchmarks/baseline.json --threshold 0.15
+
+    # Only run the analytics benchmarks
+    python benchmark.py --filter analytics
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(REPO_DIR, 'benchmarks', 'baseline.json')
+
+# The app loads the model and log file relative to the working directory;
+# point the log at a scratch file so benchmarks never touch real history.
+os.chdir(REPO_DIR)
+sys.path.insert(0, REPO_DIR)
+SCRATCH_DIR = tempfile.mkdtemp(prefix='tapcheck-bench-')
+os.environ['PREDICTION_LOG_FILE'] = os.path.join(SCRATCH_DIR, 'api_predictions_log.json')
+os.environ['HISTORY_DIR'] = os.path.join(SCRATCH_DIR, 'prediction_history')
+os.environ['ROLLUP_DIR'] = os.path.join(SCRATCH_DIR, 'prediction_rollups')
+os.environ['CACHE_WARMUP'] = 'false'
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import sklearn  # noqa: E402
+
+import app  # noqa: E402
+from history_store import HistoryStore  # noqa: E402
+from load_test import synthetic_payload  # noqa: E402
+from rollups import RollupStore  # noqa: E402
+import serialization  # noqa: E402
+from scoring import FEATURE_NAMES, assign_tier  # noqa: E402
+
+LOG_ENTRIES = 10000
+SAVE_LOGS = app.save_logs
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark. The decorated function returns the callable to time, or None to skip."""
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+
+def feature_rows(n, seed=0):
+    """Feature dicts shaped exactly like the ones /predict builds"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        data = app.normalize_field_names(synthetic_payload(rng))
+        rows.append({f: data.get(f, np.nan) for f in FEATURE_NAMES})
+    return rows
+
+
+def fill_prediction_log(n=LOG_ENTRIES):
+    """Fill the in-memory prediction log through log_prediction itself"""
+    rng = random.Random(1)
+    rows = feature_rows(n, seed=1)
+    saver = app.save_logs
+    app.save_logs = lambda: None
+    try:
+        app.prediction_log.clear()
+        for features in rows:
+            proba = rng.random() * 0.4
+            employees = features['Eligible Employees'] or features['Global Employees'] or 0
+            tier = assign_tier(proba, employees)
+            response = {'probability_closed_won': round(proba, 4), 'tier': tier}
+            app.log_prediction(features, response, employees, features)
+    finally:
+        app.save_logs = saver
+
+
+def analytics_call(view, path):
+    """Call a GET view inside a request context, including JSON serialization"""
+    def run():
+        with app.app.test_request_context(path):
+            view()
+    return run
+
+
+@benchmark('normalize_field_names.snake_case')
+def bench_normalize_snake():
+    payload = synthetic_payload(random.Random(0))
+    return lambda: app.normalize_field_names(payload)
+
+
+@benchmark('normalize_field_names.title_case')
+def bench_normalize_title():
+    payload = app.normalize_field_names(synthetic_payload(random.Random(0)))
+    payload = {k: v for k, v in payload.items() if k in FEATURE_NAMES}
+    return lambda: app.normalize_field_names(payload)
+
+
+@benchmark('clean_value.numeric_with_commas')
+def bench_clean_numeric():
+    return lambda: app.clean_value('23,196', default=np.nan, field_name='Global Employees')
+
+
+@benchmark('clean_value.hyphen')
+def bench_clean_hyphen():
+    return lambda: app.clean_value('-', default='missing', field_name='Industry')
+
+
+@benchmark('model.predict_proba.1_row')
+def bench_predict_1():
+    df = pd.DataFrame(feature_rows(1), columns=FEATURE_NAMES)
+    model = app.model_registry.active.model
+    return lambda: model.predict_proba(df)
+
+
+@benchmark('model.predict_proba.100_rows')
+def bench_predict_100():
+    df = pd.DataFrame(feature_rows(100), columns=FEATURE_NAMES)
+    model = app.model_registry.active.model
+    return lambda: model.predict_proba(df)
+
+
+@benchmark('model.predict_proba.1000_rows')
+def bench_predict_1000():
+    df = pd.DataFrame(feature_rows(1000), columns=FEATURE_NAMES)
+    model = app.model_registry.active.model
+    return lambda: model.predict_proba(df)
+
+
+@benchmark('assign_tier')
+def bench_assign_tier():
+    cases = [(0.05, 50), (0.15, 250), (0.09, 600), (0.02, 1500), (0.2, 5000)]
+
+    def run():
+        for proba, employees in cases:
+            assign_tier(proba, employees)
+    return run
+
+
+@benchmark('get_simple_explanation')
+def bench_explanation():
+    features = feature_rows(1)[0]
+    return lambda: app.get_simple_explanation(features, 0.1234, 'B')
+
+
+@benchmark('predict.endpoint')
+def bench_predict_endpoint():
+    payload = synthetic_payload(random.Random(0))
+    app.save_logs = lambda: None
+
+    def run():
+        # Measure the full scoring path, not a prediction cache hit
+        app.prediction_cache.clear()
+        with app.app.test_request_context('/predict', method='POST', json=payload):
+            app.predict()
+    return run
+
+
+@benchmark('predict.endpoint.cache_hit')
+def bench_predict_endpoint_cached():
+    payload = synthetic_payload(random.Random(0))
+    app.save_logs = lambda: None
+
+    def run():
+        with app.app.test_request_context('/predict', method='POST', json=payload):
+            app.predict()
+    return run
+
+
+@benchmark('drift.observe')
+def bench_drift_observe():
+    features = feature_rows(1)[0]
+    return lambda: app.drift_monitor.observe(features)
+
+
+@benchmark('log_prediction.full_log')
+def bench_log_prediction():
+    fill_prediction_log()
+    features = feature_rows(1)[0]
+    response = {'probability_closed_won': 0.1234, 'tier': 'B'}
+    # Periodic saves are timed separately by save_logs.full_log
+    app.save_logs = lambda: None
+    return lambda: app.log_prediction(features, response, 250, features)
+
+
+@benchmark('save_logs.full_log')
+def bench_save_logs():
+    fill_prediction_log()
+    return SAVE_LOGS
+
+
+@benchmark('analytics.tier_distribution.10k')
+def bench_tier_distribution():
+    fill_prediction_log()
+    return analytics_call(app.tier_distribution, '/analytics/tier-distribution')
+
+
+@benchmark('analytics.recent_predictions.10k')
+def bench_recent_predictions():
+    fill_prediction_log()
+    return analytics_call(app.recent_predictions, '/analytics/recent-predictions?limit=1000')
+
+
+@benchmark('analytics.recent_predictions.ndjson_gzip.10k')
+def bench_recent_predictions_stream():
+    fill_prediction_log()
+
+    def run():
+        path = '/analytics/recent-predictions?format=ndjson&limit=10000'
+        with app.app.test_request_context(path, headers={'Accept-Encoding': 'gzip'}):
+            for _ in app.recent_predictions().response:
+                pass
+    return run
+
+
+@benchmark('analytics.probability_quartiles.10k')
+def bench_probability_quartiles():
+    fill_prediction_log()
+    return analytics_call(app.probability_quartiles, '/analytics/probability-quartiles')
+
+
+@benchmark('analytics.query.10k')
+def bench_query():
+    # A fresh store holding exactly the 10k filled rows, flushed to disk
+    app.history_store = HistoryStore(tempfile.mkdtemp(dir=SCRATCH_DIR), flush_rows=10 ** 9)
+    fill_prediction_log()
+    app.history_store.flush()
+    return analytics_call(app.query_history, '/analytics/query?tier=A&tier=B&employee_band=300-999&limit=100')
+
+
+@benchmark('analytics.trends.30d_hourly')
+def bench_trends():
+    # 30 days of rollups (100k predictions), queried as 720 hourly points
+    app.rollup_store = RollupStore(tempfile.mkdtemp(dir=SCRATCH_DIR))
+    rng = random.Random(1)
+    now = int(time.time())
+    for _ in range(100_000):
+        proba = rng.random() * 0.4
+        employees = int(rng.lognormvariate(5, 1.5))
+        timestamp_us = rng.randrange(now - 30 * 86400, now) * 1_000_000
+        app.rollup_store.observe(timestamp_us, proba, assign_tier(proba, employees), employees)
+    start = datetime.utcfromtimestamp(now - 30 * 86400).isoformat()
+    return analytics_call(app.trends, f'/analytics/trends?start={start}&interval=1h')
+
+
+def batch_wire_roundtrip(content_type, encode):
+    """
+    Decode a 100-account /predict-batch body into the model's DataFrame and
+    encode 100 results, in one wire format - everything but the scoring
+    """
+    if not serialization.available(content_type):
+        return None
+    rng = random.Random(0)
+    accounts = [synthetic_payload(rng) for _ in range(100)]
+    body = encode(accounts)
+    features = feature_rows(1)[0]
+    result, _ = app.build_prediction(features, 0.3, 'bench')
+    response = {'count': 100, 'errors': 0, 'predictions': [result] * 100, 'status': 'success'}
+    
+    def run():
+        headers = {'Content-Type': content_type}
+        with app.app.test_request_context('/predict-batch', method='POST', data=body, headers=headers):
+            fmt, data = app.read_scoring_request((serialization.JSON, serialization.MSGPACK, serialization.ARROW))
+            if fmt == serialization.ARROW:
+                frame = serialization.arrow_features(data, app.normalize_field_names)
+                serialization.feature_dicts(frame)
+            else:
+                rows = [app.build_features(app.normalize_field_names(a)) for a in data['accounts']]
+                pd.DataFrame(rows, columns=FEATURE_NAMES)
+            app.respond(response)
+    return run
+
+
+@benchmark('serialization.batch_100.json')
+def bench_wire_json():
+    return batch_wire_roundtrip(serialization.JSON, lambda accounts: json.dumps({'accounts': accounts}))
+
+
+@benchmark('serialization.batch_100.msgpack')
+def bench_wire_msgpack():
+    return batch_wire_roundtrip(serialization.MSGPACK, lambda accounts: serialization.pack({'accounts': accounts}))
+
+
+@benchmark('serialization.batch_100.arrow')
+def bench_wire_arrow():
+    def encode(accounts):
+        pa = serialization.pa
+        table = pa.Table.from_pandas(pd.DataFrame(accounts), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return batch_wire_roundtrip(serialization.ARROW, encode)
+
+
+def time_callable(fn, repeats, min_time):
+    """Return per-call seconds for each repeat, calibrating the loop count first"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return loops, timings
+
+
+def run_benchmarks(name_filter, repeats, min_time):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        fn = setup()
+        if fn is None:
+            print(f"{name:<45}{'skipped':>14}")
+            continue
+        fn()  # warm caches and lazy imports
+        loops, timings = time_callable(fn, repeats, min_time)
+        results[name] = {
+            'median_us': round(statistics.median(timings) * 1e6, 3),
+            'min_us': round(min(timings) * 1e6, 3),
+            'loops': loops,
+            'repeats': repeats,
+        }
+        print(f"{name:<45}{results[name]['median_us']:>14,.1f} us  (min {results[name]['min_us']:,.1f}, {loops} loops)")
+        app.save_logs = SAVE_LOGS
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table and return the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<45}{'baseline us':>14}{'current us':>14}{'change':>10}")
+    print("-" * 83)
+    for name, current in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            print(f"{name:<45}{'-':>14}{current['median_us']:>14,.1f}{'new':>10}")
+            continue
+        change = current['median_us'] / base['median_us'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<45}{base['median_us']:>14,.1f}{current['median_us']:>14,.1f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed repeats per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per repeat')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='Write results as a JSON baseline')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='Compare against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Relative slowdown that counts as a regression (default 0.15)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.filter, args.repeats, args.min_time)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({
+                'meta': {
+                    'created': datetime.utcnow().isoformat(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'numpy': np.__version__,
+                    'pandas': pd.__version__,
+                    'sklearn': sklearn.__version__,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
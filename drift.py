@@ -0,0 +1,413 @@
+"""
+Streaming feature drift monitor
+
+Every scored request updates fixed-size counters for each model feature:
+one O(1) increment per feature per request, so the drift report never
+rescans the prediction log. Counters are compared with a reference profile
+of the training distribution:
+
+- From the model itself (default): the fitted OneHotEncoder's categories,
+  the imputer medians and scaler moments, and the HistGradientBoosting bin
+  thresholds. When a numeric feature had more distinct training values than
+  bins, those thresholds are training quantiles, which gives an expected
+  histogram and so a PSI. The encoder keeps no category frequencies, so
+  categorical PSI needs a training-data reference.
+- From training data: `python drift.py --training-data train.csv` writes
+  drift_reference.json with exact histograms and category frequencies.
+
+Usage:
+    python drift.py --training-data train.csv --output drift_reference.json
+"""
+
+import argparse
+import bisect
+import json
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from prediction_log import CATEGORICAL_FIELDS, NUMERIC_FIELDS
+
+# Values the API treats as missing (see clean_value in app.py)
+MISSING_TOKENS = {'-', '--', 'null', 'NULL', 'None', 'none', ''}
+OTHER = '__other__'
+NUMERIC_BINS = 10
+PSI_EPSILON = 1e-4
+# Conventional PSI bands: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant
+PSI_WATCH = 0.1
+PSI_DRIFT = 0.25
+# Share of unparseable or never-trained-on values that flags a feature on its own
+RATE_DRIFT = 0.05
+
+
+def psi(observed, expected):
+    """Population stability index between two proportion vectors"""
+    observed = np.maximum(np.asarray(observed, dtype=float), PSI_EPSILON)
+    expected = np.maximum(np.asarray(expected, dtype=float), PSI_EPSILON)
+    return float(np.sum((observed - expected) * np.log(observed / expected)))
+
+
+def _fitted_parts(pipeline):
+    """(onehot encoder, numeric imputer, scaler, classifier) of a fitted pipeline"""
+    preprocessor = pipeline.named_steps['preprocessor']
+    categorical = preprocessor.named_transformers_['cat']
+    numeric = preprocessor.named_transformers_['num']
+    return (categorical.named_steps['onehot'], numeric.named_steps['imputer'],
+            numeric.named_steps['scaler'], pipeline.named_steps['classifier'])
+
+
+def _pipelines(model):
+    """Fitted pipelines inside a (possibly calibrated) model"""
+    if hasattr(model, 'calibrated_classifiers_'):
+        return [c.base_estimator for c in model.calibrated_classifiers_]
+    return [model]
+
+
+def _expected_histogram(edges, cdf):
+    """Bin proportions for bins (-inf, e0], (e0, e1], ..., (e_last, inf)"""
+    cumulative = [0.0] + [cdf(e) for e in edges] + [1.0]
+    return [max(b - a, 0.0) for a, b in zip(cumulative, cumulative[1:])]
+
+
+def reference_from_model(model, version=None):
+    """Reference profile derived from a fitted model's preprocessing and bins"""
+    pipelines = _pipelines(model)
+    _, imputer, scaler, _ = _fitted_parts(pipelines[0])
+
+    categorical = {}
+    for i, field in enumerate(CATEGORICAL_FIELDS):
+        # Each calibration fold fitted its own encoder; any of them knowing a value counts
+        known = set()
+        for pipeline in pipelines:
+            known.update(_fitted_parts(pipeline)[0].categories_[i].tolist())
+        categorical[field] = {'known': sorted(known, key=str), 'expected': None, 'null_rate': None}
+
+    numeric = {}
+    for j, field in enumerate(NUMERIC_FIELDS):
+        thresholds = []
+        quantile_binned = True
+        for pipeline in pipelines:
+            _, _, fold_scaler, fold_classifier = _fitted_parts(pipeline)
+            mapper = fold_classifier._bin_mapper
+            # Numeric columns come last in the ColumnTransformer output, after
+            # a one-hot block whose width differs between folds
+            column = fold_classifier.n_features_in_ - len(NUMERIC_FIELDS) + j
+            scaled = mapper.bin_thresholds_[column]
+            thresholds.append(scaled * fold_scaler.scale_[j] + fold_scaler.mean_[j])
+            # With fewer distinct values than bins the thresholds are midpoints
+            # between those values and say nothing about their frequencies
+            quantile_binned &= len(scaled) == mapper.n_bins - 2
+
+        pooled = np.sort(np.concatenate(thresholds))
+        edges = np.unique(np.percentile(pooled, np.linspace(0, 100, NUMERIC_BINS + 1)[1:-1])).tolist()
+        expected = None
+        if quantile_binned:
+            # Fold thresholds sit at the 1/n_bins training quantiles
+            def cdf(x):
+                return float(np.mean([np.searchsorted(t, x, side='right') / (len(t) + 1)
+                                      for t in thresholds]))
+            expected = _expected_histogram(edges, cdf)
+        numeric[field] = {
+            'edges': edges,
+            'expected': expected,
+            'null_rate': None,
+            'median': float(imputer.statistics_[j]),
+            'mean': float(scaler.mean_[j]),
+            'std': float(scaler.scale_[j]),
+        }
+
+    return {
+        'source': 'model',
+        'model_version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'numeric': numeric,
+        'categorical': categorical,
+    }
+
+
+def unavailable_reference(version=None, error=None):
+    """Empty profile used when none could be built; requests are counted but no feature is compared"""
+    return {
+        'source': 'unavailable',
+        'model_version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'error': error,
+        'numeric': {},
+        'categorical': {},
+    }
+
+
+def reference_from_frame(frame, version=None, max_categories=200):
+    """Exact reference profile from a training DataFrame with the model's columns"""
+    import pandas as pd
+
+    numeric = {}
+    for field in NUMERIC_FIELDS:
+        raw = frame[field] if field in frame else pd.Series(dtype=float)
+        values = pd.to_numeric(raw.astype(str).str.replace(',', ''), errors='coerce')
+        values = values[raw.notna()]
+        present = values.dropna().to_numpy(dtype=float)
+        null_rate = 1 - len(present) / len(frame) if len(frame) else None
+        if not len(present):
+            numeric[field] = {'edges': [], 'expected': None, 'null_rate': null_rate}
+            continue
+        edges = np.unique(np.quantile(present, np.linspace(0, 1, NUMERIC_BINS + 1)[1:-1])).tolist()
+        counts = np.bincount(np.searchsorted(edges, present, side='left'), minlength=len(edges) + 1)
+        numeric[field] = {
+            'edges': edges,
+            'expected': (counts / len(present)).tolist(),
+            'null_rate': null_rate,
+            'median': float(np.median(present)),
+            'mean': float(present.mean()),
+            'std': float(present.std()),
+            'min': float(present.min()),
+            'max': float(present.max()),
+        }
+
+    categorical = {}
+    for field in CATEGORICAL_FIELDS:
+        raw = frame[field] if field in frame else pd.Series(dtype=object)
+        present = raw.dropna()
+        present = present[~present.astype(str).str.strip().isin(MISSING_TOKENS)]
+        frequencies = present.value_counts(normalize=True)
+        expected = {str(k): float(v) for k, v in frequencies.iloc[:max_categories].items()}
+        if len(frequencies) > max_categories:
+            expected[OTHER] = float(frequencies.iloc[max_categories:].sum())
+        categorical[field] = {
+            'known': sorted({str(v) for v in frequencies.index}),
+            'expected': expected,
+            'null_rate': 1 - len(present) / len(frame) if len(frame) else None,
+        }
+
+    return {
+        'source': 'training_data',
+        'model_version': version,
+        'created_at': datetime.utcnow().isoformat(),
+        'rows': int(len(frame)),
+        'numeric': numeric,
+        'categorical': categorical,
+    }
+
+
+class _Window:
+    """Counters for one time window"""
+
+    def __init__(self, reference, started):
+        self.started = started
+        self.count = 0
+        self.numeric = {
+            field: {'bins': [0] * (len(profile['edges']) + 1), 'null': 0, 'placeholder': 0,
+                    'invalid': 0, 'quoted': 0, 'out_of_range': 0}
+            for field, profile in reference['numeric'].items()
+        }
+        self.categorical = {
+            field: {'values': {}, 'null': 0, 'placeholder': 0, 'unseen': 0, 'unseen_values': {}}
+            for field in reference['categorical']
+        }
+
+
+class DriftMonitor:
+    """Incremental per-feature histograms compared against a reference profile"""
+
+    def __init__(self, reference, window_seconds=3600, max_categories=200):
+        self.window_seconds = window_seconds
+        self.max_categories = max_categories
+        self._lock = threading.Lock()
+        self.set_reference(reference)
+
+    @property
+    def reference(self):
+        return self._reference
+
+    def set_reference(self, reference):
+        """Switch reference profile; counters restart because bin edges may differ"""
+        with self._lock:
+            self._reference = reference
+            # Training-data profiles store categories as CSV strings, so compare as strings
+            self._compare_as_str = reference['source'] == 'training_data'
+            self._known = {field: {str(v) for v in profile['known']} if self._compare_as_str
+                           else set(profile['known'])
+                           for field, profile in reference['categorical'].items()}
+            now = time.time()
+            self._current = _Window(reference, now)
+            self._previous = None
+            self._lifetime = _Window(reference, now)
+
+    def _bump(self, counts, key):
+        if key in counts or len(counts) < self.max_categories:
+            counts[key] = counts.get(key, 0) + 1
+        else:
+            counts[OTHER] = counts.get(OTHER, 0) + 1
+
+    def observe(self, features):
+        """Count one request's raw feature values (as received, before cleaning)"""
+        numeric = self._reference['numeric']
+        now = time.time()
+        with self._lock:
+            if now - self._current.started >= self.window_seconds:
+                self._previous = self._current
+                self._current = _Window(self._reference, now)
+            for window in (self._current, self._lifetime):
+                window.count += 1
+                for field, profile in numeric.items():
+                    self._observe_numeric(window.numeric[field], profile, features.get(field))
+                for field, counts in window.categorical.items():
+                    self._observe_categorical(field, counts, features.get(field))
+
+    @staticmethod
+    def _observe_numeric(counts, profile, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            counts['null'] += 1
+            return
+        if isinstance(value, str):
+            text = value.strip()
+            if text in MISSING_TOKENS:
+                counts['placeholder'] += 1
+                return
+            try:
+                number = float(text)
+            except ValueError:
+                # e.g. "23,196" - the model cannot use it as-is
+                counts['invalid'] += 1
+                return
+            counts['quoted'] += 1
+        else:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                counts['invalid'] += 1
+                return
+        if math.isnan(number):
+            counts['null'] += 1
+            return
+        # Only training-data profiles know the true range
+        if 'min' in profile and not profile['min'] <= number <= profile['max']:
+            counts['out_of_range'] += 1
+        counts['bins'][bisect.bisect_left(profile['edges'], number)] += 1
+
+    def _observe_categorical(self, field, counts, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            counts['null'] += 1
+            return
+        if isinstance(value, str) and value.strip() in MISSING_TOKENS:
+            counts['placeholder'] += 1
+            return
+        try:
+            hash(value)
+        except TypeError:
+            value = str(value)
+        if (str(value) if self._compare_as_str else value) not in self._known[field]:
+            counts['unseen'] += 1
+            self._bump(counts['unseen_values'], str(value))
+        self._bump(counts['values'], str(value))
+
+    def _feature_status(self, value, count, min_count, bad_rate=None):
+        if bad_rate is not None and bad_rate > RATE_DRIFT:
+            return 'drift'
+        if count < min_count:
+            return 'insufficient_data'
+        if value is None:
+            return 'unknown'
+        return 'drift' if value > PSI_DRIFT else 'watch' if value > PSI_WATCH else 'stable'
+
+    def report(self, window='current', min_count=100):
+        """Drift statistics per feature for the 'current', 'previous' or 'lifetime' window"""
+        with self._lock:
+            source = {'current': self._current, 'previous': self._previous,
+                      'lifetime': self._lifetime}[window]
+            reference = self._reference
+            if source is None:
+                return {'window': window, 'observations': 0, 'features': {}}
+            # Copy the counters so the rest runs without the lock
+            count = source.count
+            started = source.started
+            numeric_counts = {f: dict(c, bins=list(c['bins'])) for f, c in source.numeric.items()}
+            categorical_counts = {f: dict(c, values=dict(c['values']), unseen_values=dict(c['unseen_values']))
+                                  for f, c in source.categorical.items()}
+
+        def rate(n):
+            return round(n / count, 4) if count else None
+
+        features = {}
+        for field, counts in numeric_counts.items():
+            profile = reference['numeric'][field]
+            valid = sum(counts['bins'])
+            value = None
+            if profile['expected'] is not None and valid:
+                value = psi([b / valid for b in counts['bins']], profile['expected'])
+            features[field] = {
+                'type': 'numeric',
+                'psi': round(value, 4) if value is not None else None,
+                'status': self._feature_status(value, valid, min_count, rate(counts['invalid'])),
+                'null_rate': rate(counts['null']),
+                'placeholder_rate': rate(counts['placeholder']),
+                'invalid_rate': rate(counts['invalid']),
+                'quoted_rate': rate(counts['quoted']),
+                'out_of_range_rate': rate(counts['out_of_range']) if 'min' in profile else None,
+                'reference_null_rate': profile.get('null_rate'),
+                'histogram': {
+                    'edges': profile['edges'],
+                    'observed': counts['bins'],
+                    'expected': [round(p, 4) for p in profile['expected']] if profile['expected'] else None,
+                },
+            }
+
+        for field, counts in categorical_counts.items():
+            profile = reference['categorical'][field]
+            valid = sum(counts['values'].values())
+            value = None
+            if profile['expected'] is not None and valid:
+                expected = profile['expected']
+                keys = set(expected) | set(counts['values'])
+                value = psi([counts['values'].get(k, 0) / valid for k in keys],
+                            [expected.get(k, 0.0) for k in keys])
+            top_unseen = sorted(counts['unseen_values'].items(), key=lambda kv: -kv[1])[:5]
+            features[field] = {
+                'type': 'categorical',
+                'psi': round(value, 4) if value is not None else None,
+                'status': self._feature_status(value, valid, min_count, rate(counts['unseen'])),
+                'null_rate': rate(counts['null']),
+                'placeholder_rate': rate(counts['placeholder']),
+                'unseen_rate': rate(counts['unseen']),
+                'reference_null_rate': profile.get('null_rate'),
+                'top_unseen': [{'value': v, 'count': n} for v, n in top_unseen],
+            }
+
+        return {
+            'window': window,
+            'window_started': datetime.utcfromtimestamp(started).isoformat(),
+            'observations': count,
+            'reference': {
+                'source': reference['source'],
+                'model_version': reference.get('model_version'),
+                'created_at': reference.get('created_at'),
+                **({'error': reference['error']} if reference.get('error') else {}),
+            },
+            'drifting': sorted(f for f, s in features.items() if s['status'] == 'drift'),
+            'features': features,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a drift reference profile from training data')
+    parser.add_argument('--training-data', required=True, help='CSV with the model feature columns')
+    parser.add_argument('--model-version', default=None, help='Model version the data was used to train')
+    parser.add_argument('--output', default='drift_reference.json')
+    args = parser.parse_args()
+
+    import pandas as pd
+    frame = pd.read_csv(args.training_data)
+    missing = [f for f in NUMERIC_FIELDS + CATEGORICAL_FIELDS if f not in frame.columns]
+    if missing:
+        parser.error(f"training data is missing columns: {missing}")
+    reference = reference_from_frame(frame, args.model_version)
+    with open(args.output, 'w') as f:
+        json.dump(reference, f, indent=2)
+    print(f"Wrote {args.output} from {len(frame)} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,230 @@
 """
-Tapcheck Prediction API Client Example
+Tapcheck Prediction API Client
 
 This example demonstrates how to use the Tapcheck Prediction API
 to get conversion probability predictions for potential customers.
+
+The client keeps a pooled keep-alive session, retries 5xx/429 responses
+with exponential backoff, and transparently chunks large account lists
+onto the /predict-batch endpoint. AsyncTapcheckAPIClient offers the same
+calls for asyncio code with a bound on concurrent requests.
 """
 
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
 import requests
-import json
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_BASE_URL = "https://render-api-tc.onrender.com"
+# Overload and gateway errors only: the API answers 500 for input it cannot
+# process, and re-sending that input fails again (and may be logged twice)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class TapcheckAPIError(Exception):
+    """Raised when the API returns a non-2xx response"""
+
+    def __init__(self, status_code: int, payload: Any):
+        self.status_code = status_code
+        self.payload = payload
+        super().__init__(f"API Error {status_code}: {payload}")
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield lists of up to `size` items without materializing the input"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class TapcheckAPIClient:
-    """Simple client for the Tapcheck Prediction API"""
-    
-    def __init__(self, base_url: str = "https://render-api-tc.onrender.com"):
-        self.base_url = base_url
-        self.headers = {"Content-Type": "application/json"}
-    
+    """Client for the Tapcheck Prediction API"""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, timeout: Tuple[float, float] = (5, 60),
+                 max_retries: int = 3, backoff_factor: float = 0.5, pool_size: int = 10,
+                 batch_size: int = 500):
+        """
+        Args:
+            base_url: API root URL
+            timeout: (connect, read) timeout in seconds for every request
+            max_retries: Retries for connection errors and 429/5xx responses
+            backoff_factor: Sleep backoff_factor * 2**(retry - 1) seconds between retries
+            pool_size: Maximum keep-alive connections kept open to the API
+            batch_size: Accounts sent per /predict-batch request (server max 1000)
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._batch_supported = True
+
+        retry_kwargs = dict(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        try:
+            retry = Retry(allowed_methods=frozenset(['GET', 'POST']), **retry_kwargs)
+        except TypeError:  # urllib3 < 1.26
+            retry = Retry(method_whitelist=frozenset(['GET', 'POST']), **retry_kwargs)
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+
+    def _request(self, method: str, path: str, **kwargs) -> Any:
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = response.text
+        if not 200 <= response.status_code < 300:
+            raise TapcheckAPIError(response.status_code, payload)
+        return payload
+
     def health_check(self) -> Dict[str, Any]:
         """Check if the API is healthy"""
-        response = requests.get(f"{self.base_url}/health")
-        return response.json()
-    
+        return self._request('GET', '/health')
+
     def predict(self, company_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Get a conversion probability prediction
-        
-        Required fields:
-        - Global Employees (int)
-        - Eligible Employees (int)
-        - Industry (str)
+
+        Only Global Employees is required. The other model features (Eligible
+        Employees, Industry, Territory, Type, ...) are optional; missing ones
+        are imputed by the model.
         """
-        response = requests.post(
-            f"{self.base_url}/predict",
-            headers=self.headers,
-            json=company_data
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"API Error: {response.json()}")
-        
-        return response.json()
+        return self._request('POST', '/predict', json=company_data)
+
+    def predict_batch(self, accounts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Score up to batch_size accounts in a single request
+
+        Results come back in input order. Accounts that fail validation are
+        returned as {"error": ..., "status": "error"} rather than raising.
+        """
+        if self._batch_supported:
+            try:
+                return self._request('POST', '/predict-batch', json={'accounts': accounts})['predictions']
+            except TapcheckAPIError as e:
+                if e.status_code != 404:
+                    raise
+                # Older deployments without /predict-batch
+                self._batch_supported = False
+        results = []
+        for account in accounts:
+            try:
+                results.append(self.predict(account))
+            except TapcheckAPIError as e:
+                results.append({'error': e.payload, 'status': 'error'})
+        return results
+
+    def predict_many(self, accounts: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Score any number of accounts, chunked onto the batch endpoint"""
+        return [result for _, result in self.iter_predictions(accounts)]
+
+    def iter_predictions(self, accounts: Iterable[Dict[str, Any]]
+                         ) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Stream (account, result) pairs for an arbitrarily large iterable
+
+        Only one chunk of accounts is held in memory at a time, so this works
+        for generators reading from huge files or database cursors.
+        """
+        for chunk in _chunks(accounts, self.batch_size):
+            yield from zip(chunk, self.predict_batch(chunk))
+
+
+class AsyncTapcheckAPIClient:
+    """asyncio client with bounded concurrency, backed by a pooled session"""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, concurrency: int = 8, **client_kwargs):
+        """
+        Args:
+            concurrency: Maximum requests in flight at once
+            **client_kwargs: Passed through to TapcheckAPIClient (timeouts, retries, batch_size)
+        """
+        client_kwargs.setdefault('pool_size', concurrency)
+        self._client = TapcheckAPIClient(base_url, **client_kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self._client.close()
+
+    async def _call(self, fn, *args):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def health_check(self) -> Dict[str, Any]:
+        return await self._call(self._client.health_check)
+
+    async def predict(self, company_data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call(self._client.predict, company_data)
+
+    async def predict_batch(self, accounts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self._call(self._client.predict_batch, accounts)
+
+    async def predict_many(self, accounts: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Score any number of accounts with up to `concurrency` batches in flight"""
+        return [result async for _, result in self.iter_predictions(accounts)]
+
+    async def iter_predictions(self, accounts: Iterable[Dict[str, Any]]
+                               ) -> AsyncIterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Stream (account, result) pairs in input order, keeping a bounded window of batches in flight"""
+        pending = []
+        for chunk in _chunks(accounts, self._client.batch_size):
+            pending.append((chunk, asyncio.ensure_future(self.predict_batch(chunk))))
+            if len(pending) >= self.concurrency:
+                chunk, future = pending.pop(0)
+                for pair in zip(chunk, await future):
+                    yield pair
+        for chunk, future in pending:
+            for pair in zip(chunk, await future):
+                yield pair
+
 
 def main():
     # Initialize the client
     client = TapcheckAPIClient()
-    
+
     # Check API health
     print("Checking API health...")
     health = client.health_check()
     print(f"API Status: {health['status']}, Model: {health['model']}\n")
-    
+
     # Example 1: Small Technology Company
     print("Example 1: Small Technology Company")
     small_tech = {
@@ -62,7 +237,7 @@ def main():
     result1 = client.predict(small_tech)
     print(f"Probability: {result1['probability_closed_won']:.2%}")
     print(f"Tier: {result1['tier']} - {result1['tier_description']}\n")
-    
+
     # Example 2: Large Manufacturing Company
     print("Example 2: Large Manufacturing Company")
     large_mfg = {
@@ -81,7 +256,7 @@ def main():
     result2 = client.predict(large_mfg)
     print(f"Probability: {result2['probability_closed_won']:.2%}")
     print(f"Tier: {result2['tier']} - {result2['tier_description']}\n")
-    
+
     # Example 3: Mid-size Healthcare Company
     print("Example 3: Mid-size Healthcare Company")
     mid_healthcare = {
@@ -95,5 +270,26 @@ def main():
     print(f"Probability: {result3['probability_closed_won']:.2%}")
     print(f"Tier: {result3['tier']} - {result3['tier_description']}\n")
 
+    # Example 4: Many accounts at once (chunked onto /predict-batch)
+    print("Example 4: Batch of accounts")
+    accounts = [small_tech, large_mfg, mid_healthcare] * 100
+    results = client.predict_many(accounts)
+    tiers = {}
+    for result in results:
+        tiers[result.get('tier', 'error')] = tiers.get(result.get('tier', 'error'), 0) + 1
+    print(f"Scored {len(results)} accounts: {tiers}\n")
+
+    # Example 5: asyncio with bounded concurrency
+    print("Example 5: Async client")
+
+    async def score_async():
+        async with AsyncTapcheckAPIClient(concurrency=4, batch_size=100) as async_client:
+            return await async_client.predict_many(accounts)
+
+    async_results = asyncio.run(score_async())
+    print(f"Scored {len(async_results)} accounts asynchronously")
+
+    client.close()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
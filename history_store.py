@@ -0,0 +1,482 @@
+"""
+Columnar, time-partitioned prediction history
+
+Every logged prediction is also appended here and flushed in the background
+to compressed NumPy column files, one directory per UTC day:
+
+    prediction_history/2025-07-14/part-<pid>-<n>.npz        columns
+    prediction_history/2025-07-14/part-<pid>-<n>.idx.json   index
+
+The index records row count, min/max timestamp, probability and employee
+count, per-tier counts and the dictionary of values for each categorical
+column (and of the as-sent numeric values that were not numbers). Queries prune whole days by directory name, then skip any part
+whose index cannot match, and only load the parts that survive - so months
+of history can be filtered without holding it in memory.
+"""
+
+import glob
+import heapq
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from prediction_log import (CATEGORICAL_FIELDS, EPOCH, INT32_MAX, LOG_DTYPE, NUMERIC_FIELDS,
+                            MISSING, CategoryInterner, PredictionRingBuffer, raw_numeric, to_float)
+from scoring import EMPLOYEE_RANGE_BOUNDS, EMPLOYEE_RANGES, TIERS
+
+# Inclusive employee-count bounds for each band name
+EMPLOYEE_BANDS = dict(zip(EMPLOYEE_RANGES, zip([0] + EMPLOYEE_RANGE_BOUNDS,
+                                               [b - 1 for b in EMPLOYEE_RANGE_BOUNDS] + [INT32_MAX])))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def day_of(timestamp_us):
+    return (EPOCH + timedelta(microseconds=int(timestamp_us))).strftime('%Y-%m-%d')
+
+
+class HistoryStore:
+    """Appends predictions to day partitions and answers filtered queries"""
+
+    def __init__(self, root, flush_rows=5000, flush_interval=300, retention_days=None):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._parts_written = 0
+        self._index_cache = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background flush thread"""
+        os.makedirs(self.root, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, timestamp_us, features, probability, tier, employees, model_version=None):
+        employees = to_float(employees)
+        employees = 0 if math.isnan(employees) else int(min(max(employees, 0), INT32_MAX))
+        numeric = [features.get(f) for f in NUMERIC_FIELDS]
+        row = (timestamp_us, float(probability), TIERS.index(tier), employees,
+               model_version, [to_float(v) for v in numeric], [raw_numeric(v) for v in numeric],
+               [features.get(f) for f in CATEGORICAL_FIELDS])
+        with self._lock:
+            self._pending.append(row)
+            pending = len(self._pending)
+        if pending >= self.flush_rows:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.compact_closed_days()
+                self.apply_retention()
+            except Exception as e:
+                print(f"[history] Flush error: {e}")
+
+    # -- writing ---------------------------------------------------------
+
+    @staticmethod
+    def _encode(rows):
+        """Turn pending row tuples into a LOG_DTYPE array plus dictionaries"""
+        data = np.zeros(len(rows), dtype=LOG_DTYPE)
+        interners = [CategoryInterner() for _ in CATEGORICAL_FIELDS]
+        versions = CategoryInterner()
+        raw_interners = [CategoryInterner() for _ in NUMERIC_FIELDS]
+        for i, (ts, proba, tier, employees, version, numeric, raw, categorical) in enumerate(rows):
+            data[i]['timestamp_us'] = ts
+            data[i]['probability'] = proba
+            data[i]['tier'] = tier
+            data[i]['employees'] = employees
+            data[i]['model_version'] = versions.code(version)
+            data[i]['numeric'] = numeric
+            data[i]['numeric_raw'] = [interner.code(value) for interner, value in zip(raw_interners, raw)]
+            data[i]['categorical'] = [interner.code(value) for interner, value in zip(interners, categorical)]
+        return (data, [interner.values for interner in interners], versions.values,
+                [interner.values for interner in raw_interners])
+
+    def _write_part(self, day, data, categories, versions, raw, name=None):
+        directory = os.path.join(self.root, day)
+        os.makedirs(directory, exist_ok=True)
+        if name is None:
+            self._parts_written += 1
+            name = f"part-{os.getpid()}-{int(time.time() * 1000)}-{self._parts_written}"
+        path = os.path.join(directory, name)
+        order = np.argsort(data['timestamp_us'], kind='stable')
+        data = data[order]
+        np.savez_compressed(
+            f"{path}.tmp.npz",
+            timestamp_us=data['timestamp_us'], probability=data['probability'],
+            tier=data['tier'], employees=data['employees'], model_version=data['model_version'],
+            numeric=data['numeric'], numeric_raw=data['numeric_raw'], categorical=data['categorical'],
+        )
+        os.replace(f"{path}.tmp.npz", f"{path}.npz")
+        index = {
+            'rows': int(len(data)),
+            'min_timestamp_us': int(data['timestamp_us'][0]),
+            'max_timestamp_us': int(data['timestamp_us'][-1]),
+            'min_probability': float(data['probability'].min()),
+            'max_probability': float(data['probability'].max()),
+            'min_employees': int(data['employees'].min()),
+            'max_employees': int(data['employees'].max()),
+            'tier_counts': dict(zip(TIERS, np.bincount(data['tier'], minlength=4).tolist())),
+            'categories': dict(zip(CATEGORICAL_FIELDS, categories)),
+            'model_versions': versions,
+            'numeric_raw': dict(zip(NUMERIC_FIELDS, raw)),
+        }
+        # The index is written last: a part without one is incomplete and ignored
+        with open(f"{path}.idx.tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(f"{path}.idx.tmp", f"{path}.idx.json")
+
+    def flush(self):
+        """Write pending rows to their day partitions"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        with self._flush_lock:
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(day_of(row[0]), []).append(row)
+            for day, day_rows in by_day.items():
+                self._write_part(day, *self._encode(day_rows))
+
+    def compact_closed_days(self):
+        """Merge the many small parts of finished days into one part each"""
+        today = day_of((datetime.utcnow() - EPOCH) // timedelta(microseconds=1))
+        for day in self._days():
+            if day >= today:
+                continue
+            directory = os.path.join(self.root, day)
+            parts = self._part_paths(directory)
+            if len(parts) <= 1:
+                continue
+            lock_path = os.path.join(directory, '.compacting')
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(lock_path) as f:
+                        pid = int(f.read())
+                except (OSError, ValueError):
+                    continue  # just taken, not written yet
+                if not _pid_alive(pid):
+                    # Left behind by a worker that died mid-compaction; retried next cycle
+                    try:
+                        os.remove(lock_path)
+                    except FileNotFoundError:
+                        pass
+                continue  # another worker is on it
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            try:
+                loaded = [self._load_part(p) for p in parts]
+                loaded = [part for part in loaded if part is not None]
+                if not loaded:
+                    continue
+                rows = []
+                for index, columns in loaded:
+                    rows.extend(self._decode_rows(index, columns, np.arange(index['rows'])))
+                self._write_part(day, *self._encode(rows),
+                                 name=f"part-compacted-{int(time.time() * 1000)}")
+                for path in parts:
+                    for suffix in ('.idx.json', '.npz'):
+                        try:
+                            os.remove(path + suffix)
+                        except FileNotFoundError:
+                            pass
+                    self._index_cache.pop(path, None)
+            finally:
+                os.remove(lock_path)
+
+    def apply_retention(self):
+        """Delete day partitions older than the retention window"""
+        if not self.retention_days:
+            return
+        cutoff = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        for day in self._days():
+            if day < cutoff:
+                shutil.rmtree(os.path.join(self.root, day), ignore_errors=True)
+                self._part_paths(os.path.join(self.root, day))  # drops their cached indexes
+
+    # -- reading ---------------------------------------------------------
+
+    def _days(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if len(d) == 10 and d[4] == '-' and d[7] == '-')
+
+    def _part_paths(self, directory):
+        paths = sorted(p[:-len('.idx.json')] for p in glob.glob(os.path.join(directory, 'part-*.idx.json')))
+        # Forget the indexes of parts that are gone (compacted or expired)
+        current = set(paths)
+        for path in [p for p in list(self._index_cache) if os.path.dirname(p) == directory and p not in current]:
+            self._index_cache.pop(path, None)
+        return paths
+
+    def _index(self, path):
+        index = self._index_cache.get(path)
+        if index is None:
+            with open(f"{path}.idx.json", 'r') as f:
+                index = json.load(f)
+            self._index_cache[path] = index
+        return index
+
+    def _load_part(self, path):
+        try:
+            index = self._index(path)
+            with np.load(f"{path}.npz") as npz:
+                columns = {name: npz[name] for name in npz.files}
+            return index, columns
+        except FileNotFoundError:
+            # Removed by a concurrent compaction
+            self._index_cache.pop(path, None)
+            return None
+
+    @staticmethod
+    def _decode_rows(index, columns, selected):
+        """Rebuild pending-style row tuples (used when compacting)"""
+        categories = [index['categories'][f] + [None] for f in CATEGORICAL_FIELDS]
+        versions = index['model_versions'] + [None]
+        raw = [index.get('numeric_raw', {}).get(f, []) + [None] for f in NUMERIC_FIELDS]
+        raw_codes = columns.get('numeric_raw')
+        rows = []
+        for i in selected:
+            rows.append((
+                int(columns['timestamp_us'][i]), float(columns['probability'][i]),
+                int(columns['tier'][i]), int(columns['employees'][i]),
+                versions[columns['model_version'][i]],
+                columns['numeric'][i].tolist(),
+                # Parts written before raw values were kept have no such column
+                [None] * len(NUMERIC_FIELDS) if raw_codes is None
+                else [raw[j][code] for j, code in enumerate(raw_codes[i].tolist())],
+                [categories[j][code] for j, code in enumerate(columns['categorical'][i].tolist())],
+            ))
+        return rows
+
+    @staticmethod
+    def _materialize(index, columns, positions):
+        """JSON log entries for the given rows of a loaded part"""
+        rows = np.zeros(len(positions), dtype=LOG_DTYPE)
+        rows['numeric_raw'] = MISSING
+        for name in LOG_DTYPE.names:
+            if name in columns:
+                rows[name] = columns[name][positions]
+        raw = index.get('numeric_raw', {})
+        return PredictionRingBuffer.materialize(
+            rows, [index['categories'][f] for f in CATEGORICAL_FIELDS], index['model_versions'],
+            [raw.get(f, []) for f in NUMERIC_FIELDS])
+
+    @staticmethod
+    def _can_match(index, start_us, end_us, tiers, categories, bands):
+        """Decide from the part index alone whether any row could match"""
+        if start_us is not None and index['max_timestamp_us'] < start_us:
+            return False
+        if end_us is not None and index['min_timestamp_us'] > end_us:
+            return False
+        if tiers and not any(index['tier_counts'].get(t) for t in tiers):
+            return False
+        for field, wanted in categories.items():
+            if not set(index['categories'][field]) & wanted:
+                return False
+        if bands and not any(lo <= index['max_employees'] and hi >= index['min_employees']
+                             for lo, hi in (EMPLOYEE_BANDS[b] for b in bands)):
+            return False
+        return True
+
+    @staticmethod
+    def _mask(index, columns, start_us, end_us, tiers, categories, bands):
+        ts = columns['timestamp_us']
+        mask = np.ones(len(ts), dtype=bool)
+        if start_us is not None:
+            mask &= ts >= start_us
+        if end_us is not None:
+            mask &= ts <= end_us
+        if tiers:
+            mask &= np.isin(columns['tier'], [TIERS.index(t) for t in tiers])
+        for field, wanted in categories.items():
+            values = index['categories'][field]
+            codes = [code for code, value in enumerate(values) if value in wanted]
+            column = columns['categorical'][:, CATEGORICAL_FIELDS.index(field)]
+            mask &= np.isin(column, codes)
+        if bands:
+            employees = columns['employees']
+            band_mask = np.zeros(len(ts), dtype=bool)
+            for lo, hi in (EMPLOYEE_BANDS[b] for b in bands):
+                band_mask |= (employees >= lo) & (employees <= hi)
+            mask &= band_mask
+        return mask
+
+    def _pending_part(self):
+        """This worker's unflushed rows, shaped like a loaded part"""
+        with self._lock:
+            rows = list(self._pending)
+        if not rows:
+            return None
+        data, categories, versions, raw = self._encode(rows)
+        index = {
+            'rows': len(rows),
+            'min_timestamp_us': int(data['timestamp_us'].min()),
+            'max_timestamp_us': int(data['timestamp_us'].max()),
+            'min_employees': int(data['employees'].min()),
+            'max_employees': int(data['employees'].max()),
+            'tier_counts': dict(zip(TIERS, np.bincount(data['tier'], minlength=4).tolist())),
+            'categories': dict(zip(CATEGORICAL_FIELDS, categories)),
+            'model_versions': versions,
+            'numeric_raw': dict(zip(NUMERIC_FIELDS, raw)),
+        }
+        columns = {name: data[name] for name in data.dtype.names}
+        return index, columns
+
+    def iter_recent_features(self):
+        """Yield logged feature dicts, newest first
+
+        Parts written by different workers overlap in time, so a day's parts
+        are merged by timestamp. A part is only loaded once the merge reaches
+        its newest row, and its entries are built a chunk at a time as they
+        are consumed, so a caller that stops early (the cache warmer at its
+        budget) never materializes the rest of a large compacted part.
+        """
+        for day in reversed(self._days()):
+            parts = self._part_paths(os.path.join(self.root, day))
+            parts.sort(key=lambda p: self._index(p)['max_timestamp_us'], reverse=True)
+            heap = []  # (-timestamp, part number, entry, rest of the part)
+            opened = 0
+            while opened < len(parts) or heap:
+                while opened < len(parts) and (
+                        not heap or self._index(parts[opened])['max_timestamp_us'] >= -heap[0][0]):
+                    loaded = self._load_part(parts[opened])
+                    opened += 1
+                    if loaded is None:
+                        continue
+                    rows = self._iter_newest(*loaded)
+                    self._push_next(heap, opened, rows)
+                if heap:
+                    _, number, entry, rows = heapq.heappop(heap)
+                    yield entry['all_features_used']
+                    self._push_next(heap, number, rows)
+
+    def _iter_newest(self, index, columns, chunk_size=250):
+        """(timestamp, entry) for a loaded part's rows, newest first, built chunk_size rows at a time"""
+        for stop in range(index['rows'], 0, -chunk_size):
+            positions = np.arange(stop - 1, max(stop - chunk_size, 0) - 1, -1)
+            yield from zip(columns['timestamp_us'][positions].tolist(),
+                           self._materialize(index, columns, positions))
+
+    @staticmethod
+    def _push_next(heap, number, rows):
+        for timestamp, entry in rows:
+            heapq.heappush(heap, (-timestamp, number, entry, rows))
+            return
+
+    def query(self, start_us=None, end_us=None, tiers=None, industries=None,
+              territories=None, bands=None, limit=100):
+        """Filter history, returning aggregates over all matches and the newest `limit` rows"""
+        categories = {}
+        if industries:
+            categories['Industry'] = set(industries)
+        if territories:
+            categories['Territory'] = set(territories)
+        tiers = set(tiers or [])
+        bands = set(bands or [])
+
+        start_day = day_of(start_us) if start_us is not None else None
+        end_day = day_of(end_us) if end_us is not None else None
+        stats = {'days_total': 0, 'days_scanned': 0, 'parts_total': 0,
+                 'parts_scanned': 0, 'parts_pruned': 0, 'rows_scanned': 0}
+        matched = 0
+        tier_counts = np.zeros(4, dtype=np.int64)
+        probability_sum = 0.0
+        # Min-heap of the newest `limit` matches across all parts, which may
+        # overlap in time: (timestamp, part number, row, (index, part's candidate rows))
+        newest = []
+        considered = 0
+
+        def consider(index, columns):
+            nonlocal matched, probability_sum, considered
+            mask = self._mask(index, columns, start_us, end_us, tiers, categories, bands)
+            positions = np.flatnonzero(mask)
+            stats['rows_scanned'] += len(mask)
+            if not len(positions):
+                return
+            matched += len(positions)
+            tier_counts[:] += np.bincount(columns['tier'][positions], minlength=4)
+            probability_sum += float(columns['probability'][positions].astype(np.float64).sum())
+            # Keep copies of the part's newest `limit` matches, not the whole part
+            candidates = positions[::-1][:limit]
+            part = (index, {name: column[candidates] for name, column in columns.items()})
+            considered += 1
+            for row, timestamp in enumerate(part[1]['timestamp_us'].tolist()):
+                item = (timestamp, considered, row, part)
+                if len(newest) < limit:
+                    heapq.heappush(newest, item)
+                elif item[:3] > newest[0][:3]:
+                    heapq.heapreplace(newest, item)
+                else:
+                    break  # the rest of this part is older still
+
+        pending = self._pending_part()
+        if pending and self._can_match(pending[0], start_us, end_us, tiers, categories, bands):
+            consider(*pending)
+
+        with self._flush_lock:
+            days = self._days()
+        stats['days_total'] = len(days)
+        for day in reversed(days):
+            if (start_day and day < start_day) or (end_day and day > end_day):
+                continue
+            stats['days_scanned'] += 1
+            for path in self._part_paths(os.path.join(self.root, day)):
+                stats['parts_total'] += 1
+                if not self._can_match(self._index(path), start_us, end_us, tiers, categories, bands):
+                    stats['parts_pruned'] += 1
+                    continue
+                loaded = self._load_part(path)
+                if loaded is None:
+                    continue
+                stats['parts_scanned'] += 1
+                consider(*loaded)
+
+        by_part = {}
+        for timestamp, number, row, part in sorted(newest, key=lambda item: item[:3], reverse=True):
+            by_part.setdefault(number, (part, []))[1].append(row)
+        predictions = []
+        for (index, columns), rows in by_part.values():
+            predictions.extend(self._materialize(index, columns, rows))
+        predictions.sort(key=lambda e: e['timestamp'], reverse=True)
+
+        return {
+            'matched': matched,
+            'tier_distribution': {
+                tier: {
+                    'count': int(count),
+                    'percentage': round(count / matched * 100, 1) if matched else 0.0
+                } for tier, count in zip(TIERS, tier_counts.tolist())
+            },
+            'mean_probability': round(probability_sum / matched, 4) if matched else None,
+            'scan': stats,
+            'count': len(predictions),
+            'predictions': predictions[:limit],
+        }
@@ -0,0 +1,106 @@
+"""
+Thread budgets for model inference
+
+HistGradientBoostingClassifier predicts on an OpenMP thread pool, and NumPy
+may use a BLAS pool. By default each sizes itself to every core on the
+machine, in every gunicorn worker. A few workers on a small box then
+oversubscribe the cores, and one-row predictions, which gain nothing from
+threads, pay for waking and synchronising them in tail latency.
+
+The policy caps the pools with threadpoolctl:
+
+    single rows   calls under `batch_min_rows` rows run single-threaded
+    batches       larger calls get `batch_threads`
+    jobs          scoring job processes get `job_threads`
+    BLAS          capped process-wide at `blas_threads` when a model loads
+
+OpenMP limits apply to the thread that sets them, so every call site sets
+the budget for its own thread. The setting is remembered per thread and
+only changed when it differs, so repeated calls of the same kind cost one
+attribute check.
+"""
+
+import os
+import threading
+
+from threadpoolctl import ThreadpoolController
+
+
+def available_cpus():
+    """CPUs this process may run on (respects affinity masks and container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ThreadPolicy:
+    """How many OpenMP and BLAS threads inference may use, by kind of call"""
+
+    def __init__(self, batch_threads=None, job_threads=1, batch_min_rows=100, blas_threads=1):
+        """
+        Args:
+            batch_threads: OpenMP threads for calls of at least batch_min_rows
+                rows (default: available CPUs divided among gunicorn workers)
+            job_threads: OpenMP threads for each scoring job process
+            batch_min_rows: Smaller calls run single-threaded
+            blas_threads: Process-wide BLAS thread limit
+        """
+        self.cpus = available_cpus()
+        if batch_threads is None:
+            workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+            batch_threads = self.cpus // max(1, workers)
+        self.batch_threads = max(1, batch_threads)
+        self.job_threads = max(1, job_threads)
+        self.batch_min_rows = batch_min_rows
+        self.blas_threads = blas_threads
+        self._controller = None
+        self._generation = 0
+        self._libraries = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self):
+        """
+        Find the thread pools loaded so far and apply the process-wide limit
+
+        Called after each model load, since unpickling a model is what loads
+        its OpenMP runtime. Also makes the calling thread single-threaded.
+        """
+        controller = ThreadpoolController()
+        controller.limit(limits=self.blas_threads, user_api='blas')
+        with self._lock:
+            self._controller = controller
+            self._generation += 1
+            self._libraries = [{'user_api': lib.user_api, 'internal_api': lib.internal_api,
+                                'version': lib.version} for lib in controller.lib_controllers]
+        self.use(1)
+
+    def threads_for(self, rows):
+        return 1 if rows < self.batch_min_rows else self.batch_threads
+
+    def use(self, threads):
+        """Limit OpenMP in the calling thread"""
+        controller = self._controller
+        if controller is None:
+            return
+        local = self._local
+        if getattr(local, 'state', None) == (self._generation, threads):
+            return
+        controller.limit(limits=threads, user_api='openmp')
+        local.state = (self._generation, threads)
+
+    def for_rows(self, rows):
+        """Set the calling thread's budget for a predict call on this many rows"""
+        self.use(self.threads_for(rows))
+
+    def describe(self):
+        return {
+            'cpus': self.cpus,
+            'single_row_threads': 1,
+            'batch_min_rows': self.batch_min_rows,
+            'batch_threads': self.batch_threads,
+            'job_threads': self.job_threads,
+            'blas_threads': self.blas_threads,
+            'libraries': self._libraries,
+        }
@@ -0,0 +1,583 @@
+"""
+Asynchronous scoring jobs for rescoring runs too big for one request
+
+A job scores a whole dataset, either uploaded with the request or a file in
+the job input directory, and writes the results to a CSV file that can be
+downloaded once it has finished:
+
+    queued -> running -> succeeded | failed | cancelled
+
+The work happens in a pool of worker processes. The input is split into
+shards inside the pool, so the web worker never parses it, and each pool
+process unpickles the model once and keeps it for every shard it scores.
+Jobs are pinned to the model version that was active when they were
+created.
+
+Interactive traffic always comes first:
+
+    - pool processes run at a lower OS priority (nice) than the web workers
+    - at most `max_concurrent` jobs run at a time across all gunicorn
+      workers; further jobs wait in the queue (up to `max_queued`)
+    - a running job keeps at most one shard per pool process in flight and
+      submits no new shards while interactive scoring is under pressure
+
+Job state lives on disk, one directory per job, so any gunicorn worker can
+report a job's status, serve its results or cancel it, whichever worker is
+running it.
+"""
+
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inference_threads import ThreadPolicy
+from scoring import (FEATURE_NAMES, assign_tier, build_features, get_employee_count, normalize_field_names,
+                     score_frame)
+
+# Input formats by file extension
+INPUT_FORMATS = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.msgpack': 'msgpack',
+    '.arrow': 'arrow',
+    '.arrows': 'arrow',
+}
+
+# Input formats of uploaded bodies, by Content-Type
+UPLOAD_FORMATS = {
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/json': 'json',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.arrow.file': 'arrow',
+}
+
+# 'orphaned' is never written: readers report it for unfinished jobs whose worker is gone
+FINISHED = ('succeeded', 'failed', 'cancelled', 'orphaned')
+RESULT_COLUMNS = ['row', 'probability_closed_won', 'tier', 'employee_count', 'model_version', 'status', 'error']
+
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+POLL_SECONDS = 0.5
+
+
+# ---------------------------------------------------------------------------
+# Pool side: these run in the worker processes
+
+# Models unpickled by this pool process, by path
+_models = {}
+_thread_policy = None
+
+
+def _init_worker(nice, threads):
+    global _thread_policy
+    if nice:
+        os.nice(nice)
+    _thread_policy = ThreadPolicy(job_threads=threads)
+
+
+def _model(path):
+    model = _models.get(path)
+    if model is None:
+        with open(path, 'rb') as f:
+            model = _models[path] = pickle.load(f)
+        _thread_policy.configure()
+    return model
+
+
+def _ready():
+    return os.getpid()
+
+
+def _read_accounts(path, fmt, shard_size):
+    """Yield the input's accounts as lists of dicts, shard_size at a time"""
+    if fmt == 'csv':
+        # Blank cells become NaN, as build_features treats missing fields
+        for chunk in pd.read_csv(path, chunksize=shard_size):
+            yield chunk.to_dict('records')
+    elif fmt == 'jsonl':
+        batch = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) == shard_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    elif fmt == 'arrow':
+        import pyarrow as pa
+        source = pa.memory_map(path)
+        is_file = source.read(6) == b'ARROW1'
+        source.seek(0)
+        table = (pa.ipc.open_file(source) if is_file else pa.ipc.open_stream(source)).read_all()
+        for start in range(0, table.num_rows, shard_size):
+            # Nulls are missing values, like blank CSV cells
+            yield [{k: np.nan if v is None else v for k, v in row.items()}
+                   for row in table.slice(start, shard_size).to_pylist()]
+    else:
+        if fmt == 'msgpack':
+            from serialization import unpack
+            with open(path, 'rb') as f:
+                data = unpack(f.read())
+        else:
+            with open(path) as f:
+                data = json.load(f)
+        accounts = data.get('accounts') if isinstance(data, dict) else data
+        if not isinstance(accounts, list):
+            raise ValueError('Expected a list or {"accounts": [...]}')
+        for start in range(0, len(accounts), shard_size):
+            yield accounts[start:start + shard_size]
+
+
+def split_input(path, fmt, shard_dir, shard_size):
+    """Write the input out as pickled shards; returns (path, first row, rows) per shard"""
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = []
+    first_row = 0
+    for accounts in _read_accounts(path, fmt, shard_size):
+        shard_path = os.path.join(shard_dir, f'shard-{len(shards):05d}.pkl')
+        with open(shard_path, 'wb') as f:
+            pickle.dump(accounts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        shards.append((shard_path, first_row, len(accounts)))
+        first_row += len(accounts)
+    return shards
+
+
+def score_shard(model_path, model_version, shard_path, output_path, first_row, id_field=None):
+    """Score one shard and write its result rows (no header); returns (rows, errors)"""
+    with open(shard_path, 'rb') as f:
+        accounts = pickle.load(f)
+    model = _model(model_path)
+
+    results = []
+    rows = []
+    for i, account in enumerate(accounts):
+        result = {'row': first_row + i, 'model_version': model_version, 'status': 'error'}
+        if id_field:
+            result[id_field] = account.get(id_field) if isinstance(account, dict) else None
+        results.append(result)
+        if not isinstance(account, dict):
+            result['error'] = 'Account must be an object'
+            continue
+        account = normalize_field_names(account)
+        if 'Global Employees' not in account:
+            result['error'] = 'Missing: Global Employees'
+            continue
+        rows.append((result, build_features(account)))
+
+    if rows:
+        df = pd.DataFrame([features for _, features in rows], columns=FEATURE_NAMES)
+        _thread_policy.use(_thread_policy.job_threads)
+        for (result, features), proba in zip(rows, score_frame(model, df)):
+            if isinstance(proba, Exception):
+                result['error'] = str(proba)
+                continue
+            try:
+                employees = get_employee_count(features)
+                result.update(probability_closed_won=round(float(proba), 4),
+                              tier=assign_tier(proba, employees),
+                              employee_count=int(employees), status='success')
+            except Exception as e:
+                result['error'] = str(e)
+
+    columns = result_columns(id_field)
+    frame = pd.DataFrame(results, columns=columns)
+    frame['employee_count'] = frame['employee_count'].astype('Int64')
+    frame.to_csv(output_path, index=False, header=False)
+    return len(results), int((frame['status'] == 'error').sum())
+
+
+def merge_results(paths, results_path, columns):
+    """Concatenate the shard outputs, in order, under one header"""
+    tmp = results_path + '.tmp'
+    with open(tmp, 'w', newline='') as out:
+        pd.DataFrame(columns=columns).to_csv(out, index=False)
+        for path in paths:
+            with open(path, newline='') as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+    os.replace(tmp, results_path)
+    return os.path.getsize(results_path)
+
+
+def result_columns(id_field=None):
+    return RESULT_COLUMNS[:1] + ([id_field] if id_field else []) + RESULT_COLUMNS[1:]
+
+
+# ---------------------------------------------------------------------------
+# Web worker side
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+class JobManager:
+    """Creates jobs, runs the ones this worker accepted and reads any job's state"""
+
+    def __init__(self, root, input_dir, processes=1, max_concurrent=1, max_queued=10,
+                 shard_size=5000, nice=10, retention_hours=72, threads=1, pressure=None):
+        """
+        Args:
+            root: Directory holding one subdirectory per job
+            input_dir: The only directory jobs may read referenced files from
+            processes: Worker processes in this gunicorn worker's pool
+            max_concurrent: Jobs running at a time across all gunicorn workers
+            max_queued: Jobs waiting for a slot before new ones are refused
+            shard_size: Accounts per shard
+            nice: Priority increment for pool processes (0 to disable)
+            retention_hours: Finished jobs and their results are removed after this
+            threads: OpenMP threads each pool process may use
+            pressure: Callable that returns True while interactive traffic
+                needs the CPU; no new shards are submitted until it clears
+        """
+        self.root = root
+        self.input_dir = os.path.abspath(input_dir)
+        self.processes = processes
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.shard_size = shard_size
+        self.nice = nice
+        self.retention_hours = retention_hours
+        self.threads = threads
+        self.pressure = pressure
+        self._lock = threading.Lock()
+        self._pool = None
+        self._cancel = {}
+
+    # -- state files ------------------------------------------------------
+
+    def _dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def _write(self, job):
+        path = os.path.join(self._dir(job['id']), 'job.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)
+
+    def _update(self, job, **changes):
+        job.update(changes)
+        self._write(job)
+
+    def get(self, job_id):
+        """A job's state, or None if there is no such job"""
+        if not JOB_ID.fullmatch(job_id or ''):
+            return None
+        try:
+            with open(os.path.join(self._dir(job_id), 'job.json')) as f:
+                job = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return self._derive_state(job)
+
+    @staticmethod
+    def _derive_state(job):
+        """Report an unfinished job whose worker is gone as orphaned; job.json is only written by its owner"""
+        if job['state'] not in FINISHED and not _pid_alive(job['pid']):
+            job.update(state='orphaned', error='The worker running this job exited')
+        return job
+
+    def list(self, limit=50):
+        """Most recently created jobs first"""
+        jobs = [self.get(job_id) for job_id in self._job_ids()]
+        jobs = [job for job in jobs if job is not None]
+        jobs.sort(key=lambda job: job['created_at'], reverse=True)
+        return jobs[:limit]
+
+    def _job_ids(self):
+        try:
+            return [name for name in os.listdir(self.root) if JOB_ID.fullmatch(name)]
+        except FileNotFoundError:
+            return []
+
+    def result_path(self, job_id):
+        """Path of a succeeded job's results file"""
+        job = self.get(job_id)
+        if job is None or job['state'] != 'succeeded':
+            return None
+        return os.path.join(self._dir(job_id), 'results.csv')
+
+    def resolve_input(self, name):
+        """Only allow jobs to read known formats from the input directory"""
+        path = os.path.abspath(os.path.join(self.input_dir, name))
+        if os.path.commonpath([path, self.input_dir]) != self.input_dir:
+            raise ValueError('Input must be a file in the job input directory')
+        fmt = INPUT_FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise ValueError(f"Input must be one of: {', '.join(sorted(INPUT_FORMATS))}")
+        if not os.path.isfile(path):
+            raise ValueError(f'Input file not found: {name}')
+        return path, fmt
+
+    # -- creating and cancelling --------------------------------------------
+
+    def create(self, model_path, model_version, fmt, input_path=None, upload=None, id_field=None):
+        """
+        Queue a job over a referenced input file or an uploaded stream
+
+        Returns the new job, or None when the queue is full.
+        """
+        if id_field in RESULT_COLUMNS:
+            raise ValueError(f'id_field may not be one of the result columns: {id_field}')
+        self.apply_retention()
+        pending = sum(1 for job in self.list(limit=None) if job['state'] not in FINISHED)
+        if pending >= self.max_concurrent + self.max_queued:
+            return None
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._dir(job_id)
+        os.makedirs(job_dir)
+        if upload is not None:
+            input_path = os.path.join(job_dir, f'input.{fmt}')
+            with open(input_path, 'wb') as f:
+                shutil.copyfileobj(upload, f, 1 << 20)
+            if os.path.getsize(input_path) == 0:
+                shutil.rmtree(job_dir)
+                raise ValueError('Empty request body')
+        job = {
+            'id': job_id,
+            'state': 'queued',
+            'phase': None,
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'pid': os.getpid(),
+            'input': {
+                'source': 'upload' if upload is not None else os.path.relpath(input_path, self.input_dir),
+                'format': fmt,
+                'bytes': os.path.getsize(input_path),
+            },
+            'id_field': id_field,
+            'model_version': model_version,
+            'model_path': os.path.abspath(model_path),
+            'rows_total': None,
+            'rows_done': 0,
+            'rows_failed': 0,
+            'shards_total': None,
+            'shards_done': 0,
+            'progress': 0.0,
+            'elapsed_seconds': None,
+            'rows_per_second': None,
+            'throttled_seconds': 0.0,
+            'result_bytes': None,
+            'error': None,
+        }
+        self._write(job)
+        cancel = threading.Event()
+        with self._lock:
+            self._cancel[job_id] = cancel
+        threading.Thread(target=self._run, args=(job, input_path, cancel), daemon=True,
+                         name=f'job-{job_id[:8]}').start()
+        print(f"[jobs] Queued job {job_id} ({job['input']['source']}, {fmt})")
+        return job
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop; returns its state, or None if unknown"""
+        job = self.get(job_id)
+        if job is None or job['state'] in FINISHED:
+            return job
+        # The flag file reaches the job from whichever gunicorn worker runs it
+        open(os.path.join(self._dir(job_id), 'cancel'), 'w').close()
+        with self._lock:
+            event = self._cancel.get(job_id)
+        if event is not None:
+            event.set()
+        return job
+
+    def _cancelled(self, job, cancel):
+        return cancel.is_set() or os.path.exists(os.path.join(self._dir(job['id']), 'cancel'))
+
+    # -- running --------------------------------------------------------------
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_worker, initargs=(self.nice, self.threads))
+                # Spawned processes re-import the parent's __main__ module. Under
+                # `python app.py` that would start a second API in every pool
+                # process, so they are started while __main__ is hidden
+                main = sys.modules['__main__']
+                sys.modules['__main__'] = types.ModuleType('__main__')
+                try:
+                    for future in [pool.submit(_ready) for _ in range(self.processes)]:
+                        future.result()
+                finally:
+                    sys.modules['__main__'] = main
+                self._pool = pool
+            return self._pool
+
+    def _claim_slot(self, job_id):
+        """Take one of the max_concurrent run slots shared by all gunicorn workers"""
+        slots = os.path.join(self.root, '.slots')
+        os.makedirs(slots, exist_ok=True)
+        for i in range(self.max_concurrent):
+            path = os.path.join(slots, f'slot-{i}')
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path) as f:
+                        pid = int(f.read().split()[0])
+                except (OSError, ValueError, IndexError):
+                    continue  # just claimed, not written yet
+                if not _pid_alive(pid):
+                    # Left behind by a worker that died mid-job
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{os.getpid()} {job_id}')
+            return path
+        return None
+
+    def _run(self, job, input_path, cancel):
+        slot = None
+        try:
+            while slot is None:
+                if self._cancelled(job, cancel):
+                    self._update(job, state='cancelled', finished_at=_now())
+                    return
+                slot = self._claim_slot(job['id'])
+                if slot is None:
+                    time.sleep(POLL_SECONDS)
+            self._execute(job, input_path, cancel)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._pool = None
+            self._update(job, state='failed', error=str(e) or type(e).__name__, finished_at=_now())
+        finally:
+            if slot is not None:
+                os.remove(slot)
+            with self._lock:
+                self._cancel.pop(job['id'], None)
+            shutil.rmtree(os.path.join(self._dir(job['id']), 'shards'), ignore_errors=True)
+            if job['input']['source'] == 'upload':
+                try:
+                    os.remove(input_path)
+                except FileNotFoundError:
+                    pass
+            print(f"[jobs] Job {job['id']} {job['state']}"
+                  + (f": {job['error']}" if job['error'] else ''))
+
+    def _wait(self, future, job, cancel):
+        """Result of a pool task, or None if the job is cancelled meanwhile"""
+        while not future.done():
+            if self._cancelled(job, cancel):
+                future.cancel()
+                return None
+            wait([future], timeout=POLL_SECONDS)
+        return future.result()
+
+    def _execute(self, job, input_path, cancel):
+        pool = self._executor()
+        started = time.monotonic()
+        self._update(job, state='running', phase='splitting', started_at=_now())
+        shard_dir = os.path.join(self._dir(job['id']), 'shards')
+        shards = self._wait(pool.submit(split_input, input_path, job['input']['format'],
+                                        shard_dir, self.shard_size), job, cancel)
+        if shards is None:
+            self._update(job, state='cancelled', finished_at=_now())
+            return
+        self._update(job, phase='scoring', shards_total=len(shards),
+                     rows_total=sum(rows for _, _, rows in shards))
+
+        outputs = [os.path.join(shard_dir, f'result-{i:05d}.csv') for i in range(len(shards))]
+        pending = deque(range(len(shards)))
+        running = {}
+        while pending or running:
+            if self._cancelled(job, cancel):
+                for future in running:
+                    future.cancel()
+                self._update(job, state='cancelled', finished_at=_now())
+                return
+            while pending and len(running) < self.processes:
+                if self.pressure is not None and self.pressure():
+                    break
+                i = pending.popleft()
+                shard_path, first_row, _ = shards[i]
+                running[pool.submit(score_shard, job['model_path'], job['model_version'], shard_path,
+                                    outputs[i], first_row, job['id_field'])] = i
+            if not running:
+                # Interactive scoring is busy; leave the CPU to it for now
+                time.sleep(POLL_SECONDS)
+                job['throttled_seconds'] = round(job['throttled_seconds'] + POLL_SECONDS, 1)
+                continue
+            done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                try:
+                    rows, errors = future.result()
+                except Exception:
+                    # Don't leave the other shards occupying the pool for a failed job
+                    for other in running:
+                        other.cancel()
+                    raise
+                job['rows_done'] += rows
+                job['rows_failed'] += errors
+                job['shards_done'] += 1
+            if done:
+                elapsed = time.monotonic() - started
+                self._update(job, elapsed_seconds=round(elapsed, 1),
+                             progress=round(job['rows_done'] / job['rows_total'], 4),
+                             rows_per_second=round(job['rows_done'] / elapsed, 1))
+
+        self._update(job, phase='writing')
+        size = self._wait(pool.submit(merge_results, outputs, os.path.join(self._dir(job['id']), 'results.csv'),
+                                      result_columns(job['id_field'])), job, cancel)
+        if size is None:
+            self._update(job, state='cancelled', finished_at=_now())
+            return
+        self._update(job, state='succeeded', phase=None, progress=1.0, result_bytes=size, finished_at=_now(),
+                     elapsed_seconds=round(time.monotonic() - started, 1))
+
+    def apply_retention(self):
+        """Remove finished jobs older than retention_hours"""
+        if not self.retention_hours:
+            return
+        cutoff = time.time() - self.retention_hours * 3600
+        for job_id in self._job_ids():
+            path = os.path.join(self._dir(job_id), 'job.json')
+            try:
+                with open(path) as f:
+                    state = self._derive_state(json.load(f))['state']
+                if state in FINISHED and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(self._dir(job_id), ignore_errors=True)
+            except (OSError, ValueError, KeyError):
+                continue
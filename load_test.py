@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Local load-testing harness for the Tapcheck Prediction API
+
+Starts the app under gunicorn with the requested number of workers and
+threads, replays request payloads against it and reports throughput,
+latency percentiles and error rate per endpoint.
+
+Examples:
+
+    # 8 concurrent clients against 2 sync workers for 30 seconds
+    python load_test.py --workers 2 --concurrency 8 --duration 30
+
+    # Open-loop: 50 requests/second against 2 workers x 4 threads
+    python load_test.py --workers 2 --threads 4 --rate 50 --duration 60
+
+    # Replay captured payloads (one JSON object per line)
+    python load_test.py --payloads captured_requests.jsonl
+
+    # Hit an already running server instead of starting gunicorn
+    python load_test.py --url http://localhost:5000 --concurrency 4
+
+Payload files are JSONL. Each line is either a bare /predict payload, e.g.
+{"global_employees": "50", "industry": "Retail"}, or an explicit request:
+{"endpoint": "/predict", "method": "POST", "payload": {...}}.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Value pools for synthetic Clay-style payloads
+INDUSTRIES = ['Retail', 'Healthcare', 'Construction', 'Transportation', 'Technology',
+              'Manufacturing', 'Finance', 'Education', 'Senior Living', 'Other']
+TERRITORIES = ['Micro - Retail', 'Enterprise - Other', 'Unknown - Other', 'Mid-Market',
+               'Micro - Other', 'Enterprise Territory']
+TYPES = ['Employer', 'Partner', 'Prospect']
+VERTICALS = ['Retail & Hospitality', 'Healthcare', 'Industrial', '-']
+PAYROLL = ['ADP', 'Paychex', 'Viventium', 'Workday', 'New Payroll', 'UKG Pro', '-']
+STATES = ['CA', 'TX', 'NY', 'FL', 'WA', 'IL']
+
+
+def synthetic_payload(rng):
+    """Build a random payload in the format Clay sends"""
+    global_emp = int(rng.lognormvariate(5, 1.5))
+    eligible = int(global_emp * rng.uniform(0.5, 0.95)) if rng.random() < 0.6 else 0
+    payload = {
+        'global_employees': global_emp,
+        'eligible_employees': eligible,
+        'industry': rng.choice(INDUSTRIES),
+        'territory': rng.choice(TERRITORIES),
+        'type': rng.choice(TYPES),
+    }
+    # Roughly half of Clay rows carry the full enrichment set
+    if rng.random() < 0.5:
+        payload.update({
+            'Billing State/Province': rng.choice(STATES),
+            'Vertical': rng.choice(VERTICALS),
+            'Are they using a Competitor?': rng.choice(['Yes', 'No', '-']),
+            'Company Payroll Software': rng.choice(PAYROLL),
+            'Marketing Source': rng.choice(['Direct', 'Referral', 'Partner']),
+            'Strategic Account': rng.choice(['true', 'false']),
+        })
+    return payload
+
+
+def load_payloads(path, default_endpoint):
+    """Read a JSONL payload file into a list of request specs"""
+    specs = []
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_no}: {e}")
+                continue
+            if isinstance(item, dict) and 'payload' in item:
+                endpoint = item.get('endpoint', default_endpoint)
+                method = item.get('method', 'POST').upper()
+                specs.append((endpoint, method, item['payload']))
+            else:
+                specs.append((default_endpoint, 'POST', item))
+    if not specs:
+        raise SystemExit(f"No payloads found in {path}")
+    return specs
+
+
+def parse_targets(values):
+    """Parse --endpoint values of the form /path or /path:weight"""
+    targets = []
+    for value in values or ['/predict']:
+        path, _, weight = value.partition(':')
+        targets.append((path, float(weight) if weight else 1.0))
+    return targets
+
+
+class RequestSource:
+    """Thread-safe supplier of (endpoint, method, payload) tuples"""
+
+    def __init__(self, specs=None, targets=None, seed=0):
+        self.specs = specs
+        self.targets = targets
+        self.rng = random.Random(seed)
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            if self.specs:
+                spec = self.specs[self.index % len(self.specs)]
+                self.index += 1
+                return spec
+            paths = [t[0] for t in self.targets]
+            weights = [t[1] for t in self.targets]
+            endpoint = self.rng.choices(paths, weights)[0]
+            if endpoint.startswith('/predict'):
+                return endpoint, 'POST', synthetic_payload(self.rng)
+            return endpoint, 'GET', None
+
+
+class Stats:
+    """Per-endpoint latency and error accumulator"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.status_codes = {}
+
+    def record(self, endpoint, latency_ms, status):
+        key = endpoint.split('?')[0]
+        with self.lock:
+            self.latencies.setdefault(key, []).append(latency_ms)
+            codes = self.status_codes.setdefault(key, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+            if not (isinstance(status, int) and 200 <= status < 300):
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Client:
+    """Keep-alive HTTP connection owned by a single load thread"""
+
+    def __init__(self, base_url, timeout):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.https = parsed.scheme == 'https'
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def send(self, endpoint, method, payload):
+        if self.conn is None:
+            self._connect()
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self.conn.request(method, endpoint, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException) as e:
+            # Drop the connection so the next request reconnects
+            self.conn.close()
+            self.conn = None
+            return type(e).__name__
+
+
+def run_closed_loop(source, stats, base_url, concurrency, deadline, max_requests, timeout):
+    """Each thread sends its next request as soon as the previous one returns"""
+    remaining = [max_requests] if max_requests else None
+    remaining_lock = threading.Lock()
+
+    def worker():
+        client = Client(base_url, timeout)
+        while time.perf_counter() < deadline:
+            if remaining is not None:
+                with remaining_lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            endpoint, method, payload = source.next()
+            start = time.perf_counter()
+            status = client.send(endpoint, method, payload)
+            stats.record(endpoint, (time.perf_counter() - start) * 1000, status)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open_loop(source, stats, base_url, rate, concurrency, deadline, max_requests, timeout):
+    """Send at a fixed arrival rate regardless of how fast responses come back.
+
+    Latency is measured from each request's scheduled send time, so time spent
+    waiting for a free client thread is counted (no coordinated omission).
+    """
+    schedule = queue.Queue()
+    stop = object()
+
+    def worker():
+        client = Client(base_url, timeout)
+        while True:
+            item = schedule.get()
+            if item is stop:
+                return
+            scheduled_at, (endpoint, method, payload) = item
+            status = client.send(endpoint, method, payload)
+            stats.record(endpoint, (time.perf_counter() - scheduled_at) * 1000, status)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        scheduled_at = start + sent * interval
+        if scheduled_at >= deadline or (max_requests and sent >= max_requests):
+            break
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        schedule.put((scheduled_at, source.next()))
+        sent += 1
+
+    for _ in threads:
+        schedule.put(stop)
+    for t in threads:
+        t.join()
+
+
+def build_report(stats, elapsed, config):
+    """Summarize recorded latencies per endpoint and overall"""
+    def summarize(latencies, errors, codes):
+        values = sorted(latencies)
+        count = len(values)
+        return {
+            'requests': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4) if count else 0.0,
+            'throughput_rps': round(count / elapsed, 2) if elapsed else 0.0,
+            'latency_ms': {
+                'mean': round(sum(values) / count, 2) if count else None,
+                'p50': round(percentile(values, 50), 2) if count else None,
+                'p95': round(percentile(values, 95), 2) if count else None,
+                'p99': round(percentile(values, 99), 2) if count else None,
+                'p999': round(percentile(values, 99.9), 2) if count else None,
+                'max': round(values[-1], 2) if count else None,
+            },
+            'status_codes': codes,
+        }
+
+    endpoints = {}
+    all_latencies = []
+    all_codes = {}
+    for endpoint, latencies in stats.latencies.items():
+        codes = stats.status_codes.get(endpoint, {})
+        endpoints[endpoint] = summarize(latencies, stats.errors.get(endpoint, 0), codes)
+        all_latencies.extend(latencies)
+        for code, n in codes.items():
+            all_codes[code] = all_codes.get(code, 0) + n
+
+    return {
+        'config': config,
+        'elapsed_seconds': round(elapsed, 2),
+        'endpoints': endpoints,
+        'overall': summarize(all_latencies, sum(stats.errors.values()), all_codes),
+    }
+
+
+def print_report(report):
+    config = report['config']
+    print("\n" + "=" * 96)
+    print(f"Mode: {config['mode']}  Target: {config['url']}  "
+          f"Workers: {config['workers']}  Threads: {config['threads']}  "
+          f"Concurrency: {config['concurrency']}"
+          + (f"  Rate: {config['rate']}/s" if config['rate'] else ''))
+    print(f"Elapsed: {report['elapsed_seconds']}s")
+    print("=" * 96)
+    header = f"{'endpoint':<36}{'reqs':>7}{'err%':>7}{'rps':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'p999':>8}{'max':>8}"
+    print(header)
+    print("-" * 96)
+    rows = list(report['endpoints'].items()) + [('OVERALL', report['overall'])]
+    for name, summary in rows:
+        lat = summary['latency_ms']
+
+        def fmt(value):
+            return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+        print(f"{name:<36}{summary['requests']:>7}{summary['error_rate'] * 100:>6.1f}%"
+              f"{summary['throughput_rps']:>9.1f}{fmt(lat['p50'])}{fmt(lat['p95'])}"
+              f"{fmt(lat['p99'])}{fmt(lat['p999'])}{fmt(lat['max'])}")
+    print("-" * 96)
+    print("Latencies in milliseconds. Status codes:",
+          json.dumps(report['overall']['status_codes']))
+
+
+def wait_until_healthy(base_url, timeout, process=None):
+    """Poll /health until the server answers or the timeout expires"""
+    client = Client(base_url, 5)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {process.returncode}")
+        if client.send('/health', 'GET', None) == 200:
+            return
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {base_url} did not become healthy within {timeout}s")
+
+
+def start_gunicorn(args, log_dir):
+    """Launch the app under gunicorn from the repository directory"""
+    cmd = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{args.port}',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--log-level', 'warning',
+    ] + (args.gunicorn_arg or []) + ['app:app']
+    env = dict(os.environ)
+    # Keep load-test traffic out of the real prediction log
+    env['PREDICTION_LOG_FILE'] = os.path.join(log_dir, 'api_predictions_log.json')
+    env['HISTORY_DIR'] = os.path.join(log_dir, 'prediction_history')
+    env['ROLLUP_DIR'] = os.path.join(log_dir, 'prediction_rollups')
+    env['GUNICORN_THREADS'] = str(args.threads)
+    print(f"Starting: {' '.join(cmd)}")
+    return subprocess.Popen(cmd, cwd=REPO_DIR, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Target an already running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=8765, help='Port for the local gunicorn server')
+    parser.add_argument('--gunicorn-arg', action='append', help='Extra argument passed to gunicorn (repeatable)')
+    parser.add_argument('--payloads', help='JSONL file of payloads to replay (default: synthetic Clay payloads)')
+    parser.add_argument('--endpoint', action='append',
+                        help='Synthetic target as /path or /path:weight (repeatable, default /predict)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads (max requests in flight)')
+    parser.add_argument('--rate', type=float, help='Open-loop arrival rate in requests/second')
+    parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of untimed warm-up traffic')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for synthetic payloads')
+    parser.add_argument('--json', dest='json_out', help='Also write the report as JSON to this file')
+    args = parser.parse_args()
+
+    if args.payloads:
+        source = RequestSource(specs=load_payloads(args.payloads, '/predict'))
+    else:
+        source = RequestSource(targets=parse_targets(args.endpoint), seed=args.seed)
+
+    process = None
+    log_dir = tempfile.mkdtemp(prefix='tapcheck-loadtest-')
+    base_url = args.url or f'http://127.0.0.1:{args.port}'
+    try:
+        if not args.url:
+            process = start_gunicorn(args, log_dir)
+        wait_until_healthy(base_url, 120, process)
+
+        if args.warmup > 0:
+            print(f"Warming up for {args.warmup}s...")
+            run_closed_loop(source, Stats(), base_url, args.concurrency,
+                            time.perf_counter() + args.warmup, None, args.timeout)
+
+        mode = 'open-loop' if args.rate else 'closed-loop'
+        print(f"Running {mode} test for {args.duration}s...")
+        stats = Stats()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        if args.rate:
+            run_open_loop(source, stats, base_url, args.rate, args.concurrency,
+                          deadline, args.requests, args.timeout)
+        else:
+            run_closed_loop(source, stats, base_url, args.concurrency,
+                            deadline, args.requests, args.timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        # Only written to by the server started above
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    config = {
+        'mode': mode,
+        'url': base_url,
+        'workers': None if args.url else args.workers,
+        'threads': None if args.url else args.threads,
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'payloads': args.payloads or 'synthetic',
+    }
+    report = build_report(stats, elapsed, config)
+    print_report(report)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json_out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Versioned model registry with zero-downtime hot-swap
+
+A new model version is unpickled, warmed and parity-checked in a background
+thread, then swapped in by replacing a single reference. Requests pin the
+version they started with via acquire(), so in-flight requests finish on
+the old model and it is only released once the last of them completes.
+
+Each gunicorn worker holds its own registry. Promotions are written to a
+small pointer file that every worker polls, so all workers converge on the
+same version without a restart.
+"""
+
+import json
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from scoring import FEATURE_NAMES
+
+# Representative Clay rows used to warm a model and compare versions
+WARMUP_ROWS = [
+    {'Global Employees': 50, 'Eligible Employees': np.nan, 'Industry': 'Retail',
+     'Territory': 'Micro - Retail', 'Type': 'Employer'},
+    {'Global Employees': 23196, 'Eligible Employees': np.nan, 'Industry': 'Construction',
+     'Territory': 'Enterprise - Other', 'Type': 'Employer'},
+    {'Global Employees': 500, 'Eligible Employees': 400, 'Industry': 'Technology',
+     'Territory': 'Mid-Market', 'Type': 'Employer'},
+    {'Global Employees': 800, 'Eligible Employees': 650, 'Industry': 'Healthcare',
+     'Billing State/Province': 'TX', 'Marketing Source': 'Referral'},
+    {'Global Employees': 5000, 'Eligible Employees': 4500, 'Industry': 'Manufacturing',
+     'Predicted Eligible Employees': 4200, 'Revenue in Last 30 Days': 250000,
+     'Territory': 'Europe', 'Type': 'Enterprise', 'Vertical': 'Industrial',
+     'Are they using a Competitor?': 'Yes', 'Company Payroll Software': 'Workday',
+     'Strategic Account': 'Yes'},
+    {'Global Employees': 150, 'Eligible Employees': 120, 'Industry': 'Healthcare',
+     'Company Payroll Software': 'Viventium', 'Are they using a Competitor?': 'No'},
+]
+
+
+def warmup_frame():
+    """DataFrame of the warm-up rows in the column order the model expects"""
+    return pd.DataFrame([{f: row.get(f, np.nan) for f in FEATURE_NAMES} for row in WARMUP_ROWS],
+                        columns=FEATURE_NAMES)
+
+
+def version_from_path(path):
+    """Derive a version name from a model file, e.g. tapcheck_v4_model.pkl -> tapcheck_v4"""
+    name = os.path.basename(path)
+    for suffix in ('_model.pkl', '.pkl'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class ModelVersion:
+    """A loaded model plus the number of requests currently using it"""
+
+    def __init__(self, version, model, path):
+        self.version = version
+        self.model = model
+        self.path = path
+        self.loaded_at = datetime.utcnow().isoformat()
+        self.in_flight = 0
+        self.retired = False
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'in_flight': self.in_flight,
+        }
+
+
+class ModelRegistry:
+    """Holds the active model version and swaps it atomically"""
+
+    def __init__(self, pointer_file=None, parity_tolerance=None, thread_policy=None):
+        self.pointer_file = pointer_file
+        self.parity_tolerance = parity_tolerance
+        self.thread_policy = thread_policy
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._active = None
+        self._retiring = []
+        self._pointer_mtime = None
+        self._activate_callbacks = []
+        self.load_status = {'state': 'idle'}
+        self.events = deque(maxlen=50)
+
+    @property
+    def active(self):
+        return self._active
+
+    def _event(self, message):
+        print(f"[model-registry] {message}")
+        self.events.append({'timestamp': datetime.utcnow().isoformat(), 'message': message})
+
+    def read_model(self, path, version=None):
+        """Unpickle a model file and check it can score the warm-up rows"""
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        if self.thread_policy is not None:
+            # Unpickling loads the model's OpenMP runtime; cap it before warm-up
+            self.thread_policy.configure()
+        loaded = ModelVersion(version or version_from_path(path), model, path)
+        self.check_model(model)
+        return loaded
+
+    def check_model(self, model):
+        """Warm a model on sample rows and verify its output is usable.
+
+        Returns the warm-up probabilities of the positive class.
+        """
+        if not hasattr(model, 'predict_proba'):
+            raise ValueError('Model has no predict_proba method')
+        names = getattr(model, 'feature_names_in_', None)
+        if names is not None and list(names) != FEATURE_NAMES:
+            raise ValueError(f'Model expects features {list(names)}')
+
+        df = warmup_frame()
+        # The first calls pay for lazy initialization inside sklearn/OpenMP
+        model.predict_proba(df)
+        model.predict_proba(df.iloc[:1])
+        proba = model.predict_proba(df)
+        if proba.shape != (len(df), 2):
+            raise ValueError(f'predict_proba returned shape {proba.shape}, expected ({len(df)}, 2)')
+        if not np.all(np.isfinite(proba)) or proba.min() < 0 or proba.max() > 1:
+            raise ValueError('predict_proba returned values outside [0, 1]')
+        return proba[:, 1]
+
+    def parity_report(self, candidate, reference, tolerance=None):
+        """Compare two model versions on the warm-up rows"""
+        new = self.check_model(candidate.model)
+        old = self.check_model(reference.model)
+        max_delta = float(np.max(np.abs(new - old)))
+        report = {
+            'reference_version': reference.version,
+            'rows': len(new),
+            'max_abs_delta': round(max_delta, 4),
+            'mean_abs_delta': round(float(np.mean(np.abs(new - old))), 4),
+            'tolerance': tolerance,
+            'passed': tolerance is None or max_delta <= tolerance,
+        }
+        return report
+
+    def activate(self, loaded):
+        """Swap in a new version; the old one is released once its requests finish"""
+        with self._lock:
+            previous = self._active
+            self._active = loaded
+            if previous is not None:
+                previous.retired = True
+                if previous.in_flight:
+                    self._retiring.append(previous)
+                else:
+                    previous.model = None
+        if previous is not None:
+            self._event(f"Activated {loaded.version} (replacing {previous.version}, "
+                        f"{previous.in_flight} request(s) still in flight)")
+        else:
+            self._event(f"Activated {loaded.version}")
+        for callback in self._activate_callbacks:
+            try:
+                callback(loaded)
+            except Exception as e:
+                self._event(f"Activation callback failed for {loaded.version}: {e}")
+
+    def on_activate(self, callback):
+        """Call callback(version) after each later activation, in the activating thread"""
+        self._activate_callbacks.append(callback)
+
+    @contextmanager
+    def acquire(self):
+        """Pin the active model version for the duration of a request"""
+        with self._lock:
+            current = self._active
+            current.in_flight += 1
+        try:
+            yield current
+        finally:
+            with self._lock:
+                current.in_flight -= 1
+                drained = current.retired and current.in_flight == 0 and current in self._retiring
+                if drained:
+                    self._retiring.remove(current)
+                    current.model = None
+            if drained:
+                self._event(f"Released {current.version} after in-flight requests drained")
+
+    def load_initial(self, path, version=None):
+        """Load the startup model synchronously, honouring a promoted pointer"""
+        pointer = self._read_pointer()
+        if pointer:
+            try:
+                self.activate(self.read_model(pointer['path'], pointer.get('version')))
+                return
+            except Exception as e:
+                self._event(f"Could not load promoted model {pointer.get('path')}: {e}")
+        self.activate(self.read_model(path, version))
+
+    def load_async(self, path, version=None, tolerance=None, promote=True):
+        """Load, warm and check a model in the background, then swap it in.
+
+        Returns False if another load is already running.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return False
+        version = version or version_from_path(path)
+        tolerance = self.parity_tolerance if tolerance is None else tolerance
+        self.load_status = {'state': 'loading', 'version': version, 'path': path,
+                            'started_at': datetime.utcnow().isoformat()}
+
+        def run():
+            start = time.perf_counter()
+            try:
+                loaded = self.read_model(path, version)
+                parity = self.parity_report(loaded, self._active, tolerance) if self._active else None
+                if parity and not parity['passed']:
+                    raise ValueError(f"Parity check failed: max delta {parity['max_abs_delta']} "
+                                     f"exceeds tolerance {tolerance}")
+                self.activate(loaded)
+                if promote:
+                    self._write_pointer(path, version)
+                self.load_status = {'state': 'active', 'version': version, 'path': path,
+                                    'parity': parity,
+                                    'load_seconds': round(time.perf_counter() - start, 3)}
+            except Exception as e:
+                self._event(f"Failed to load {version} from {path}: {e}")
+                self.load_status = {'state': 'failed', 'version': version, 'path': path,
+                                    'error': str(e)}
+            finally:
+                self._load_lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def _read_pointer(self):
+        if not self.pointer_file or not os.path.exists(self.pointer_file):
+            return None
+        try:
+            self._pointer_mtime = os.path.getmtime(self.pointer_file)
+            with open(self.pointer_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            self._event(f"Could not read model pointer {self.pointer_file}: {e}")
+            return None
+
+    def _write_pointer(self, path, version):
+        if not self.pointer_file:
+            return
+        tmp = f"{self.pointer_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'path': path, 'version': version,
+                       'promoted_at': datetime.utcnow().isoformat()}, f)
+        os.replace(tmp, self.pointer_file)
+        self._pointer_mtime = os.path.getmtime(self.pointer_file)
+
+    def watch_pointer(self, interval=10):
+        """Poll the pointer file so promotions made via other workers are picked up"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if not self.pointer_file or not os.path.exists(self.pointer_file):
+                        continue
+                    if os.path.getmtime(self.pointer_file) == self._pointer_mtime:
+                        continue
+                    pointer = self._read_pointer()
+                    if pointer and self._active and pointer.get('version') != self._active.version:
+                        self.load_async(pointer['path'], pointer.get('version'), promote=False)
+                except Exception as e:
+                    print(f"[model-registry] Pointer watch error: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def describe(self):
+        with self._lock:
+            return {
+                'active': self._active.describe() if self._active else None,
+                'retiring': [m.describe() for m in self._retiring],
+                'last_load': self.load_status,
+                'events': list(self.events)[-10:],
+            }
@@ -0,0 +1,230 @@
+"""
+Prediction result cache
+
+Scores depend only on the feature vector and the model version, so repeat
+accounts can skip inference. Results are kept in an LRU keyed by
+(model version, normalized feature tuple); a hot-swapped model simply
+stops matching the old entries, which age out.
+
+After a deploy or cold start the cache is empty, so CacheWarmer preloads it
+in the background from persisted prediction history: it ranks the distinct
+feature vectors seen there by frequency (then recency) and scores the top
+ones in vectorized batches, within a time and memory budget. It never
+blocks startup or readiness.
+"""
+
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from scoring import FEATURE_NAMES, score_frame
+
+# Key markers for missing values. NaN (field absent) and None (explicit
+# null) are kept apart because the model's imputer treats them differently.
+_NAN = ('nan',)
+_NONE = ('none',)
+
+
+def _key_part(value):
+    if value is None:
+        return _NONE
+    if isinstance(value, bool):
+        return ('bool', value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        value = float(value)
+        return _NAN if math.isnan(value) else value
+    if isinstance(value, str):
+        return value
+    return None
+
+
+def feature_key(features):
+    """Hashable cache key for a feature dict, or None if it cannot be cached"""
+    key = tuple(_key_part(features.get(f, np.nan)) for f in FEATURE_NAMES)
+    return None if None in key else key
+
+
+def key_bytes(key):
+    """Approximate memory held by one cache entry"""
+    return sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key) + 200
+
+
+class PredictionCache:
+    """Thread-safe LRU of positive-class probabilities"""
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, version, key):
+        if key is None:
+            return None
+        with self._lock:
+            proba = self._entries.get((version, key))
+            if proba is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((version, key))
+            self.hits += 1
+            return proba
+
+    def put(self, version, key, proba):
+        if key is None or not self.max_entries:
+            return
+        with self._lock:
+            self._entries[(version, key)] = float(proba)
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put_many(self, version, keys, probas, overwrite=True):
+        """Insert a batch; with overwrite=False existing (recently used) entries win"""
+        with self._lock:
+            for key, proba in zip(keys, probas):
+                if key is None or (not overwrite and (version, key) in self._entries):
+                    continue
+                self._entries[(version, key)] = float(proba)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def describe(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class CacheWarmer:
+    """Preloads a PredictionCache from logged feature vectors in the background"""
+
+    def __init__(self, cache, registry, max_vectors=5000, time_budget=60, memory_budget_mb=50,
+                 max_rows_scanned=200000, batch_size=256, thread_policy=None):
+        """
+        Args:
+            cache: PredictionCache to fill
+            registry: ModelRegistry whose active model scores the vectors
+            max_vectors: Most distinct vectors to score
+            time_budget: Seconds after which warm-up stops, wherever it is
+            memory_budget_mb: Bound on the candidate table built while scanning history
+            max_rows_scanned: Most logged predictions to read
+            batch_size: Rows per model call; small batches keep the GIL
+                free often enough that live requests are not held up
+            thread_policy: ThreadPolicy keeping warm-up single-threaded
+        """
+        self.cache = cache
+        self.registry = registry
+        self.max_vectors = min(max_vectors, cache.max_entries)
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.max_rows_scanned = max_rows_scanned
+        self.batch_size = batch_size
+        self.thread_policy = thread_policy
+        self.status = {'state': 'idle'}
+
+    def start(self, *sources):
+        """Warm from the given iterables of feature dicts (newest first), in a daemon thread"""
+        threading.Thread(target=self._run, args=(sources,), daemon=True).start()
+
+    def _run(self, sources):
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        self.status = {'state': 'scanning', 'started_at': datetime.utcnow().isoformat()}
+        try:
+            candidates, scanned, stop_reason = self._collect(sources, deadline)
+            self.status.update(state='scoring', rows_scanned=scanned, distinct_vectors=len(candidates))
+
+            # Most frequent first, most recent breaking ties
+            ranked = sorted(candidates.items(), key=lambda kv: (-kv[1][0], kv[1][1]))
+            ranked = ranked[:self.max_vectors]
+            scored, version = self._score([features for _, (_, _, features) in ranked],
+                                          [key for key, _ in ranked], deadline)
+            if scored < len(ranked):
+                stop_reason = 'time_budget'
+            self.status.update(
+                state='done',
+                model_version=version,
+                vectors_scored=scored,
+                stopped_by=stop_reason,
+                seconds=round(time.monotonic() - started, 2),
+            )
+            print(f"[cache] Warmed {scored} predictions in {self.status['seconds']}s")
+        except Exception as e:
+            self.status.update(state='failed', error=str(e))
+            print(f"[cache] Warm-up failed: {e}")
+
+    def _collect(self, sources, deadline):
+        """Count distinct vectors: key -> [count, first-seen rank, features]"""
+        candidates = {}
+        memory = 0
+        scanned = 0
+        for source in sources:
+            for features in source:
+                if scanned >= self.max_rows_scanned:
+                    return candidates, scanned, 'row_budget'
+                if scanned % 1000 == 0 and time.monotonic() > deadline:
+                    return candidates, scanned, 'time_budget'
+                scanned += 1
+                # Logs store missing values as null; build_features uses NaN
+                features = {f: np.nan if features.get(f) is None else features[f] for f in FEATURE_NAMES}
+                key = feature_key(features)
+                if key is None:
+                    continue
+                entry = candidates.get(key)
+                if entry is not None:
+                    entry[0] += 1
+                    continue
+                memory += key_bytes(key) * 2  # key plus the features dict kept for scoring
+                if memory > self.memory_budget:
+                    return candidates, scanned, 'memory_budget'
+                candidates[key] = [1, scanned, features]
+            if candidates:
+                # Later sources are fallbacks for when earlier ones are empty
+                break
+        return candidates, scanned, 'exhausted'
+
+    def _score(self, rows, keys, deadline):
+        """Score rows in small vectorized batches; returns (rows scored, model version)
+
+        Rows the model rejects are skipped (and counted in status) rather
+        than ending the warm-up.
+        """
+        scored = 0
+        failed = 0
+        version = None
+        for start in range(0, len(rows), self.batch_size):
+            if time.monotonic() > deadline:
+                break
+            df = pd.DataFrame(rows[start:start + self.batch_size], columns=FEATURE_NAMES)
+            if self.thread_policy is not None:
+                self.thread_policy.use(1)
+            with self.registry.acquire() as active:
+                probas = score_frame(active.model, df)
+            version = active.version
+            good = [(key, proba) for key, proba in zip(keys[start:start + len(df)], probas)
+                    if not isinstance(proba, Exception)]
+            # Live traffic may already have cached some of these; keep those
+            self.cache.put_many(version, [key for key, _ in good], [proba for _, proba in good], overwrite=False)
+            scored += len(df)
+            failed += len(df) - len(good)
+            self.status.update(vectors_scored=scored, vectors_failed=failed)
+        return scored, version
@@ -0,0 +1,338 @@
+"""
+Compact in-memory prediction log
+
+Predictions are stored in a preallocated NumPy structured array used as a
+ring buffer: one fixed-size row per prediction with an epoch timestamp,
+float32 probability, uint8 tier, int32 employee count, the four numeric
+features and interned codes for the categorical features. Numeric values
+that were not sent as numbers ("23,196", "-", "150") are also interned, so
+the log returns them as sent while analytics use the float. Analytics run as
+vectorized masks over column snapshots, and the nested JSON entries the API
+has always returned are only built for rows that are actually sent.
+"""
+
+import math
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from scoring import CATEGORICAL_FEATURES as CATEGORICAL_FIELDS, NUMERIC_FEATURES as NUMERIC_FIELDS, TIERS
+
+FIELD_ORDER = CATEGORICAL_FIELDS + NUMERIC_FIELDS
+MISSING = -1
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+LOG_DTYPE = np.dtype(
+    [('timestamp_us', np.int64),
+     ('probability', np.float32),
+     ('tier', np.uint8),
+     ('employees', np.int32),
+     ('model_version', np.int32),
+     ('numeric', np.float64, len(NUMERIC_FIELDS)),
+     ('numeric_raw', np.int32, len(NUMERIC_FIELDS)),
+     ('categorical', np.int32, len(CATEGORICAL_FIELDS))]
+)
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def to_epoch_us(timestamp):
+    """Microseconds since the epoch for a naive UTC datetime or ISO string"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+
+def from_epoch_us(value):
+    """ISO timestamp for microseconds since the epoch"""
+    return (EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def to_float(value):
+    """Numeric feature value as float, NaN when missing or unparseable"""
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def raw_numeric(value):
+    """A numeric feature value the float column cannot reproduce (e.g. a string), else None"""
+    if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return None
+    return value
+
+
+class CategoryInterner:
+    """Maps category values to small integer codes and back"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return MISSING
+        # Keep 'true' and True (or 1 and '1') distinct, as the encoder does
+        try:
+            key = (type(value), value)
+            hash(key)
+        except TypeError:
+            key = (str, str(value))
+            value = str(value)
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.codes[key] = code
+            self.values.append(value)
+        return code
+
+    def compact(self, live_codes):
+        """Drop values no longer referenced; returns an old->new code lookup array"""
+        remap = np.full(len(self.values) + 1, MISSING, dtype=np.int32)
+        values = []
+        codes = {}
+        for old in np.unique(live_codes):
+            if old == MISSING:
+                continue
+            value = self.values[old]
+            remap[old] = len(values)
+            codes[(type(value), value)] = len(values)
+            values.append(value)
+        self.values = values
+        self.codes = codes
+        return remap
+
+
+class PredictionRingBuffer:
+    """Fixed-capacity, thread-safe log of the most recent predictions"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=LOG_DTYPE)
+        self._lock = threading.Lock()
+        self._appended = 0
+        self._categories = [CategoryInterner() for _ in CATEGORICAL_FIELDS]
+        self._versions = CategoryInterner()
+        self._raw = [CategoryInterner() for _ in NUMERIC_FIELDS]
+        # Interned values are rebuilt from live rows once a table grows past this
+        self._max_categories = 2 * capacity + 1024
+
+    def __len__(self):
+        return min(self._appended, self.capacity)
+
+    @property
+    def total_appended(self):
+        """Number of predictions ever appended (also the next sequence number)"""
+        return self._appended
+
+    def clear(self):
+        with self._lock:
+            self._appended = 0
+            self._categories = [CategoryInterner() for _ in CATEGORICAL_FIELDS]
+            self._versions = CategoryInterner()
+            self._raw = [CategoryInterner() for _ in NUMERIC_FIELDS]
+
+    def append(self, timestamp_us, features, probability, tier, employees, model_version=None):
+        """Add one prediction, overwriting the oldest once the buffer is full; returns its sequence number"""
+        values = [features.get(f) for f in NUMERIC_FIELDS]
+        numeric = [to_float(v) for v in values]
+        tier_code = TIERS.index(tier)
+        employees = to_float(employees)
+        employees = 0 if math.isnan(employees) else int(min(max(employees, 0), INT32_MAX))
+        with self._lock:
+            row = self._data[self._appended % self.capacity]
+            row['timestamp_us'] = timestamp_us
+            row['probability'] = probability
+            row['tier'] = tier_code
+            row['employees'] = employees
+            row['model_version'] = self._versions.code(model_version)
+            row['numeric'] = numeric
+            row['numeric_raw'] = [interner.code(raw_numeric(v)) for interner, v in zip(self._raw, values)]
+            row['categorical'] = [interner.code(features.get(f))
+                                  for interner, f in zip(self._categories, CATEGORICAL_FIELDS)]
+            seq = self._appended
+            self._appended += 1
+            if any(len(interner) > self._max_categories for interner in self._categories + self._raw):
+                self._compact()
+        return seq
+
+    def append_entry(self, entry):
+        """Add an entry in the JSON log format (used when loading saved logs)"""
+        features = entry.get('all_features_used') or {}
+        if not features:
+            request = entry.get('request_from_clay') or {}
+            features = {
+                'Global Employees': request.get('global_employees'),
+                'Eligible Employees': request.get('eligible_employees'),
+                'Industry': request.get('industry'),
+                'Territory': request.get('territory'),
+                'Type': request.get('type'),
+            }
+        response = entry['response']
+        self.append(to_epoch_us(entry['timestamp']), features, response['probability'],
+                    response['tier'], response['employee_count'], response.get('model_version'))
+
+    def _compact(self):
+        used = min(self._appended, self.capacity)
+        for name, interners in (('categorical', self._categories), ('numeric_raw', self._raw)):
+            for i, interner in enumerate(interners):
+                if len(interner) > self._max_categories:
+                    column = self._data[name][:used, i]
+                    remap = interner.compact(column)
+                    self._data[name][:used, i] = remap[column]
+
+    def _indices(self, start_seq, stop_seq):
+        return np.arange(start_seq, stop_seq) % self.capacity
+
+    def seq_range(self):
+        """(oldest, next) sequence numbers currently held"""
+        return max(0, self._appended - self.capacity), self._appended
+
+    def snapshot(self, start_seq=None, limit=None):
+        """Copy rows (oldest first) plus the lookup tables needed to decode them.
+
+        Only the requested rows are copied; the lock is held just long
+        enough to take the copy.
+        """
+        with self._lock:
+            oldest, stop = self.seq_range()
+            start = oldest if start_seq is None else min(max(start_seq, oldest), stop)
+            if limit is not None:
+                stop = min(stop, start + limit)
+            rows = self._data[self._indices(start, stop)]
+            categories = [list(interner.values) for interner in self._categories]
+            versions = list(self._versions.values)
+            raw = [list(interner.values) for interner in self._raw]
+        return start, rows, categories, versions, raw
+
+    def cursor_range(self, since=None, limit=100):
+        """Sequence range [start, stop) of a page of at most `limit` rows.
+
+        Without a cursor this is the newest `limit` rows. With one, the page
+        starts at `since`, or at the oldest row still held when the rows in
+        between have been overwritten; `missed` counts those rows. A cursor
+        beyond the newest row (the log was reset) restarts from the oldest.
+        """
+        oldest, stop = self.seq_range()
+        if since is None:
+            return max(oldest, stop - limit), stop, 0
+        if since > stop:
+            since = oldest
+        start = max(since, oldest)
+        return start, min(stop, start + limit), start - since
+
+    def iter_chunks(self, start_seq, stop_seq, chunk_size=250):
+        """Yield entries (with `seq`) for [start_seq, stop_seq), one small snapshot at a time"""
+        seq = start_seq
+        while seq < stop_seq:
+            start, rows, categories, versions, raw = self.snapshot(seq, min(chunk_size, stop_seq - seq))
+            if not len(rows):
+                return
+            yield self.materialize(rows, categories, versions, raw, start_seq=start)
+            seq = start + len(rows)
+
+    def tail(self, limit):
+        """Snapshot of the most recent `limit` rows"""
+        oldest, stop = self.seq_range()
+        return self.snapshot(start_seq=max(oldest, stop - limit))
+
+    def columns(self, *names):
+        """Chronological copies of the named columns only, for vectorized analytics"""
+        with self._lock:
+            oldest, stop = self.seq_range()
+            if stop - oldest == self.capacity and stop % self.capacity:
+                # Wrapped: the oldest row sits just after the newest
+                split = stop % self.capacity
+                result = {n: np.concatenate([self._data[n][split:], self._data[n][:split]]) for n in names}
+            else:
+                result = {n: self._data[n][:stop - oldest].copy() for n in names}
+        if 'probability' in result:
+            # Probabilities are logged rounded to 4 places; undo float32 noise
+            result['probability'] = np.round(result['probability'].astype(np.float64), 4)
+        return result
+
+    def time_range(self):
+        """ISO timestamps of the oldest and newest entries"""
+        with self._lock:
+            oldest, stop = self.seq_range()
+            if stop == oldest:
+                return None, None
+            first = int(self._data['timestamp_us'][oldest % self.capacity])
+            last = int(self._data['timestamp_us'][(stop - 1) % self.capacity])
+        return from_epoch_us(first), from_epoch_us(last)
+
+    @staticmethod
+    def materialize(rows, categories, versions, raw=None, start_seq=None):
+        """Build JSON log entries for a snapshot of rows
+
+        `raw` holds the interned as-sent values of each numeric field; where
+        a row has one it is returned instead of the parsed float.
+        """
+        # Decode whole columns at once; per-row NumPy scalar access is slow.
+        # A trailing None in each lookup table makes code -1 (MISSING) decode to None.
+        columns = []
+        for j, values in enumerate(categories):
+            decoder = np.empty(len(values) + 1, dtype=object)
+            decoder[:len(values)] = values
+            columns.append(decoder[rows['categorical'][:, j]].tolist())
+        for j in range(len(NUMERIC_FIELDS)):
+            # Whole numbers back to int (as they were sent) and NaN to None
+            values = rows['numeric'][:, j]
+            column = values.astype(object)
+            whole = np.isfinite(values) & (values == np.floor(values))
+            column[whole] = values[whole].astype(np.int64).tolist()
+            column[np.isnan(values)] = None
+            codes = rows['numeric_raw'][:, j]
+            kept = codes != MISSING
+            if raw is not None and kept.any():
+                decoder = np.empty(len(raw[j]), dtype=object)
+                decoder[:] = raw[j]
+                column[kept] = decoder[codes[kept]]
+            columns.append(column.tolist())
+        version_decoder = np.empty(len(versions) + 1, dtype=object)
+        version_decoder[:len(versions)] = versions
+
+        timestamps = rows['timestamp_us'].astype('datetime64[us]').astype(str).tolist()
+        probabilities = np.round(rows['probability'].astype(np.float64), 4).tolist()
+        tiers = np.array(list(TIERS))[rows['tier']].tolist()
+        employees = rows['employees'].tolist()
+        model_versions = version_decoder[rows['model_version']].tolist()
+
+        entries = []
+        for i, values in enumerate(zip(*columns)):
+            features = dict(zip(FIELD_ORDER, values))
+            entry = {
+                'timestamp': timestamps[i],
+                'request_from_clay': {
+                    'global_employees': features['Global Employees'],
+                    'eligible_employees': features['Eligible Employees'],
+                    'industry': features['Industry'],
+                    'territory': features['Territory'],
+                    'type': features['Type']
+                },
+                'all_features_used': features,
+                'response': {
+                    'probability': probabilities[i],
+                    'tier': tiers[i],
+                    'employee_count': employees[i],
+                    'model_version': model_versions[i]
+                }
+            }
+            if start_seq is not None:
+                entry['seq'] = start_seq + i
+            entries.append(entry)
+        return entries
+
+    def entries(self, limit=None):
+        """Most recent `limit` entries (all when None) in the JSON log format"""
+        start, rows, categories, versions, raw = self.tail(limit if limit is not None else self.capacity)
+        return self.materialize(rows, categories, versions, raw)
@@ -0,0 +1,203 @@
+"""
+On-demand profiling of the running worker
+
+Nothing is instrumented until a session is started, so profiling costs
+nothing while it is off. A session runs for a bounded time or number of
+requests and keeps its result until the next one starts. Two modes:
+
+    sample   - a background thread snapshots the stacks of the threads
+               that are serving requests every few milliseconds and counts
+               them as collapsed stacks ("root;frame;frame count"), the
+               input format of flamegraph.pl, speedscope and inferno.
+               Low overhead and safe under real traffic.
+    cprofile - cProfile is enabled in the request thread for the next N
+               requests and the runs are merged into one pstats dump,
+               readable with pstats, snakeviz or flameprof. Exact call
+               counts, but it slows the profiled requests down severalfold.
+
+Each gunicorn worker profiles only itself.
+"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+MODES = ('sample', 'cprofile')
+MAX_SECONDS = 300
+MAX_REQUESTS = 1000
+MAX_STACK_DEPTH = 128
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame, root):
+    """Collapsed stack for a frame, outermost first"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+class Profiler:
+    """One profiling session at a time for this worker"""
+
+    def __init__(self):
+        # Checked by the request hooks; the only cost while profiling is off
+        self.active = False
+        self._lock = threading.Lock()
+        self._session = None
+        self._requests = {}
+        self._stacks = Counter()
+        self._stats = None
+
+    def start(self, mode='sample', seconds=30, requests=None, interval_ms=10, all_threads=False):
+        """Begin a session; returns False if one is already running"""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f'seconds must be between 0 and {MAX_SECONDS}')
+        if requests is not None and not 0 < requests <= MAX_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {MAX_REQUESTS}')
+        if not 1 <= interval_ms <= 1000:
+            raise ValueError('interval_ms must be between 1 and 1000')
+        with self._lock:
+            if self.active:
+                return False
+            self._requests = {}
+            self._stacks = Counter()
+            self._stats = None
+            self._session = {
+                'mode': mode,
+                'pid': os.getpid(),
+                'started_at': datetime.utcnow().isoformat(),
+                'seconds': seconds,
+                'max_requests': requests,
+                'interval_ms': interval_ms if mode == 'sample' else None,
+                'all_threads': all_threads,
+                'requests_seen': 0,
+                'requests_profiled': 0,
+                'samples': 0,
+                'stopped_by': None,
+                '_deadline': time.monotonic() + seconds,
+            }
+            self.active = True
+        if mode == 'sample':
+            threading.Thread(target=self._sample, daemon=True).start()
+        print(f"[profile] Started {mode} profiling for {seconds}s"
+              + (f" or {requests} requests" if requests else ''))
+        return True
+
+    def stop(self, reason='stopped'):
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            self._session['stopped_by'] = reason
+            self._session['finished_at'] = datetime.utcnow().isoformat()
+        print(f"[profile] Profiling finished ({reason})")
+
+    def _check_limits(self):
+        session = self._session
+        if time.monotonic() >= session['_deadline']:
+            self.stop('time_limit')
+        elif session['max_requests'] and session['requests_seen'] >= session['max_requests']:
+            self.stop('request_limit')
+
+    def request_started(self, label):
+        """Called at the start of each request while a session is active"""
+        session = self._session
+        with self._lock:
+            if not self.active:
+                return None
+            if session['max_requests'] and session['requests_seen'] >= session['max_requests']:
+                return None
+            session['requests_seen'] += 1
+            self._requests[threading.get_ident()] = label
+        if session['mode'] != 'cprofile':
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler already owns this interpreter
+            return None
+        return profile
+
+    def request_finished(self, profile):
+        with self._lock:
+            self._requests.pop(threading.get_ident(), None)
+        if profile is not None:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self._session['requests_profiled'] += 1
+        if self.active:
+            self._check_limits()
+
+    def _sample(self):
+        session = self._session
+        interval = session['interval_ms'] / 1000
+        me = threading.get_ident()
+        while self.active:
+            if time.monotonic() >= session['_deadline']:
+                self.stop('time_limit')
+                break
+            frames = sys._current_frames()
+            with self._lock:
+                if session['all_threads']:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    targets = {ident: self._requests.get(ident, names.get(ident, str(ident)))
+                               for ident in frames if ident != me}
+                else:
+                    targets = dict(self._requests)
+                for ident, root in targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks[collapse(frame, root)] += 1
+                        session['samples'] += 1
+            del frames
+            time.sleep(interval)
+
+    def status(self):
+        if self.active:
+            self._check_limits()
+        if self._session is None:
+            return {'state': 'idle'}
+        status = {k: v for k, v in self._session.items() if not k.startswith('_')}
+        status['state'] = 'running' if self.active else 'done'
+        status['formats'] = ['collapsed'] if status['mode'] == 'sample' else ['pstats', 'text']
+        return status
+
+    def collapsed(self):
+        """Collapsed stacks, one "stack count" line each, heaviest first"""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def pstats_dump(self):
+        """Merged cProfile statistics in the marshal format pstats.Stats() loads"""
+        with self._lock:
+            return marshal.dumps(self._stats.stats) if self._stats is not None else None
+
+    def pstats_text(self, sort='cumulative', limit=50):
+        with self._lock:
+            if self._stats is None:
+                return None
+            stream = io.StringIO()
+            self._stats.stream = stream
+            self._stats.sort_stats(sort).print_stats(limit)
+            return stream.getvalue()
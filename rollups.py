@@ -0,0 +1,350 @@
+"""
+Time-bucketed prediction rollups
+
+Each logged prediction increments its per-minute bucket. A bucket is one
+float64 vector:
+
+    [ tier x employee band counts (20) | probability histogram (190) | sum | sum of squares ]
+
+The histogram is the quantile sketch, with fixed bins that buckets merge by
+plain addition. Most probabilities are small, so the bins grow
+geometrically by 5% from 0.001 to 0.2 and are 0.01 wide above that, with
+one bin for [0, 0.001). A quantile read from it (interpolating inside the
+bin) lies in the same bin as the exact value, so it is within 5% of it
+between 0.001 and 0.2, within 0.01 above 0.2 and within 0.001 below 0.001.
+When a minute closes it
+is folded into its hour and day buckets; minutes and hours are dropped
+after their retention period, days are kept. Time-series queries merge
+buckets of the coarsest level that fits the requested interval, so a year
+of trends costs a few hundred vector additions, not a scan of raw entries.
+
+Every worker persists its buckets to its own compressed file under the
+rollup directory and queries read all of them. Files left by workers that
+have exited are adopted (merged and deleted) by a live worker.
+"""
+
+import bisect
+import glob
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from scoring import EMPLOYEE_RANGE_BOUNDS, EMPLOYEE_RANGES, TIERS
+
+LEVELS = {'minute': 60, 'hour': 3600, 'day': 86400}
+DEFAULT_RETENTION = {'minute': 2 * 86400, 'hour': 90 * 86400, 'day': None}
+
+SKETCH_EDGES = np.concatenate([[0.0], np.geomspace(0.001, 0.2, 110), np.linspace(0.21, 1.0, 80)])
+SKETCH_BINS = len(SKETCH_EDGES) - 1
+N_CELLS = len(TIERS) * len(EMPLOYEE_RANGES)
+SUM = N_CELLS + SKETCH_BINS
+SUMSQ = SUM + 1
+WIDTH = SUMSQ + 1
+# Buckets saved before the sketch had variable bins: 100 bins of width 0.01
+LEGACY_WIDTH = N_CELLS + 100 + 2
+
+_EDGES = SKETCH_EDGES.tolist()
+
+_FILE_PATTERN = re.compile(r'rollups-(\d+)-\d+\.npz$')
+
+
+def band_index(employees):
+    try:
+        employees = float(employees)
+    except (TypeError, ValueError):
+        return 0
+    if not employees > 0:  # also NaN, logged as 0 like the history store does
+        return 0
+    return bisect.bisect_right(EMPLOYEE_RANGE_BOUNDS, employees)
+
+
+def sketch_bin(probability):
+    return min(max(bisect.bisect_right(_EDGES, probability) - 1, 0), SKETCH_BINS - 1)
+
+
+def _upgrade(vectors):
+    """Bucket vectors in the current layout; legacy histograms are spread over the new bins by overlap"""
+    if vectors.shape[1] != LEGACY_WIDTH:
+        return vectors
+    old_edges = np.linspace(0.0, 1.0, 101)
+    overlap = (np.minimum(old_edges[1:, None], SKETCH_EDGES[None, 1:])
+               - np.maximum(old_edges[:-1, None], SKETCH_EDGES[None, :-1]))
+    spread = np.clip(overlap, 0.0, None) / 0.01
+    upgraded = np.zeros((len(vectors), WIDTH))
+    upgraded[:, :N_CELLS] = vectors[:, :N_CELLS]
+    upgraded[:, N_CELLS:SUM] = vectors[:, N_CELLS:N_CELLS + 100] @ spread
+    upgraded[:, SUM:] = vectors[:, -2:]
+    return upgraded
+
+
+def quantiles_of(histograms, q):
+    """Quantile q of each row of sketch histograms, interpolated inside the bin (None if empty)"""
+    cumulative = np.cumsum(histograms, axis=1)
+    total = cumulative[:, -1]
+    target = q * total
+    i = np.minimum((cumulative < target[:, None]).sum(axis=1), SKETCH_BINS - 1)
+    rows = np.arange(len(histograms))
+    below = np.where(i > 0, cumulative[rows, i - 1], 0.0)
+    in_bin = histograms[rows, i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.clip(np.where(in_bin > 0, (target - below) / in_bin, 0.0), 0.0, 1.0)
+    values = (SKETCH_EDGES[i] + fraction * (SKETCH_EDGES[i + 1] - SKETCH_EDGES[i])).tolist()
+    return [round(v, 4) if n else None for v, n in zip(values, total.tolist())]
+
+
+def summarize(vectors, quantiles=(0.25, 0.5, 0.75), breakdown=False):
+    """Counts and probability statistics for each row of merged bucket vectors"""
+    vectors = np.atleast_2d(vectors)
+    cells = vectors[:, :N_CELLS].reshape(len(vectors), len(TIERS), len(EMPLOYEE_RANGES))
+    counts = cells.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = vectors[:, SUM] / counts
+        stds = np.sqrt(np.maximum(vectors[:, SUMSQ] / counts - means * means, 0.0))
+    tier_counts = cells.sum(axis=2).astype(int).tolist()
+    band_counts = cells.astype(int).tolist()
+    names = [f'p{round(q * 100):02d}' for q in quantiles]
+    columns = [quantiles_of(vectors[:, N_CELLS:SUM], q) for q in quantiles]
+
+    summaries = []
+    for row, (count, mean, std) in enumerate(zip(counts.astype(int).tolist(), means.tolist(), stds.tolist())):
+        summary = {
+            'count': count,
+            'tiers': dict(zip(TIERS, tier_counts[row])),
+            'mean_probability': round(mean, 4) if count else None,
+            'std_probability': round(std, 4) if count else None,
+            'quantiles': {name: column[row] for name, column in zip(names, columns)},
+        }
+        if breakdown:
+            by_tier = band_counts[row]
+            summary['by_employee_band'] = {
+                band: {tier: by_tier[t][b] for t, tier in enumerate(TIERS)}
+                for b, band in enumerate(EMPLOYEE_RANGES)
+            }
+        summaries.append(summary)
+    return summaries
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RollupStore:
+    """Per-minute rollups folded into hours and days, persisted per worker"""
+
+    def __init__(self, root, flush_interval=60, retention=None):
+        """
+        Args:
+            root: Directory holding one rollup file per worker
+            flush_interval: Seconds between saves of this worker's buckets
+            retention: Seconds each level is kept ({'minute': ..., 'hour': ...});
+                None keeps a level forever
+        """
+        self.root = root
+        self.flush_interval = flush_interval
+        self.retention = dict(DEFAULT_RETENTION, **(retention or {}))
+        self.path = os.path.join(root, f"rollups-{os.getpid()}-{int(time.time() * 1000)}.npz")
+        self._lock = threading.Lock()
+        self._buckets = {level: {} for level in LEVELS}
+        # Minutes before this one are already folded into hours and days
+        self._open_minute = 0
+        self._file_cache = {}
+        self._thread = None
+
+    def start(self):
+        """Adopt files of exited workers and start the background save thread"""
+        os.makedirs(self.root, exist_ok=True)
+        self.adopt_orphans()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.apply_retention()
+                self.save()
+                self.adopt_orphans()
+            except Exception as e:
+                print(f"[rollups] Save error: {e}")
+
+    # -- writing ---------------------------------------------------------
+
+    def _bucket(self, level, start):
+        bucket = self._buckets[level].get(start)
+        if bucket is None:
+            bucket = self._buckets[level][start] = np.zeros(WIDTH)
+        return bucket
+
+    def observe(self, timestamp_us, probability, tier, employees):
+        """Count one prediction in its minute bucket"""
+        seconds = timestamp_us // 1_000_000
+        minute = seconds - seconds % 60
+        cell = TIERS.index(tier) * len(EMPLOYEE_RANGES) + band_index(employees)
+        probability = float(probability)
+        sketch = N_CELLS + sketch_bin(probability)
+        with self._lock:
+            if minute > self._open_minute:
+                self._fold_open_minute()
+                self._open_minute = minute
+            targets = [self._bucket('minute', minute)]
+            if minute < self._open_minute:
+                # Late arrival for a minute that was already folded
+                targets.append(self._bucket('hour', minute - minute % 3600))
+                targets.append(self._bucket('day', minute - minute % 86400))
+            for bucket in targets:
+                bucket[cell] += 1
+                bucket[sketch] += 1
+                bucket[SUM] += probability
+                bucket[SUMSQ] += probability * probability
+
+    def _fold_open_minute(self):
+        bucket = self._buckets['minute'].get(self._open_minute)
+        if bucket is None:
+            return
+        self._bucket('hour', self._open_minute - self._open_minute % 3600)[:] += bucket
+        self._bucket('day', self._open_minute - self._open_minute % 86400)[:] += bucket
+
+    def _snapshot(self, levels=tuple(LEVELS)):
+        """Copy of the given levels with the open minute folded in, as saved to disk"""
+        with self._lock:
+            snapshot = {level: {start: bucket.copy() for start, bucket in self._buckets[level].items()}
+                        for level in levels}
+            open_bucket = self._buckets['minute'].get(self._open_minute)
+            open_bucket = open_bucket.copy() if open_bucket is not None else None
+            open_minute = self._open_minute
+        if open_bucket is not None:
+            for level in set(levels) & {'hour', 'day'}:
+                start = open_minute - open_minute % LEVELS[level]
+                snapshot[level].setdefault(start, np.zeros(WIDTH))[:] += open_bucket
+        return snapshot
+
+    def save(self):
+        snapshot = self._snapshot()
+        arrays = {}
+        for level, buckets in snapshot.items():
+            starts = sorted(buckets)
+            arrays[f'{level}_start'] = np.array(starts, dtype=np.int64)
+            arrays[level] = np.array([buckets[s] for s in starts]).reshape(len(starts), WIDTH)
+        tmp = self.path[:-len('.npz')] + '.tmp.npz'
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+    def apply_retention(self, now=None):
+        now = time.time() if now is None else now
+        current_minute = int(now) - int(now) % 60
+        with self._lock:
+            if self._open_minute < current_minute:
+                # Fold a closed minute even when no traffic has arrived since
+                self._fold_open_minute()
+                self._open_minute = current_minute
+            for level, keep in self.retention.items():
+                if keep is None:
+                    continue
+                cutoff = now - keep
+                buckets = self._buckets[level]
+                for start in [s for s in buckets if s + LEVELS[level] <= cutoff]:
+                    del buckets[start]
+
+    def adopt_orphans(self):
+        """Merge the rollup files of workers that have exited into this one"""
+        adopted = []
+        for path in self._files():
+            pid = int(_FILE_PATTERN.search(path).group(1))
+            if path == self.path or (pid != os.getpid() and _pid_alive(pid)):
+                continue
+            claimed = f"{path}.adopting-{os.getpid()}"
+            try:
+                os.rename(path, claimed)  # only one worker wins the rename
+            except FileNotFoundError:
+                continue
+            levels = self._read(claimed)
+            with self._lock:
+                for level, buckets in levels.items():
+                    for start, bucket in buckets.items():
+                        self._bucket(level, start)[:] += bucket
+                # Their minutes are folded already; don't fold them again
+                if levels['minute']:
+                    self._open_minute = max(self._open_minute, max(levels['minute']) + 60)
+            adopted.append(claimed)
+        if adopted:
+            self.save()
+            for claimed in adopted:
+                os.remove(claimed)
+            print(f"[rollups] Adopted {len(adopted)} rollup file(s) from exited workers")
+
+    # -- reading ---------------------------------------------------------
+
+    def _files(self):
+        return sorted(p for p in glob.glob(os.path.join(self.root, 'rollups-*.npz'))
+                      if _FILE_PATTERN.search(os.path.basename(p)))
+
+    @staticmethod
+    def _read(path):
+        with np.load(path) as npz:
+            return {level: dict(zip(npz[f'{level}_start'].tolist(), _upgrade(npz[level]))) for level in LEVELS}
+
+    def _other_workers(self):
+        """Saved buckets of the other workers, cached by file modification time"""
+        results = []
+        files = self._files()
+        for path in files:
+            if path == self.path:
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+                cached = self._file_cache.get(path)
+                if cached is None or cached[0] != mtime:
+                    cached = self._file_cache[path] = (mtime, self._read(path))
+                results.append(cached[1])
+            except (FileNotFoundError, OSError, ValueError):
+                continue  # adopted or being replaced
+        for path in set(self._file_cache) - set(files):
+            del self._file_cache[path]
+        return results
+
+    def choose_level(self, start, interval, now=None):
+        """Coarsest level whose bucket size divides `interval` and still covers `start`"""
+        now = time.time() if now is None else now
+        for level in ('day', 'hour', 'minute'):
+            keep = self.retention[level]
+            if interval % LEVELS[level] == 0 and (keep is None or start >= now - keep):
+                return level
+        raise ValueError('No rollups at that resolution go back that far; '
+                         f"minute buckets are kept for {self.retention['minute'] // 3600}h and "
+                         f"hour buckets for {self.retention['hour'] // 86400} days")
+
+    def series(self, start, end, interval, level=None):
+        """
+        Merged bucket vectors for each `interval` step in [start, end)
+
+        Args:
+            start, end: Epoch seconds; start is aligned down to the interval
+            interval: Step in seconds, a multiple of 60
+            level: Rollup level to read; chosen from the range when None
+
+        Returns:
+            (level, point start times, matrix of vectors one row per point)
+        """
+        level = level or self.choose_level(start, interval)
+        start -= start % interval
+        n_points = max(int(-(-(end - start) // interval)), 0)
+        points = np.zeros((n_points, WIDTH))
+        for buckets in [self._snapshot((level,))[level]] + [worker[level] for worker in self._other_workers()]:
+            if not buckets:
+                continue
+            starts = np.fromiter(buckets, dtype=np.int64, count=len(buckets))
+            keep = (starts >= start) & (starts < end)
+            if not keep.any():
+                continue
+            rows = np.array([buckets[s] for s in starts[keep].tolist()])
+            np.add.at(points, (starts[keep] - start) // interval, rows)
+        return level, start + np.arange(n_points, dtype=np.int64) * interval, points
@@ -0,0 +1,169 @@
+"""
+Shared scoring helpers for the Tapcheck Prediction API
+
+Kept free of Flask and model-loading side effects so the benchmark suite
+and background workers can import them without starting the app.
+"""
+
+import bisect
+
+import numpy as np
+
+# The model expects these exact column names in this order
+FEATURE_NAMES = [
+    'Territory', 'Industry', 'Billing State/Province', 'Type', 'Vertical',
+    'Are they using a Competitor?', 'Web Technologies', 'Company Payroll Software',
+    'Marketing Source', 'Strategic Account',
+    'Global Employees', 'Eligible Employees', 'Predicted Eligible Employees',
+    'Revenue in Last 30 Days'
+]
+NUMERIC_FEATURES = ['Global Employees', 'Eligible Employees', 'Predicted Eligible Employees',
+                    'Revenue in Last 30 Days']
+CATEGORICAL_FEATURES = [f for f in FEATURE_NAMES if f not in NUMERIC_FEATURES]
+
+# Tiers, best first; logs store a tier as its index here
+TIERS = 'ABCD'
+TIER_DESCRIPTIONS = {'A': 'Top 25%', 'B': 'High', 'C': 'Medium', 'D': 'Low'}
+
+
+def normalize_field_names(data):
+    """Normalize field names to handle both snake_case and Title Case formats"""
+    # Mapping from various formats to expected format
+    field_mappings = {
+        # snake_case to Title Case
+        'global_employees': 'Global Employees',
+        'eligible_employees': 'Eligible Employees',
+        'predicted_eligible_employees': 'Predicted Eligible Employees',
+        'revenue_in_last_30_days': 'Revenue in Last 30 Days',
+        'territory': 'Territory',
+        'industry': 'Industry',
+        'billing_state_province': 'Billing State/Province',
+        'type': 'Type',
+        'vertical': 'Vertical',
+        'are_they_using_a_competitor': 'Are they using a Competitor?',
+        'web_technologies': 'Web Technologies',
+        'company_payroll_software': 'Company Payroll Software',
+        'marketing_source': 'Marketing Source',
+        'strategic_account': 'Strategic Account',
+        # Also handle exact matches (case-insensitive)
+        'billing state/province': 'Billing State/Province',
+        'are they using a competitor?': 'Are they using a Competitor?',
+    }
+    
+    # Create normalized data dictionary
+    normalized = {}
+    
+    # First, copy over any fields that are already in the correct format
+    for key, value in data.items():
+        normalized[key] = value
+    
+    # Then, check for fields that need to be mapped
+    for key, value in data.items():
+        # Check direct mapping (case-insensitive)
+        lower_key = key.lower()
+        if lower_key in field_mappings:
+            correct_key = field_mappings[lower_key]
+            normalized[correct_key] = value
+        # Also handle case where it's already correct but different case
+        elif key.lower() in [k.lower() for k in field_mappings.values()]:
+            # Find the correct casing
+            for correct_key in field_mappings.values():
+                if key.lower() == correct_key.lower():
+                    normalized[correct_key] = value
+                    break
+    
+    return normalized
+
+
+def build_features(data):
+    """Create raw feature dict - handle missing fields like pandas CSV reader"""
+    features = {}
+    for feature in FEATURE_NAMES:
+        if feature in data:
+            value = data[feature]
+            # Treat empty strings as NaN (like pandas does with CSV)
+            if isinstance(value, str) and value.strip() == "":
+                features[feature] = np.nan
+            else:
+                features[feature] = value
+        else:
+            # Missing fields become NaN, just like pandas reads empty CSV cells
+            features[feature] = np.nan
+    return features
+
+
+def _as_count(value):
+    """A quoted employee count ("150", "23,196") as a number; other strings count as absent"""
+    if not isinstance(value, str):
+        return value
+    try:
+        value = float(value.replace(',', '').strip())
+    except ValueError:
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def get_employee_count(features):
+    """Determine employee count for tier assignment"""
+    eligible = _as_count(features.get('Eligible Employees'))
+    global_emp = _as_count(features.get('Global Employees'))
+    
+    # Use eligible if available and not None/0, otherwise use global
+    if eligible and eligible > 0:
+        return eligible
+    elif global_emp and global_emp > 0:
+        return global_emp
+    return 0
+
+
+def score_frame(model, df):
+    """
+    Positive-class probabilities for a model-ready DataFrame
+
+    One malformed row fails the whole frame, so a failing frame is split in
+    half and each half scored again until the bad rows are isolated. They
+    come back as the exception; every other row is still scored in
+    vectorized calls, about 2*log2(n) extra calls per bad row rather than
+    one call per row.
+
+    Categorical columns are passed as object dtype. A column with no values
+    in this frame would otherwise be float, and the imputer's 'missing'
+    fill fails on it, so a row's result would depend on the rest of the
+    batch.
+    """
+    cast = {f: object for f in CATEGORICAL_FEATURES if f in df and df[f].dtype != object}
+    if cast:
+        df = df.astype(cast)
+    try:
+        return model.predict_proba(df)[:, 1]
+    except Exception as e:
+        if len(df) == 1:
+            return [e]
+        middle = len(df) // 2
+        return list(score_frame(model, df.iloc[:middle])) + list(score_frame(model, df.iloc[middle:]))
+
+
+def assign_tier(proba, employees):
+    """Assign a tier from the probability using per-size-band thresholds"""
+    # Updated thresholds based on 120,195 accounts (July 14, 2025)
+    if employees >= 3000:
+        return 'A' if proba > 0.1237 else 'B' if proba > 0.0534 else 'C' if proba > 0.0419 else 'D'
+    elif employees >= 1000:
+        return 'A' if proba > 0.0825 else 'B' if proba > 0.0499 else 'C' if proba > 0.0117 else 'D'
+    elif employees >= 300:
+        return 'A' if proba > 0.1296 else 'B' if proba > 0.0552 else 'C' if proba > 0.0334 else 'D'
+    elif employees >= 100:
+        return 'A' if proba > 0.2002 else 'B' if proba > 0.0865 else 'C' if proba > 0.0534 else 'D'
+    else:
+        return 'A' if proba > 0.2638 else 'B' if proba > 0.1307 else 'C' if proba > 0.0577 else 'D'
+
+
+# Employee-count bands used for tiering and analytics, smallest first
+EMPLOYEE_RANGES = ['<100', '100-299', '300-999', '1000-2999', '>=3000']
+# Lowest employee count of each band after the first
+EMPLOYEE_RANGE_BOUNDS = [100, 300, 1000, 3000]
+
+
+def get_employee_range(emp_count):
+    """Name of the employee band an employee count falls into"""
+    return EMPLOYEE_RANGES[bisect.bisect_right(EMPLOYEE_RANGE_BOUNDS, emp_count)]
@@ -0,0 +1,173 @@
+"""
+Binary wire formats for the scoring endpoints
+
+JSON stays the default. High-volume callers can skip JSON encoding and
+decoding by sending and accepting:
+
+    application/msgpack                    /predict and /predict-batch
+    application/vnd.apache.arrow.stream    /predict-batch, one row per account
+
+An Arrow batch is turned into the model's DataFrame column by column, with
+no per-account dicts on the way in. The results come back as one Arrow
+record batch. Both libraries are optional: without them the formats are
+simply not offered, and a request in them is rejected with 415.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+from scoring import FEATURE_NAMES
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+# Content types accepted on requests, by the format they are read as
+REQUEST_TYPES = {
+    'application/msgpack': MSGPACK,
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+    'application/vnd.apache.arrow.stream': ARROW,
+    'application/vnd.apache.arrow.file': ARROW,
+}
+
+REQUIRED_PACKAGE = {MSGPACK: 'msgpack', ARROW: 'pyarrow'}
+
+
+class WireFormatError(ValueError):
+    """A request body that can't be read: 415 for unsupported formats, 400 for malformed ones"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def available(fmt):
+    if fmt == MSGPACK:
+        return msgpack is not None
+    if fmt == ARROW:
+        return pa is not None
+    return fmt == JSON
+
+
+def request_format(content_type, allowed):
+    """Wire format of a request body from its Content-Type; JSON when unrecognised"""
+    fmt = REQUEST_TYPES.get((content_type or '').split(';')[0].strip().lower(), JSON)
+    if fmt not in allowed:
+        raise WireFormatError(f'{fmt} is not accepted by this endpoint', 415)
+    if not available(fmt):
+        raise WireFormatError(f'{fmt} needs the {REQUIRED_PACKAGE[fmt]} package on the server', 415)
+    return fmt
+
+
+def response_format(accept, request_fmt, allowed):
+    """
+    Negotiate the response format from the Accept header
+
+    The request's own format is preferred when the client accepts anything.
+    Clients that only accept unsupported types still get JSON, as before.
+    """
+    offered = [request_fmt] + [fmt for fmt in allowed if fmt != request_fmt and available(fmt)]
+    if not accept:
+        return request_fmt
+    return accept.best_match(offered) or JSON
+
+
+def _plain(value):
+    """msgpack fallback for NumPy scalars"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Cannot serialize {type(value).__name__}')
+
+
+def pack(obj):
+    return msgpack.packb(obj, default=_plain, use_bin_type=True)
+
+
+def unpack(body):
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise WireFormatError(f'Invalid MessagePack body: {e or type(e).__name__}')
+
+
+def read_arrow(body):
+    """Read an Arrow IPC stream (or file) body into a Table"""
+    try:
+        if body[:6] == b'ARROW1':
+            return pa.ipc.open_file(pa.py_buffer(body)).read_all()
+        return pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except Exception as e:
+        raise WireFormatError(f'Invalid Arrow IPC body: {e}')
+
+
+def arrow_features(table, normalize_field_names):
+    """
+    Model-ready DataFrame for an Arrow batch
+
+    Mirrors build_features for absent fields: missing columns, nulls and
+    blank strings all become NaN (Arrow can't tell an absent field from a
+    null one). Numeric columns are converted without copying when they
+    have no nulls.
+    """
+    columns = normalize_field_names({name: table.column(name) for name in table.column_names})
+    frame = {}
+    for feature in FEATURE_NAMES:
+        column = columns.get(feature)
+        if column is None:
+            frame[feature] = np.full(table.num_rows, np.nan)
+            continue
+        if pa.types.is_dictionary(column.type):
+            # Categorical columns from pandas; the model expects plain values
+            column = column.cast(column.type.value_type)
+        values = column.to_numpy()
+        if values.dtype == object:
+            missing = column.is_null()
+            if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+                missing = pc.or_kleene(missing, pc.equal(pc.utf8_trim_whitespace(column), ''))
+            missing = pc.fill_null(missing, True).to_numpy()
+            if missing.any():
+                values[missing] = np.nan
+        frame[feature] = values
+    # Already in FEATURE_NAMES order; passing columns= would make pandas reindex
+    return pd.DataFrame(frame)
+
+
+def feature_dicts(frame):
+    """Per-account feature dicts of a batch frame, as build_features would return them"""
+    columns = [frame[feature].tolist() for feature in FEATURE_NAMES]
+    return [dict(zip(FEATURE_NAMES, values)) for values in zip(*columns)]
+
+
+ARROW_RESULT_SCHEMA = None if pa is None else pa.schema([
+    ('probability_closed_won', pa.float64()),
+    ('tier', pa.string()),
+    ('tier_description', pa.string()),
+    ('employee_count', pa.int64()),
+    ('explanation', pa.list_(pa.string())),
+    ('model_version', pa.string()),
+    ('status', pa.string()),
+    ('error', pa.string()),
+])
+
+
+def arrow_results(results, metadata=None):
+    """One Arrow IPC stream with a row per batch result"""
+    columns = {field.name: [r.get(field.name) for r in results] for field in ARROW_RESULT_SCHEMA}
+    schema = ARROW_RESULT_SCHEMA.with_metadata({k: str(v) for k, v in (metadata or {}).items()})
+    table = pa.Table.from_pydict(columns, schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
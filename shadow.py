@@ -0,0 +1,277 @@
+"""
+Shadow scoring of a candidate model off the request path
+
+/predict answers with the primary model and only enqueues the feature row.
+A background thread drains the queue in batches, scores them with the
+candidate model and accumulates agreement statistics. The queue is bounded:
+when it is full, new rows are dropped rather than slowing requests down.
+
+Which candidate to shadow is shared between gunicorn workers through a
+pointer file, the way the model registry shares promotions: the admin
+endpoints write or remove it and every worker polls it. Statistics are
+kept per worker, over the traffic that worker served.
+"""
+
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+from scoring import EMPLOYEE_RANGES, FEATURE_NAMES, TIERS, assign_tier, get_employee_range, score_frame
+
+
+class ShadowScorer:
+    """Scores sampled live traffic with a candidate model in the background"""
+
+    def __init__(self, queue_size=2000, batch_size=64, flush_interval=0.5, recent_size=1000, thread_policy=None,
+                 pointer_file=None):
+        self.batch_size = batch_size
+        self.pointer_file = pointer_file
+        self._pointer_key = None
+        self._sync_lock = threading.Lock()
+        self.thread_policy = thread_policy
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.candidate = None
+        self.sample_rate = 1.0
+        self.started_at = None
+        # Bumped on every start, so rows queued for an earlier candidate are never
+        # scored or counted under a later one
+        self._session = 0
+        self._recent = deque(maxlen=recent_size)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.submitted = 0
+        self.dropped = 0
+        self.scored = 0
+        self.failed_batches = 0
+        self.failed_rows = 0
+        self.last_error = None
+        self.flips = {p: {c: 0 for c in TIERS} for p in TIERS}
+        self.bands = {band: {'count': 0, 'agree': 0, 'delta_sum': 0.0,
+                             'abs_delta_sum': 0.0, 'max_abs_delta': 0.0}
+                      for band in EMPLOYEE_RANGES}
+        self._recent.clear()
+
+    @property
+    def enabled(self):
+        return self.candidate is not None
+
+    def start(self, candidate, sample_rate=1.0):
+        """Begin shadowing traffic with a loaded candidate model version"""
+        with self._lock:
+            self.candidate = candidate
+            self.sample_rate = sample_rate
+            self.started_at = datetime.utcnow().isoformat()
+            self._session += 1
+            self._reset_stats()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        print(f"[shadow] Shadow scoring with {candidate.version} (sample rate {sample_rate})")
+
+    def stop(self):
+        """Stop shadowing; queued rows are discarded and statistics kept"""
+        with self._lock:
+            self.candidate = None
+            self._session += 1
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    # -- sharing the candidate between workers ------------------------------
+
+    def publish(self, path, version=None, sample_rate=1.0):
+        """Ask every worker to shadow the model at `path`"""
+        tmp = f"{self.pointer_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'path': path, 'version': version, 'sample_rate': sample_rate,
+                       'requested_at': datetime.utcnow().isoformat()}, f)
+        os.replace(tmp, self.pointer_file)
+
+    def retract(self):
+        """Ask every worker to stop shadowing"""
+        try:
+            os.remove(self.pointer_file)
+        except FileNotFoundError:
+            pass
+
+    def _read_pointer(self):
+        try:
+            with open(self.pointer_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def sync(self, load):
+        """Start or stop shadowing to match the pointer file; `load(path, version)` reads a candidate"""
+        with self._sync_lock:
+            try:
+                pointer = self._read_pointer()
+            except Exception as e:
+                print(f"[shadow] Could not read shadow pointer {self.pointer_file}: {e}")
+                return
+            key = pointer and pointer.get('requested_at')
+            if key == self._pointer_key:
+                return
+            self._pointer_key = key
+            if pointer is None:
+                if self.candidate is not None:
+                    self.stop()
+                    print("[shadow] Stopped")
+                return
+            try:
+                candidate = load(pointer['path'], pointer.get('version'))
+            except Exception as e:
+                print(f"[shadow] Could not load candidate {pointer['path']}: {e}")
+                self.last_error = str(e)
+                return
+            self.start(candidate, pointer.get('sample_rate', 1.0))
+
+    def watch_pointer(self, load, interval=10):
+        """Follow the pointer file in the background, starting with its current state"""
+        def run():
+            while True:
+                self.sync(load)
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # -- scoring --------------------------------------------------------------
+
+    def submit(self, features, primary_proba, primary_tier, employees, primary_version=None):
+        """Queue a scored row for the candidate. Never blocks; returns False if dropped."""
+        if self.candidate is None:
+            return False
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            session = self._session
+            self.submitted += 1
+        try:
+            self._queue.put_nowait((session, features, primary_proba, primary_tier, employees, primary_version))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _next_batch(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            with self._lock:
+                candidate = self.candidate
+                session = self._session
+            items = [item for item in items if item[0] == session]
+            if candidate is None or not items:
+                continue
+            try:
+                df = pd.DataFrame([item[1] for item in items], columns=FEATURE_NAMES)
+                if self.thread_policy is not None:
+                    # Background scoring never takes cores from requests
+                    self.thread_policy.use(1)
+                # Rows the candidate rejects come back as exceptions; the rest still count
+                probas = score_frame(candidate.model, df)
+            except Exception as e:
+                with self._lock:
+                    if session == self._session:
+                        self.failed_batches += 1
+                        self.last_error = str(e)
+                print(f"[shadow] Candidate scoring failed: {e}")
+                continue
+            self._record(session, items, probas, candidate.version)
+
+    def _record(self, session, items, probas, candidate_version):
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            if session != self._session:
+                # Restarted or stopped while this batch was being scored
+                return
+            for (_, features, primary_proba, primary_tier, employees, primary_version), proba in zip(items, probas):
+                if isinstance(proba, Exception):
+                    self.failed_rows += 1
+                    self.last_error = str(proba)
+                    continue
+                proba = float(proba)
+                candidate_tier = assign_tier(proba, employees)
+                band = get_employee_range(employees)
+                delta = proba - primary_proba
+                stats = self.bands[band]
+                stats['count'] += 1
+                stats['agree'] += candidate_tier == primary_tier
+                stats['delta_sum'] += delta
+                stats['abs_delta_sum'] += abs(delta)
+                stats['max_abs_delta'] = max(stats['max_abs_delta'], abs(delta))
+                self.flips[primary_tier][candidate_tier] += 1
+                self.scored += 1
+                self._recent.append({
+                    'timestamp': now,
+                    'employee_count': int(employees),
+                    'employee_range': band,
+                    'primary': {'version': primary_version,
+                                'probability': round(primary_proba, 4), 'tier': primary_tier},
+                    'candidate': {'version': candidate_version,
+                                  'probability': round(proba, 4), 'tier': candidate_tier},
+                })
+
+    def report(self, recent=0):
+        """Agreement rate, tier flip matrix and probability deltas per employee band"""
+        with self._lock:
+            agree = sum(self.flips[t][t] for t in TIERS)
+            by_range = {}
+            for band, stats in self.bands.items():
+                n = stats['count']
+                if not n:
+                    continue
+                by_range[band] = {
+                    'count': n,
+                    'agreement_rate': round(stats['agree'] / n, 4),
+                    'mean_delta': round(stats['delta_sum'] / n, 4),
+                    'mean_abs_delta': round(stats['abs_delta_sum'] / n, 4),
+                    'max_abs_delta': round(stats['max_abs_delta'], 4),
+                }
+            return {
+                'pid': os.getpid(),
+                'enabled': self.enabled,
+                'candidate_version': self.candidate.version if self.candidate else None,
+                'started_at': self.started_at,
+                'sample_rate': self.sample_rate,
+                'queue': {
+                    'depth': self._queue.qsize(),
+                    'capacity': self._queue.maxsize,
+                    'submitted': self.submitted,
+                    'dropped': self.dropped,
+                    'failed_batches': self.failed_batches,
+                    'failed_rows': self.failed_rows,
+                    'last_error': self.last_error,
+                },
+                'scored': self.scored,
+                'agreement_rate': round(agree / self.scored, 4) if self.scored else None,
+                'tier_flip_matrix': self.flips,
+                'by_employee_range': by_range,
+                'recent': list(self._recent)[-recent:] if recent else [],
+            }